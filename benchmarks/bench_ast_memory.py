@@ -0,0 +1,77 @@
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from lexer import lex
+from parser import parse
+
+FUNCTION_TEMPLATE = """step_{i}: fn(a: i32, b: i32) -> i32 {{
+    total: i32 = a * {i} + b % 7 - (a + b) / 3;
+    count: i32 = 0;
+    while (count < b && total != {i}) {{
+        if (count % 2 == 0) {{
+            total = total + count * 2;
+        }} else if (count > 10) {{
+            total = total - 1;
+        }} else {{
+            echo("odd " ++ "step");
+        }}
+        count = count + 1;
+    }}
+    return total + step_helper_{i}(count, -a);
+}}
+
+step_helper_{i}: fn(x: i32, y: i32) -> i32 {{
+    flag: bool = !(x >= y) || x <= {i};
+    return x - y;
+}}
+
+"""
+
+def generate_program(functions):
+    return "".join(FUNCTION_TEMPLATE.format(i=i) for i in range(functions))
+
+def count_nodes(node):
+    count = 0
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if node is None or isinstance(node, (str, int, float, bool, list, tuple)):
+            continue
+
+        count += 1
+        for name in ("children", "body", "value", "lhs", "rhs", "stmt", "expr", "condition", "else_branch", "arguments", "op"):
+            child = getattr(node, name, None)
+            if isinstance(child, list):
+                stack.extend(child)
+            elif child is not None and hasattr(child, "kind"):
+                stack.append(child)
+
+    return count
+
+def main(argv):
+    arg_parser = argparse.ArgumentParser(description="measure the memory taken by a parsed program")
+    arg_parser.add_argument("--functions", type=int, default=5000, help="number of generated function pairs")
+    args = arg_parser.parse_args(argv)
+
+    src = generate_program(args.functions)
+    tokens = lex(src)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    root = parse(tokens)
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    nodes = count_nodes(root)
+    print(f"source: {len(src) / (1024 * 1024):.2f} MB, {len(tokens)} tokens, {nodes} nodes")
+    print(f"parse: {elapsed:.3f}s")
+    print(f"ast memory: {current / (1024 * 1024):.1f} MB, {current / nodes:.0f} bytes/node")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,63 @@
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from lexer import lex
+from parser import parse
+from interpreter import DEFAULT_YIELD_STEPS, Interpreter, interpret_async
+from output import MemorySink
+from run_benchmarks import load_programs
+
+async def measure(programs, copies, yield_every):
+    # how long the whole set takes, and the longest the loop went without
+    # getting to another task while it ran
+    gaps = []
+    running = True
+
+    async def ticker():
+        last = time.perf_counter()
+        while running:
+            await asyncio.sleep(0)
+            now = time.perf_counter()
+            gaps.append(now - last)
+            last = now
+
+    ticks = asyncio.create_task(ticker())
+    start = time.perf_counter()
+    await asyncio.gather(*(interpret_async(program, output=MemorySink(), yield_every=yield_every)
+                           for program in programs for _ in range(copies)))
+    elapsed = time.perf_counter() - start
+
+    running = False
+    await ticks
+    return elapsed, max(gaps)
+
+def main(argv):
+    arg_parser = argparse.ArgumentParser(description="measure throughput and event loop latency of cooperative runs")
+    arg_parser.add_argument("programs", nargs="*", help="program names to run, all by default")
+    arg_parser.add_argument("--copies", type=int, default=4, help="concurrent runs of each program")
+    arg_parser.add_argument("--yield-every", type=int, nargs="*", default=[10, DEFAULT_YIELD_STEPS, 1000])
+    args = arg_parser.parse_args(argv)
+
+    sources = load_programs(args.programs)
+    programs = [Interpreter(parse(lex(src))).compile_program() for src in sources.values()]
+
+    start = time.perf_counter()
+    for program in programs:
+        for _ in range(args.copies):
+            program.run(output=MemorySink())
+
+    blocking = time.perf_counter() - start
+    print(f"{'mode':<22} {'elapsed':>10} {'max loop gap':>13}")
+    print(f"{'blocking':<22} {blocking:9.3f}s {blocking * 1000:11.2f}ms")
+
+    for yield_every in args.yield_every:
+        elapsed, gap = asyncio.run(measure(programs, args.copies, yield_every))
+        print(f"{f'yield every {yield_every}':<22} {elapsed:9.3f}s {gap * 1000:11.2f}ms")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,46 @@
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from batch import STATUS_OK, run_batch
+
+PROGRAMS_DIR = os.path.join(os.path.dirname(__file__), "programs")
+
+def job_counts(limit):
+    jobs = 1
+    while jobs < limit:
+        yield jobs
+        jobs *= 2
+
+    yield limit
+
+def main(argv):
+    arg_parser = argparse.ArgumentParser(description="measure batch throughput as worker processes are added")
+    arg_parser.add_argument("--rounds", type=int, default=4, help="how many times each benchmark program is listed")
+    arg_parser.add_argument("--max-jobs", type=int, default=os.cpu_count() or 1)
+    arg_parser.add_argument("--engine", choices=["vm", "tree", "closure", "python"], default="vm")
+    args = arg_parser.parse_args(argv)
+
+    programs = sorted(os.path.join(PROGRAMS_DIR, name) for name in os.listdir(PROGRAMS_DIR) if name.endswith(".qk"))
+    scripts = programs * args.rounds
+
+    print(f"{'jobs':>6} {'elapsed':>10} {'scripts/s':>10} {'speedup':>8}")
+    baseline = None
+    for jobs in job_counts(args.max_jobs):
+        start = time.perf_counter()
+        results = list(run_batch(scripts, jobs, args.engine, use_cache=False))
+        elapsed = time.perf_counter() - start
+
+        failed = [result.path for result in results if result.status != STATUS_OK]
+        if failed:
+            print(f"failed: {', '.join(failed)}", file=sys.stderr)
+            sys.exit(1)
+
+        baseline = baseline or elapsed
+        print(f"{jobs:>6} {elapsed:9.3f}s {len(scripts) / elapsed:10.1f} {baseline / elapsed:7.2f}x")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,89 @@
+import gc
+import io
+import os
+import sys
+import time
+import argparse
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from lexer import lex
+from parser import parse
+from qast import Frame, FramePool
+from interpreter import Interpreter
+from run_benchmarks import load_programs
+
+def prepared(tokens):
+    interpreter = Interpreter(parse(tokens))
+    interpreter.prepare()
+    return interpreter
+
+def time_plain(tokens):
+    # the evaluation path as it was before hooks existed
+    root = prepared(tokens).root
+    frame = Frame(root.frame_size, None, FramePool())
+
+    start = time.perf_counter()
+    root.evaluate(frame)
+    return time.perf_counter() - start
+
+def time_disabled(tokens):
+    interpreter = prepared(tokens)
+
+    start = time.perf_counter()
+    interpreter.evaluate_tree()
+    return time.perf_counter() - start
+
+def time_enabled(tokens):
+    interpreter = prepared(tokens)
+    counter = [0]
+
+    def count(*args):
+        counter[0] += 1
+
+    interpreter.add_hook("on_statement", count)
+
+    start = time.perf_counter()
+    interpreter.evaluate_tree()
+    return time.perf_counter() - start
+
+def main(argv):
+    arg_parser = argparse.ArgumentParser(description="measure what interpreter hooks cost on the tree engine")
+    arg_parser.add_argument("programs", nargs="*", help="program names to run, all by default")
+    arg_parser.add_argument("--repeat", type=int, default=7, help="runs per variant, the best one is kept")
+    args = arg_parser.parse_args(argv)
+
+    print(f"{'program':<14} {'plain':>10} {'plain again':>12} {'no hooks':>10} {'overhead':>9} {'noise':>7} {'1 hook':>10}")
+    within_noise = True
+
+    for name, src in load_programs(args.programs).items():
+        tokens = lex(src)
+        variants = [("plain", time_plain), ("disabled", time_disabled), ("again", time_plain), ("enabled", time_enabled)]
+        times = {variant: [] for variant, _ in variants}
+
+        # interleaved and rotated, so drift in machine speed hits every variant alike
+        with contextlib.redirect_stdout(io.StringIO()):
+            for i in range(args.repeat):
+                for variant, measure in variants[i % 4:] + variants[:i % 4]:
+                    gc.collect()
+                    times[variant].append(measure(tokens))
+
+        best = {variant: min(samples) for variant, samples in times.items()}
+
+        # the plain path is measured twice as often, how far its typical run is
+        # from its best one is what identical code varies by on this machine
+        plain = sorted(times["plain"] + times["again"])
+        noise = plain[len(plain) // 2] / plain[0] - 1
+        overhead = best["disabled"] / plain[0] - 1
+        if overhead > max(noise, 0.01):
+            within_noise = False
+
+        print(f"{name:<14} {best['plain'] * 1000:8.2f}ms {best['again'] * 1000:10.2f}ms {best['disabled'] * 1000:8.2f}ms "
+              f"{overhead:+8.1%} {noise:6.1%} {best['enabled'] * 1000:8.2f}ms")
+
+    print("disabled hooks are within noise" if within_noise else "disabled hooks cost more than the noise")
+    return 0 if within_noise else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,68 @@
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from lexer import Lexer, RegexLexer
+
+SNIPPET = """add: fn(a: i32, b: i32) -> i32 {
+    return a + b;
+}
+
+counter: i32 = 0;
+ratio: f32 = 1.25;
+name: string = "qwrk";
+done: bool = false;
+
+while (counter < 100 && !done) {
+    counter = add(counter, 1);
+    if (counter % 10 == 0) {
+        echo(name ++ " tick");
+    } else if (counter >= 95) {
+        done = true;
+    }
+}
+"""
+
+def generate_source(size):
+    copies = size // len(SNIPPET) + 1
+    return SNIPPET * copies
+
+def time_lexer(lexer_class, src, repeat):
+    best = None
+    tokens = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        tokens = lexer_class(src).tokenize()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return tokens, best
+
+def main(argv):
+    arg_parser = argparse.ArgumentParser(description="compare the table driven lexer with the original one")
+    arg_parser.add_argument("--size", type=float, default=2.0, help="source size in megabytes")
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    args = arg_parser.parse_args(argv)
+
+    src = generate_source(int(args.size * 1024 * 1024))
+    print(f"source: {len(src) / (1024 * 1024):.2f} MB")
+
+    results = {}
+    times = {}
+    for lexer_class in (Lexer, RegexLexer):
+        tokens, elapsed = time_lexer(lexer_class, src, args.repeat)
+        results[lexer_class.__name__] = tokens
+        times[lexer_class.__name__] = elapsed
+        print(f"{lexer_class.__name__:>12}: {elapsed:.3f}s  {len(tokens) / elapsed:,.0f} tokens/s")
+
+    print(f"RegexLexer is {times['Lexer'] / times['RegexLexer']:.2f}x as fast as Lexer")
+
+    expected = [(t.kind, t.value, t.line, t.column) for t in results["Lexer"]]
+    actual = [(t.kind, t.value, t.line, t.column) for t in results["RegexLexer"]]
+    print("token streams match" if expected == actual else "TOKEN STREAMS DIFFER")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,56 @@
+import gc
+import os
+import sys
+import time
+import statistics
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from lexer import lex
+from parser import parse
+from interpreter import Interpreter
+from output import MemorySink
+from run_benchmarks import load_programs
+
+# large enough that no benchmark program runs into them
+GENEROUS = {"max_steps": 10 ** 12, "max_depth": 10 ** 6, "max_string": 10 ** 12}
+
+def time_run(src, engine, limited):
+    interpreter = Interpreter(parse(lex(src)), MemorySink())
+    if limited:
+        interpreter.set_limits(**GENEROUS)
+
+    start = time.process_time()
+    interpreter.run(engine)
+    return time.process_time() - start
+
+def main(argv):
+    arg_parser = argparse.ArgumentParser(description="measure what enforcing execution limits costs")
+    arg_parser.add_argument("programs", nargs="*", help="program names to run, all by default")
+    arg_parser.add_argument("--engine", choices=["vm", "tree"], default="vm")
+    arg_parser.add_argument("--repeat", type=int, default=15, help="runs per variant, the best one is kept")
+    args = arg_parser.parse_args(argv)
+
+    print(f"{'program':<14} {'unlimited':>10} {'limited':>10} {'overhead':>9}")
+    for name, src in load_programs(args.programs).items():
+        times = {False: [], True: []}
+
+        # interleaved, so drift in machine speed hits both alike
+        for _ in range(args.repeat):
+            for limited in (False, True):
+                gc.collect()
+                times[limited].append(time_run(src, args.engine, limited))
+
+        # the median of each pair's ratio, a single slow run moves it less than it moves the best times
+        unlimited = min(times[False])
+        limited = min(times[True])
+        overhead = statistics.median(b / a for a, b in zip(times[False], times[True])) - 1
+        print(f"{name:<14} {unlimited * 1000:8.2f}ms {limited * 1000:8.2f}ms {overhead:+8.1%}")
+
+    if args.engine == "tree":
+        # every metered call still updates two counters in the closure, the vm keeps them in locals
+        print("note: the tree engine misses the few percent budget on call heavy programs (calls, fib), expect 4-7%")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,64 @@
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from lexer import lex
+from parser import parse
+from interpreter import Interpreter
+from output import MemorySink
+
+SOURCE = """
+total: i32 = 0;
+i: i32 = 0;
+while (i < n) {
+    total = total + i * step;
+    i = i + 1;
+}
+echo(label);
+echo(total);
+"""
+
+INPUTS = {"n": "i32", "step": "i32", "label": "string"}
+
+def compile_each_run(values):
+    output = MemorySink()
+    source = "".join(f"{name}: {INPUTS[name]} = {value!r};\n".replace("'", '"') for name, value in values.items()) + SOURCE
+    Interpreter(parse(lex(source)), output).run("vm")
+    return output.getvalue()
+
+def main(argv):
+    arg_parser = argparse.ArgumentParser(description="compare compiling per run with running one compiled Program")
+    arg_parser.add_argument("--runs", type=int, default=2000)
+    arg_parser.add_argument("--threads", type=int, default=4)
+    args = arg_parser.parse_args(argv)
+
+    runs = [{"n": 20, "step": index, "label": f"run {index}"} for index in range(args.runs)]
+
+    start = time.perf_counter()
+    expected = [compile_each_run(values) for values in runs]
+    print(f"compile per run:     {time.perf_counter() - start:8.3f}s")
+
+    program = Interpreter(parse(lex(SOURCE))).compile_program(INPUTS)
+
+    def run_program(values):
+        output = MemorySink()
+        program.run(values, output)
+        return output.getvalue()
+
+    start = time.perf_counter()
+    results = [run_program(values) for values in runs]
+    print(f"program.run:         {time.perf_counter() - start:8.3f}s")
+    assert results == expected
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        results = list(executor.map(run_program, runs))
+    print(f"program.run threads: {time.perf_counter() - start:8.3f}s ({args.threads} threads)")
+    assert results == expected
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,48 @@
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from repl import ReplSession
+from output import MemorySink
+
+ENTRY_TEMPLATES = (
+    "v_{i}: i32 = {i} * 2;",
+    "f_{i}: fn(a: i32) -> i32 {{ return a + v_{i}; }}",
+    "v_{i} = f_{i}(v_{i});",
+    "if (v_{i} > 10) {{ echo(v_{i}); }}",
+)
+
+def entries(count):
+    for i in range(count):
+        for template in ENTRY_TEMPLATES:
+            yield template.format(i=i)
+
+def main(argv):
+    arg_parser = argparse.ArgumentParser(description="measure how entry latency changes over a long repl session")
+    arg_parser.add_argument("--entries", type=int, default=20000)
+    arg_parser.add_argument("--engine", choices=["vm", "tree", "closure"], default="vm")
+    arg_parser.add_argument("--buckets", type=int, default=5, help="how many slices of the session to report")
+    args = arg_parser.parse_args(argv)
+
+    output = MemorySink()
+    session = ReplSession(args.engine, output=output)
+    lines = list(entries(args.entries // len(ENTRY_TEMPLATES)))
+    bucket_size = len(lines) // args.buckets
+
+    print(f"{'entries':>16} {'mean latency':>14}")
+    for bucket in range(args.buckets):
+        start = time.perf_counter()
+        for line in lines[bucket * bucket_size:(bucket + 1) * bucket_size]:
+            session.feed_line(line)
+        elapsed = time.perf_counter() - start
+
+        output.clear()
+        print(f"{bucket * bucket_size:>7}-{(bucket + 1) * bucket_size:<8} {elapsed / bucket_size * 1000000:11.1f}us")
+
+    session.close()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
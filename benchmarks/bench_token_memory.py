@@ -0,0 +1,50 @@
+import gc
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from lexer import lex, lex_compact
+from parser import parse
+from bench_ast_memory import generate_program
+
+def measure(lex_function, src):
+    # memory held by the token stream once lexing is done, and the time to
+    # lex and then parse it
+    gc.collect()
+    tracemalloc.start()
+    tokens = lex_function(src)
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del tokens
+
+    gc.collect()
+    start = time.perf_counter()
+    tokens = lex_function(src)
+    lexed = time.perf_counter()
+    parse(tokens)
+    parsed = time.perf_counter()
+
+    return len(tokens), held, lexed - start, parsed - lexed
+
+def main(argv):
+    arg_parser = argparse.ArgumentParser(description="compare the memory of Token objects with a TokenArray")
+    arg_parser.add_argument("--functions", type=int, default=5000, help="number of generated function pairs")
+    args = arg_parser.parse_args(argv)
+
+    src = generate_program(args.functions)
+    print(f"source: {len(src) / (1024 * 1024):.2f} MB")
+    print(f"{'stream':<12} {'tokens':>9} {'memory':>10} {'bytes/token':>12} {'lex':>8} {'parse':>8}")
+
+    results = {}
+    for name, lex_function in (("lex", lex), ("lex_compact", lex_compact)):
+        count, held, lex_time, parse_time = results[name] = measure(lex_function, src)
+        print(f"{name:<12} {count:>9} {held / (1024 * 1024):8.1f}MB {held / count:12.1f} {lex_time:7.2f}s {parse_time:7.2f}s")
+
+    print(f"token memory: {results['lex'][1] / results['lex_compact'][1]:.1f}x smaller as a TokenArray")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,195 @@
+import io
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tracemalloc
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from lexer import lex
+from parser import parse
+from interpreter import interpret
+
+PROGRAMS_DIR = os.path.join(os.path.dirname(__file__), "programs")
+PHASES = ("lex", "parse", "interpret")
+
+# a sample repeats a phase until it takes at least this long, so short
+# phases are not lost in timer noise
+MIN_SAMPLE_TIME = 0.05
+
+# peaks of a few KiB move by a few hundred bytes from run to run
+MIN_MEMORY_CHANGE = 4096
+
+def load_programs(names=None):
+    programs = {}
+    for file_name in sorted(os.listdir(PROGRAMS_DIR)):
+        name, ext = os.path.splitext(file_name)
+        if ext != ".qk" or (names and name not in names):
+            continue
+
+        with open(os.path.join(PROGRAMS_DIR, file_name)) as file:
+            programs[name] = file.read()
+
+    return programs
+
+def make_phase(phase, src, engine):
+    # returns (setup, run): setup builds the input of one run outside the timing
+    tokens = lex(src)
+
+    if phase == "lex":
+        return lambda: src, lex
+
+    if phase == "parse":
+        return lambda: tokens, parse
+
+    # interpreting resolves and optimizes the tree in place, every run needs its own
+    return lambda: parse(tokens), lambda root: interpret(root, engine)
+
+def time_phase(setup, run, repeat):
+    number = 1
+    while True:
+        inputs = [setup() for _ in range(number)]
+        start = time.perf_counter()
+        for value in inputs:
+            run(value)
+        elapsed = time.perf_counter() - start
+
+        if elapsed >= MIN_SAMPLE_TIME:
+            break
+
+        number *= 2
+
+    best = elapsed / number
+    for _ in range(repeat - 1):
+        inputs = [setup() for _ in range(number)]
+        start = time.perf_counter()
+        for value in inputs:
+            run(value)
+        best = min(best, (time.perf_counter() - start) / number)
+
+    return best
+
+def peak_memory(setup, run):
+    value = setup()
+
+    tracemalloc.start()
+    try:
+        run(value)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return peak
+
+def bench_program(src, engine, repeat):
+    results = {}
+
+    # echo output is not part of what is measured
+    with contextlib.redirect_stdout(io.StringIO()):
+        for phase in PHASES:
+            setup, run = make_phase(phase, src, engine)
+            seconds = time_phase(setup, run, repeat)
+            results[phase] = {
+                "seconds": seconds,
+                "ops_per_sec": 1 / seconds,
+                "peak_bytes": peak_memory(setup, run),
+            }
+
+    return results
+
+def run_suite(engine, repeat, names=None):
+    results = {}
+    for name, src in load_programs(names).items():
+        results[name] = bench_program(src, engine, repeat)
+        print_program(name, results[name])
+
+    return {
+        "engine": engine,
+        "python": platform.python_version(),
+        "programs": results,
+    }
+
+def print_program(name, results):
+    for phase in PHASES:
+        result = results[phase]
+        print(f"{name:<14} {phase:<10} {result['seconds'] * 1000:10.3f} ms {result['ops_per_sec']:12.1f} ops/s "
+              f"{result['peak_bytes'] / 1024:10.1f} KiB peak")
+
+def compare(current, baseline, threshold):
+    # a phase regresses when it is slower, or takes more memory, than the
+    # baseline by more than threshold (a fraction, 0.1 is 10%)
+    regressions = []
+
+    if current["engine"] != baseline.get("engine"):
+        print(f"warning: baseline was recorded with the {baseline.get('engine')} engine", file=sys.stderr)
+
+    for name, phases in current["programs"].items():
+        base_phases = baseline["programs"].get(name)
+        if base_phases is None:
+            continue
+
+        for phase, result in phases.items():
+            base = base_phases.get(phase)
+            if base is None:
+                continue
+
+            for metric in ("seconds", "peak_bytes"):
+                if metric == "peak_bytes" and result[metric] - base[metric] < MIN_MEMORY_CHANGE:
+                    continue
+
+                if base[metric] and result[metric] > base[metric] * (1 + threshold):
+                    change = result[metric] / base[metric] - 1
+                    regressions.append(f"{name} {phase} {metric}: {base[metric]:.6g} -> {result[metric]:.6g} (+{change:.1%})")
+
+    return regressions
+
+def main(argv):
+    arg_parser = argparse.ArgumentParser(description="time lexing, parsing and interpreting the benchmark programs")
+    arg_parser.add_argument("programs", nargs="*", help="program names to run, all by default")
+    arg_parser.add_argument("--engine", choices=["vm", "tree", "closure", "python"], default="vm")
+    arg_parser.add_argument("--repeat", type=int, default=5, help="samples per phase, the best one is kept")
+    arg_parser.add_argument("--output", help="write the results to this json file")
+    arg_parser.add_argument("--baseline", help="compare against the results in this json file")
+    arg_parser.add_argument("--save-baseline", action="store_true", help="write the results to the --baseline file instead of comparing")
+    arg_parser.add_argument("--threshold", type=float, default=0.1, help="allowed slowdown before failing, as a fraction (default 0.1)")
+    args = arg_parser.parse_args(argv)
+
+    if args.save_baseline and not args.baseline:
+        arg_parser.error("--save-baseline needs --baseline")
+
+    results = run_suite(args.engine, args.repeat, args.programs)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if not args.baseline:
+        return 0
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(results, file, indent=2)
+
+        print(f"baseline saved to {args.baseline}")
+        return 0
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%}:")
+        for regression in regressions:
+            print(f"  {regression}")
+
+        return 1
+
+    print(f"no regressions beyond {args.threshold:.0%}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
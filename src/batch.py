@@ -0,0 +1,120 @@
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from lexer import lex_source
+from parser import parse
+from interpreter import Interpreter, run_code
+from cache import CACHE_DIR_NAME, cache_path, source_key, load_code, store_code
+from output import MemorySink
+
+SCRIPT_SUFFIX = ".qk"
+
+STATUS_OK = "ok"
+STATUS_ERROR = "error"
+
+# compiled bytecode by source key, kept for the life of the worker process so
+# a script that is run again is not compiled again
+PROGRAMS = {}
+
+class ScriptResult:
+    __slots__ = ('path', 'status', 'seconds', 'output', 'error', 'reused')
+
+    def __init__(self, path, status, seconds, output, error=None, reused=False):
+        self.path = path
+        self.status = status
+        self.seconds = seconds
+        self.output = output
+        self.error = error
+        self.reused = reused
+
+def collect_scripts(target):
+    # a directory runs every script below it, anything else is a manifest
+    # listing one script per line relative to the manifest, # starts a comment
+    if os.path.isdir(target):
+        scripts = []
+        for directory, subdirectories, files in os.walk(target):
+            subdirectories[:] = sorted(name for name in subdirectories if name != CACHE_DIR_NAME)
+            scripts.extend(os.path.join(directory, name) for name in sorted(files) if name.endswith(SCRIPT_SUFFIX))
+
+        return scripts
+
+    base = os.path.dirname(target)
+    with open(target, "r") as file:
+        lines = [line.split("#", 1)[0].strip() for line in file]
+
+    return [os.path.join(base, line) for line in lines if line]
+
+def compiled_program(path, src, use_cache, cache_dir):
+    key = source_key(src)
+    code = PROGRAMS.get(key)
+    if code is not None:
+        return code, True
+
+    # the on-disk cache is shared by every worker, written aside and renamed
+    code = load_code(cache_path(path, cache_dir), key) if use_cache else None
+    if code is None:
+        code = Interpreter(parse(lex_source(src))).compile()
+        if use_cache:
+            store_code(cache_path(path, cache_dir), key, code)
+
+    PROGRAMS[key] = code
+    return code, False
+
+def run_script(task):
+    path, engine, use_cache, cache_dir, limits = task
+    output = MemorySink()
+    reused = False
+    start = time.perf_counter()
+
+    try:
+        with open(path, "r") as file:
+            src = file.read()
+
+        if engine == "vm":
+            code, reused = compiled_program(path, src, use_cache, cache_dir)
+            run_code(code, output, limits=limits)
+        else:
+            interpreter = Interpreter(parse(lex_source(src)), output)
+            interpreter.limits = limits
+            interpreter.run(engine)
+    except Exception as error:
+        # one broken script is reported with the rest, it never ends the batch
+        return ScriptResult(path, STATUS_ERROR, time.perf_counter() - start, output.getvalue(),
+                            f"{type(error).__name__}: {error}", reused)
+
+    return ScriptResult(path, STATUS_OK, time.perf_counter() - start, output.getvalue(), reused=reused)
+
+def run_batch(scripts, jobs=None, engine="vm", use_cache=True, cache_dir=None, limits=None):
+    # Yields a ScriptResult per script in the order given. Workers live for
+    # the whole batch, so they start once and keep what they compiled. Limits
+    # apply to each script on its own.
+    tasks = [(path, engine, use_cache, cache_dir, limits) for path in scripts]
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+
+    if jobs == 1 or len(tasks) <= 1:
+        yield from map(run_script, tasks)
+        return
+
+    # scripts are handed out in chunks, many small ones cost little to send
+    chunksize = max(1, len(tasks) // (jobs * 8))
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        yield from executor.map(run_script, tasks, chunksize=chunksize)
+
+def print_result(result, stream=sys.stdout):
+    stream.write(f"==> {result.path} <==\n")
+    stream.write(result.output)
+    if result.error is not None:
+        stream.write(f"error: {result.error}\n")
+
+def print_summary(results, elapsed, jobs, file=sys.stderr):
+    print(f"{'status':>6} {'seconds':>9}  script", file=file)
+    for result in results:
+        note = " (reused)" if result.reused else ""
+        print(f"{result.status:>6} {result.seconds:9.3f}  {result.path}{note}", file=file)
+
+    failed = sum(1 for result in results if result.status != STATUS_OK)
+    busy = sum(result.seconds for result in results)
+    print(f"{len(results)} scripts, {failed} failed, {elapsed:.3f}s elapsed, {busy:.3f}s in scripts, {jobs} jobs", file=file)
@@ -0,0 +1,81 @@
+import os
+import marshal
+import hashlib
+
+from compiler import BYTECODE_VERSION, OPCODE_NAMES, DEREF_SHIFT, CodeObject
+
+INTERPRETER_VERSION = "0.0.1"
+
+# bump whenever the bytecode or the layout below changes
+CACHE_MAGIC = b"QKC\x01"
+CACHE_DIR_NAME = "__qkcache__"
+
+# changes whenever an opcode is added, renumbered or the compiler output
+# changes, so bytecode from another compiler is never loaded
+BYTECODE_FORMAT = hashlib.sha256(repr((BYTECODE_VERSION, sorted(OPCODE_NAMES.items()), DEREF_SHIFT)).encode()).digest()
+
+def cache_path(source_path, cache_dir=None):
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(source_path)), CACHE_DIR_NAME)
+        return os.path.join(cache_dir, os.path.basename(source_path) + ".qkc")
+
+    # a shared directory holds scripts from anywhere, same named ones apart
+    where = hashlib.sha256(os.path.abspath(source_path).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f"{os.path.basename(source_path)}-{where}.qkc")
+
+def source_key(src, optimize_ast=True):
+    digest = hashlib.sha256()
+    digest.update(INTERPRETER_VERSION.encode())
+    digest.update(BYTECODE_FORMAT)
+    digest.update(b"\x01" if optimize_ast else b"\x00")
+    digest.update(src.encode())
+
+    return digest.digest()
+
+# -------------- SERIALIZATION --------------
+# constants are scalars or nested code, so a tuple constant is always code
+def code_to_tuple(code):
+    constants = [code_to_tuple(const) if isinstance(const, CodeObject) else const for const in code.constants]
+    return (code.name, code.num_params, code.num_slots, code.instructions, constants)
+
+def tuple_to_code(data):
+    name, num_params, num_slots, instructions, constants = data
+
+    code = CodeObject(name, num_params, num_slots)
+    code.instructions = instructions
+    code.constants = [tuple_to_code(const) if isinstance(const, tuple) else const for const in constants]
+    return code
+
+def load_code(path, key):
+    try:
+        with open(path, "rb") as file:
+            data = file.read()
+    except OSError:
+        return None
+
+    header = CACHE_MAGIC + key
+    if not data.startswith(header):
+        return None
+
+    try:
+        return tuple_to_code(marshal.loads(data[len(header):]))
+    except (ValueError, EOFError, TypeError):
+        return None
+
+def store_code(path, key, code):
+    data = CACHE_MAGIC + key + marshal.dumps(code_to_tuple(code))
+
+    # written aside and renamed, so a concurrent run never reads half a file
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(temp_path, "wb") as file:
+            file.write(data)
+
+        os.replace(temp_path, path)
+    except OSError:
+        # a read-only tree just runs uncached
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
@@ -0,0 +1,162 @@
+from qast import ASTNodeKind, AST_NODE_KIND_NAMES, LiteralType, QwrkRuntimeError, OPERATOR_SPELLINGS, MATHS_OPERATORS, \
+    LOGICAL_OPERATORS, COMP_OPERATORS, STRING_OPERATORS, OP_NOT, OP_NEG, postorder
+
+NUMERIC_TYPES = (LiteralType.type_i32, LiteralType.type_f32)
+
+class QwrkTypeError(QwrkRuntimeError):
+    pass
+
+class TypeChecker:
+    def __init__(self):
+        self.return_types = []
+
+    def check_program(self, root):
+        self.check_block(root)
+        return root
+
+    def check_block(self, block):
+        for child in block.children:
+            self.check_stmt(child)
+
+    # -------------- STATEMENTS --------------
+    def check_stmt(self, node):
+        kind = node.kind
+
+        if kind == ASTNodeKind.ast_var_decl:
+            value_type = self.check_expr(node.value)
+            if value_type != node.symbol.type:
+                raise QwrkTypeError(node, f"Cannot assign type ({value_type}) to type ({node.symbol.type})")
+        elif kind == ASTNodeKind.ast_var_assign:
+            value_type = self.check_expr(node.value)
+            if value_type != node.symbol.type:
+                raise QwrkTypeError(node, f"Cannot assign type ({value_type}) to type ({node.symbol.type})")
+        elif kind == ASTNodeKind.ast_fn_decl:
+            self.return_types.append(node.symbol.type)
+            self.check_block(node.body)
+            self.return_types.pop()
+        elif kind == ASTNodeKind.ast_if_stmt:
+            self.check_condition(node.condition)
+            self.check_block(node.body)
+
+            if node.else_branch is not None:
+                self.check_stmt(node.else_branch)
+        elif kind == ASTNodeKind.ast_while_stmt:
+            self.check_condition(node.condition)
+            self.check_block(node.body)
+        elif kind == ASTNodeKind.ast_root:
+            self.check_block(node)
+        elif kind == ASTNodeKind.ast_return_stmt:
+            return_type = self.check_expr(node.expr)
+            if return_type != self.return_types[-1]:
+                raise QwrkTypeError(node, f"Invalid return type ({return_type}), expected ({self.return_types[-1]}).")
+        else:
+            self.check_expr(node)
+
+    def check_condition(self, condition):
+        condition_type = self.check_expr(condition)
+        if condition_type != LiteralType.type_bool:
+            raise QwrkTypeError(condition, f"Condition must be of type ({LiteralType.type_bool}), got ({condition_type})")
+
+    # -------------- EXPRESSIONS --------------
+    def check_expr(self, root):
+        # operands are typed before the operators over them
+        for node in postorder(root):
+            self.check_node(node)
+
+        return root.type
+
+    def check_node(self, node):
+        kind = node.kind
+
+        if kind == ASTNodeKind.ast_num or kind == ASTNodeKind.ast_str or kind == ASTNodeKind.ast_bool:
+            return
+
+        if kind == ASTNodeKind.ast_id:
+            if node.symbol.parameters is not None:
+                raise QwrkTypeError(node, f"Function ({node.value}) used as a value")
+
+            node.type = node.symbol.type
+        elif kind == ASTNodeKind.ast_bin_expr:
+            node.type = self.check_binary(node)
+        elif kind == ASTNodeKind.ast_unr_expr:
+            node.type = self.check_unary(node)
+        elif kind == ASTNodeKind.ast_fn_call:
+            node.type = self.check_call(node)
+        elif kind == ASTNodeKind.ast_echo_builtin:
+            node.type = None
+        else:
+            raise QwrkTypeError(node, f"Unexpected node in expression ({AST_NODE_KIND_NAMES[kind]})")
+
+    def check_binary(self, node):
+        lhs_type = node.lhs.type
+        rhs_type = node.rhs.type
+        op = node.op
+
+        if op in MATHS_OPERATORS:
+            if lhs_type not in NUMERIC_TYPES:
+                raise QwrkTypeError(node, f"Invalid Arethmatic operation type ({lhs_type})")
+
+            if rhs_type not in NUMERIC_TYPES:
+                raise QwrkTypeError(node, f"Invalid Arethmatic operation type ({rhs_type})")
+
+            # the result takes the type of the left operand
+            return lhs_type
+
+        if op in LOGICAL_OPERATORS:
+            if lhs_type != LiteralType.type_bool or rhs_type != LiteralType.type_bool:
+                raise QwrkTypeError(node, f"Incompatible types ({lhs_type} - {rhs_type})")
+
+            return LiteralType.type_bool
+
+        if op in COMP_OPERATORS:
+            both_numeric = lhs_type in NUMERIC_TYPES and rhs_type in NUMERIC_TYPES
+            if not both_numeric and lhs_type != rhs_type:
+                raise QwrkTypeError(node, f"Incompatible types ({lhs_type} - {rhs_type})")
+
+            return LiteralType.type_bool
+
+        if op in STRING_OPERATORS:
+            if lhs_type != LiteralType.type_string:
+                raise QwrkTypeError(node, f"Invalid String operation type ({lhs_type})")
+
+            if rhs_type != LiteralType.type_string:
+                raise QwrkTypeError(node, f"Invalid String operation type ({rhs_type})")
+
+            return LiteralType.type_string
+
+        raise QwrkTypeError(node, f"Unknown Operator ({OPERATOR_SPELLINGS.get(op, op)})")
+
+    def check_unary(self, node):
+        operand_type = node.stmt.type
+        op = node.op
+
+        if op == OP_NOT:
+            if operand_type != LiteralType.type_bool:
+                raise QwrkTypeError(node, f"Invalid operand for '!' ({operand_type})")
+
+            return LiteralType.type_bool
+
+        if op == OP_NEG:
+            if operand_type not in NUMERIC_TYPES:
+                raise QwrkTypeError(node, f"Invalid operand for '-' ({operand_type})")
+
+            return operand_type
+
+        raise QwrkTypeError(node, f"Unknown unary operator ({OPERATOR_SPELLINGS.get(op, op)})")
+
+    def check_call(self, node):
+        parameters = node.symbol.parameters
+
+        if len(parameters) != len(node.arguments):
+            raise QwrkTypeError(node, f"Invalid argument length: ({len(node.arguments)} )given, but expected ({len(parameters)}).")
+
+        for argument, (_, param_type) in zip(node.arguments, parameters):
+            arg_type = argument.type
+            if arg_type != param_type:
+                raise QwrkTypeError(node, f"Invalid argument type: ({arg_type}) given, but expected ({param_type}).")
+
+        return node.symbol.type
+
+def check(ast_root):
+    checker = TypeChecker()
+    return checker.check_program(ast_root)
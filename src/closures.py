@@ -0,0 +1,416 @@
+from qast import ASTNodeKind, AST_NODE_KIND_NAMES, CONTROL_FLOW_KINDS, QwrkRuntimeError, Frame, FramePool, Function, \
+    TailCall, BINARY_FUNCTIONS, UNARY_FUNCTIONS, OPERATOR_SPELLINGS, OP_ADD, OP_SUB, OP_MUL, OP_DIV, OP_MOD, OP_CONCAT, \
+    OP_AND, OP_OR, OP_EQ, OP_NE, OP_LT, OP_LE, OP_GT, OP_GE, OP_NOT, OP_NEG
+from rope import concat
+
+LITERAL_KINDS = (ASTNodeKind.ast_num, ASTNodeKind.ast_bool, ASTNodeKind.ast_str)
+
+# -------------- OPERATORS --------------
+# One closure factory per operator, the operator is part of the closure's
+# code instead of something looked up while running.
+def make_and(lhs, rhs):
+    def run(frame):
+        # both sides always run, && does not short-circuit
+        left = lhs(frame)
+        right = rhs(frame)
+        return left and right
+
+    return run
+
+def make_or(lhs, rhs):
+    def run(frame):
+        left = lhs(frame)
+        right = rhs(frame)
+        return left or right
+
+    return run
+
+BINARY_CLOSURES = {
+    OP_ADD: lambda lhs, rhs: lambda frame: lhs(frame) + rhs(frame),
+    OP_SUB: lambda lhs, rhs: lambda frame: lhs(frame) - rhs(frame),
+    OP_MUL: lambda lhs, rhs: lambda frame: lhs(frame) * rhs(frame),
+    OP_DIV: lambda lhs, rhs: lambda frame: lhs(frame) / rhs(frame),
+    OP_MOD: lambda lhs, rhs: lambda frame: lhs(frame) % rhs(frame),
+    OP_CONCAT: lambda lhs, rhs: lambda frame: concat(lhs(frame), rhs(frame)),
+    OP_AND: make_and,
+    OP_OR: make_or,
+    OP_EQ: lambda lhs, rhs: lambda frame: lhs(frame) == rhs(frame),
+    OP_NE: lambda lhs, rhs: lambda frame: lhs(frame) != rhs(frame),
+    OP_LT: lambda lhs, rhs: lambda frame: lhs(frame) < rhs(frame),
+    OP_LE: lambda lhs, rhs: lambda frame: lhs(frame) <= rhs(frame),
+    OP_GT: lambda lhs, rhs: lambda frame: lhs(frame) > rhs(frame),
+    OP_GE: lambda lhs, rhs: lambda frame: lhs(frame) >= rhs(frame),
+}
+
+# a literal right operand is bound as a plain value, skipping one call
+CONSTANT_RHS_CLOSURES = {
+    OP_ADD: lambda lhs, value: lambda frame: lhs(frame) + value,
+    OP_SUB: lambda lhs, value: lambda frame: lhs(frame) - value,
+    OP_MUL: lambda lhs, value: lambda frame: lhs(frame) * value,
+    OP_DIV: lambda lhs, value: lambda frame: lhs(frame) / value,
+    OP_MOD: lambda lhs, value: lambda frame: lhs(frame) % value,
+    OP_CONCAT: lambda lhs, value: lambda frame: concat(lhs(frame), value),
+    OP_EQ: lambda lhs, value: lambda frame: lhs(frame) == value,
+    OP_NE: lambda lhs, value: lambda frame: lhs(frame) != value,
+    OP_LT: lambda lhs, value: lambda frame: lhs(frame) < value,
+    OP_LE: lambda lhs, value: lambda frame: lhs(frame) <= value,
+    OP_GT: lambda lhs, value: lambda frame: lhs(frame) > value,
+    OP_GE: lambda lhs, value: lambda frame: lhs(frame) >= value,
+}
+
+class ClosureCompiler:
+    def __init__(self, module_frame):
+        # globals live in one list for the whole run, closures bind it directly
+        self.module_frame = module_frame
+        self.global_slots = module_frame.slots
+        self.pool = module_frame.pool
+
+    def compile_program(self, root):
+        return self.compile_block(root)
+
+    # -------------- STATEMENTS --------------
+    def compile_block(self, block):
+        return self.compile_statements(block.children)
+
+    def compile_statements(self, statements):
+        steps = [(self.compile_stmt(child), child.kind in CONTROL_FLOW_KINDS) for child in statements]
+
+        if not any(can_return for _, can_return in steps):
+            closures = tuple(closure for closure, _ in steps)
+
+            def run_block(frame):
+                for closure in closures:
+                    closure(frame)
+
+            return run_block
+
+        steps = tuple(steps)
+
+        def run_block_with_return(frame):
+            for closure, can_return in steps:
+                if can_return:
+                    result = closure(frame)
+                    if result is not None:
+                        return result
+                else:
+                    closure(frame)
+
+        return run_block_with_return
+
+    def compile_stmt(self, node):
+        kind = node.kind
+
+        if kind == ASTNodeKind.ast_var_decl:
+            return self.compile_store(node, 0, node.slot, self.compile_expr(node.value))
+        elif kind == ASTNodeKind.ast_var_assign:
+            return self.compile_store(node, node.depth, node.slot, self.compile_expr(node.value))
+        elif kind == ASTNodeKind.ast_fn_decl:
+            return self.compile_function(node)
+        elif kind == ASTNodeKind.ast_if_stmt:
+            return self.compile_if(node)
+        elif kind == ASTNodeKind.ast_while_stmt:
+            return self.compile_while(node)
+        elif kind == ASTNodeKind.ast_root:
+            return self.compile_block(node)
+        elif kind == ASTNodeKind.ast_return_stmt:
+            if node.expr.kind == ASTNodeKind.ast_fn_call:
+                return self.compile_tail_call(node.expr)
+
+            expr = self.compile_expr(node.expr)
+            # boxed like the tree walker, so a return is told apart from a block ending
+            return lambda frame: (expr(frame),)
+
+        return self.compile_expr(node)
+
+    def compile_store(self, node, depth, slot, value):
+        if depth == 0:
+            def store_local(frame):
+                frame.slots[slot] = value(frame)
+
+            return store_local
+
+        if node.symbol.level == 0:
+            global_slots = self.global_slots
+
+            def store_global(frame):
+                global_slots[slot] = value(frame)
+
+            return store_global
+
+        def store_outer(frame):
+            frame.ancestor(depth).slots[slot] = value(frame)
+
+        return store_outer
+
+    def compile_function(self, node):
+        body = self.wrap_body(node, self.compile_block(node.body))
+        code = (body, node.body.frame_size)
+        slot = node.slot
+
+        def declare(frame):
+            frame.slots[slot] = Function(code, frame)
+
+        return declare
+
+    def wrap_body(self, node, body):
+        # lets a subclass put something around every function body
+        return body
+
+    def compile_if(self, node):
+        if node.kind == ASTNodeKind.ast_root:
+            # an else branch the optimizer reduced to a plain block
+            return self.compile_block(node)
+
+        condition = self.compile_expr(node.condition)
+        body = self.compile_block(node.body)
+
+        if node.else_branch is None:
+            def run_if(frame):
+                if condition(frame):
+                    return body(frame)
+
+            return run_if
+
+        else_branch = self.compile_if(node.else_branch)
+
+        def run_if_else(frame):
+            if condition(frame):
+                return body(frame)
+
+            return else_branch(frame)
+
+        return run_if_else
+
+    def compile_while(self, node):
+        condition = self.compile_expr(node.condition)
+        body = self.compile_block(node.body)
+
+        def run_while(frame):
+            while condition(frame):
+                result = body(frame)
+                if result is not None:
+                    return result
+
+        return run_while
+
+    # -------------- EXPRESSIONS --------------
+    def compile_expr(self, node):
+        kind = node.kind
+
+        if kind in LITERAL_KINDS:
+            value = node.value
+            return lambda frame: value
+
+        if kind == ASTNodeKind.ast_id:
+            return self.compile_load(node)
+
+        if kind == ASTNodeKind.ast_bin_expr:
+            if node.deep:
+                return self.compile_deep(node)
+
+            return self.compile_binary(node)
+
+        if kind == ASTNodeKind.ast_unr_expr:
+            if node.deep:
+                return self.compile_deep(node)
+
+            operand = self.compile_expr(node.stmt)
+            if node.op == OP_NOT:
+                return lambda frame: not operand(frame)
+
+            if node.op == OP_NEG:
+                return lambda frame: -operand(frame)
+
+            raise QwrkRuntimeError(node, f"Unknown unary operator ({OPERATOR_SPELLINGS.get(node.op, node.op)})")
+
+        if kind == ASTNodeKind.ast_fn_call:
+            return self.compile_call(node)
+
+        if kind == ASTNodeKind.ast_echo_builtin:
+            value = self.compile_expr(node.value)
+            output_echo = self.pool.output.echo
+
+            def echo(frame):
+                output_echo(value(frame))
+
+            return echo
+
+        raise QwrkRuntimeError(node, f"Cannot compile node ({AST_NODE_KIND_NAMES[kind]})")
+
+    def compile_load(self, node):
+        slot = node.slot
+        depth = node.depth
+
+        if depth == 0:
+            return lambda frame: frame.slots[slot]
+
+        if node.symbol.level == 0:
+            global_slots = self.global_slots
+            return lambda frame: global_slots[slot]
+
+        if depth == 1:
+            return lambda frame: frame.parent.slots[slot]
+
+        return lambda frame: frame.ancestor(depth).slots[slot]
+
+    def compile_binary(self, node):
+        op = node.op
+        if op not in BINARY_CLOSURES:
+            raise QwrkRuntimeError(node, f"Unknown Operator ({OPERATOR_SPELLINGS.get(op, op)})")
+
+        lhs = self.compile_expr(node.lhs)
+        if node.rhs.kind in LITERAL_KINDS and op in CONSTANT_RHS_CLOSURES:
+            return CONSTANT_RHS_CLOSURES[op](lhs, node.rhs.value)
+
+        return BINARY_CLOSURES[op](lhs, self.compile_expr(node.rhs))
+
+    def compile_deep(self, root):
+        # An operator tree too tall for nested closures runs as a flat postfix
+        # program over a stack of values, operands that are not operators are
+        # compiled as usual. Each step is (operand count, closure or function).
+        steps = []
+        pending = [root]
+
+        while pending:
+            node = pending.pop()
+            if type(node) is tuple:
+                steps.append(node)
+                continue
+
+            kind = node.kind
+            if kind == ASTNodeKind.ast_bin_expr:
+                if node.op not in BINARY_CLOSURES:
+                    raise QwrkRuntimeError(node, f"Unknown Operator ({OPERATOR_SPELLINGS.get(node.op, node.op)})")
+
+                pending.append((2, BINARY_FUNCTIONS[node.op]))
+                pending.append(node.rhs)
+                pending.append(node.lhs)
+            elif kind == ASTNodeKind.ast_unr_expr:
+                if node.op not in UNARY_FUNCTIONS:
+                    raise QwrkRuntimeError(node, f"Unknown unary operator ({OPERATOR_SPELLINGS.get(node.op, node.op)})")
+
+                pending.append((1, UNARY_FUNCTIONS[node.op]))
+                pending.append(node.stmt)
+            else:
+                steps.append((0, self.compile_expr(node)))
+
+        steps = tuple(steps)
+
+        def run_deep(frame):
+            values = []
+            push = values.append
+            for operands, run in steps:
+                if operands == 0:
+                    push(run(frame))
+                elif operands == 1:
+                    values[-1] = run(values[-1])
+                else:
+                    rhs = values.pop()
+                    values[-1] = run(values[-1], rhs)
+
+            return values[0]
+
+        return run_deep
+
+    def compile_call(self, node):
+        function = self.compile_load(node)
+        arguments = tuple(self.compile_expr(argument) for argument in node.arguments)
+        pool = self.pool
+        free_frames = pool.free
+
+        # FramePool.acquire is inlined, calls are hot enough to matter. The body
+        # hands back the boxed value of its return, or None when it runs off the end.
+        if len(arguments) == 1:
+            argument = arguments[0]
+
+            def call_one(frame):
+                fn = function(frame)
+                body, size = fn.code
+                frames = free_frames.get(size)
+                if frames:
+                    callee = frames.pop()
+                    callee.parent = fn.parent_frame
+                else:
+                    callee = Frame(size, fn.parent_frame, pool)
+
+                callee.slots[0] = argument(frame)
+                result = body(callee)
+                if result is None:
+                    pool.release(callee)
+                    return None
+
+                value = result[0]
+                if type(value) is TailCall:
+                    return run_tail_calls(value, callee, pool)
+
+                pool.release(callee)
+                return value
+
+            return call_one
+
+        def call(frame):
+            fn = function(frame)
+            body, size = fn.code
+            frames = free_frames.get(size)
+            if frames:
+                callee = frames.pop()
+                callee.parent = fn.parent_frame
+            else:
+                callee = Frame(size, fn.parent_frame, pool)
+
+            slots = callee.slots
+            for i, argument in enumerate(arguments):
+                slots[i] = argument(frame)
+
+            result = body(callee)
+            if result is None:
+                pool.release(callee)
+                return None
+
+            value = result[0]
+            if type(value) is TailCall:
+                return run_tail_calls(value, callee, pool)
+
+            pool.release(callee)
+            return value
+
+        return call
+
+    def compile_tail_call(self, node):
+        # `return f(...)` hands f and its arguments back to the caller, which
+        # runs them once this body has finished
+        function = self.compile_load(node)
+        arguments = tuple(self.compile_expr(argument) for argument in node.arguments)
+
+        def tail_call(frame):
+            return (TailCall(function(frame), [argument(frame) for argument in arguments]),)
+
+        return tail_call
+
+def run_tail_calls(tail, frame, pool):
+    # qast.run_tail_calls for compiled bodies, whose code is (body, size)
+    while True:
+        fn = tail.function
+        if fn.parent_frame is not frame:
+            pool.release(frame)
+
+        body, size = fn.code
+        frame = pool.acquire(size, fn.parent_frame)
+        frame.slots[:len(tail.arguments)] = tail.arguments
+
+        result = body(frame)
+        if result is None:
+            pool.release(frame)
+            return None
+
+        tail = result[0]
+        if type(tail) is not TailCall:
+            pool.release(frame)
+            return tail
+
+def run_closures(root, module_frame=None, output=None):
+    if module_frame is None:
+        module_frame = Frame(root.frame_size, None, FramePool(output))
+
+    program = ClosureCompiler(module_frame).compile_program(root)
+    program(module_frame)
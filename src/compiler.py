@@ -0,0 +1,303 @@
+from qast import ASTNodeKind, AST_NODE_KIND_NAMES, QwrkRuntimeError, OPERATOR_SPELLINGS, OP_ADD, OP_SUB, OP_MUL, OP_DIV, \
+    OP_MOD, OP_CONCAT, OP_AND, OP_OR, OP_EQ, OP_NE, OP_LT, OP_LE, OP_GT, OP_GE, OP_NOT, OP_NEG
+
+# -------------- OPCODES --------------
+# Every instruction is two entries wide in CodeObject.instructions: (opcode, argument).
+# Keep the hot opcodes at the front, the VM tests them in this order.
+LOAD_LOCAL = 0
+LOAD_CONST = 1
+STORE_LOCAL = 2
+LOAD_GLOBAL = 3
+STORE_GLOBAL = 4
+BINARY_ADD = 5
+BINARY_SUB = 6
+BINARY_LT = 7
+BINARY_EQ = 8
+POP_JUMP_IF_FALSE = 9
+POP_JUMP_IF_TRUE = 10
+JUMP = 11
+BINARY_MUL = 12
+BINARY_DIV = 13
+BINARY_MOD = 14
+BINARY_NE = 15
+BINARY_LE = 16
+BINARY_GT = 17
+BINARY_GE = 18
+BINARY_CONCAT = 19
+BINARY_AND = 20
+BINARY_OR = 21
+UNARY_NOT = 22
+UNARY_NEG = 23
+CALL = 24
+RETURN = 25
+POP = 26
+ECHO = 27
+LOAD_DEREF = 28
+STORE_DEREF = 29
+MAKE_FUNCTION = 30
+CALL_MEMO = 31
+TAIL_CALL = 32
+MEMO_STORE = 33
+
+OPCODE_NAMES = {value: name for name, value in list(globals().items()) if name.isupper() and isinstance(value, int)}
+
+# bump when the compiler emits different code for the same opcodes, cached
+# bytecode is keyed on this and on the opcode table
+BYTECODE_VERSION = 1
+
+BINARY_OPCODES = {
+    OP_ADD: BINARY_ADD,
+    OP_SUB: BINARY_SUB,
+    OP_MUL: BINARY_MUL,
+    OP_DIV: BINARY_DIV,
+    OP_MOD: BINARY_MOD,
+    OP_CONCAT: BINARY_CONCAT,
+    OP_EQ: BINARY_EQ,
+    OP_NE: BINARY_NE,
+    OP_LT: BINARY_LT,
+    OP_LE: BINARY_LE,
+    OP_GT: BINARY_GT,
+    OP_GE: BINARY_GE,
+    OP_AND: BINARY_AND,
+    OP_OR: BINARY_OR,
+}
+
+UNARY_OPCODES = {
+    OP_NOT: UNARY_NOT,
+    OP_NEG: UNARY_NEG,
+}
+
+# LOAD_DEREF/STORE_DEREF pack the frame depth above the slot index
+DEREF_SHIFT = 16
+DEREF_MASK = (1 << DEREF_SHIFT) - 1
+
+class CodeObject:
+    def __init__(self, name, num_params, num_slots):
+        self.name = name
+        self.num_params = num_params
+        self.num_slots = num_slots
+        self.instructions = []
+        self.constants = []
+
+    def __str__(self):
+        return f"<code {self.name}>"
+
+    def disassemble(self):
+        lines = [f"{self.name}: params={self.num_params} slots={self.num_slots}"]
+        for pc in range(0, len(self.instructions), 2):
+            op = self.instructions[pc]
+            arg = self.instructions[pc + 1]
+            lines.append(f"  {pc:>4} {OPCODE_NAMES[op]:<18} {arg}")
+
+        for const in self.constants:
+            if isinstance(const, CodeObject):
+                lines.append(const.disassemble())
+
+        return "\n".join(lines)
+
+class Compiler:
+    def __init__(self, memoize=False):
+        self.code = None
+        self.level = 0
+        self.constant_index = {}
+        # calls to functions the purity analysis marked go through the memo table
+        self.memoize = memoize
+
+    def emit(self, op, arg=0):
+        self.code.instructions.extend((op, arg))
+        return len(self.code.instructions) - 2
+
+    def patch_jump(self, position, target=None):
+        if target is None:
+            target = len(self.code.instructions)
+
+        self.code.instructions[position + 1] = target
+
+    def add_constant(self, value):
+        key = (type(value), value)
+        if key not in self.constant_index:
+            self.constant_index[key] = len(self.code.constants)
+            self.code.constants.append(value)
+
+        return self.constant_index[key]
+
+    def add_code(self, code):
+        self.code.constants.append(code)
+        return len(self.code.constants) - 1
+
+    def emit_access(self, node, local_op, global_op, deref_op):
+        # node carries the (depth, slot) address the resolver gave it
+        if node.depth == 0:
+            self.emit(local_op, node.slot)
+        elif node.symbol.level == 0:
+            self.emit(global_op, node.slot)
+        else:
+            self.emit(deref_op, (node.depth << DEREF_SHIFT) | node.slot)
+
+    # -------------- UNITS --------------
+    def compile_unit(self, name, num_params, block, level):
+        return self.compile_statements(CodeObject(name, num_params, block.frame_size), block.children, level)
+
+    def compile_statements(self, code, statements, level):
+        outer = (self.code, self.level, self.constant_index)
+        self.code = code
+        self.level = level
+        self.constant_index = {}
+
+        for stmt in statements:
+            self.compile_stmt(stmt)
+
+        self.emit(LOAD_CONST, self.add_constant(None))
+        self.emit(RETURN)
+
+        self.code, self.level, self.constant_index = outer
+        return code
+
+    def compile_program(self, root):
+        return self.compile_unit("<main>", 0, root, 0)
+
+    def compile_top_level(self, statements, num_slots):
+        # statements run one chunk at a time against an existing module frame
+        return self.compile_statements(CodeObject("<main>", 0, num_slots), statements, 0)
+
+    def compile_block(self, block):
+        for child in block.children:
+            self.compile_stmt(child)
+
+    # -------------- STATEMENTS --------------
+    def compile_stmt(self, node):
+        kind = node.kind
+
+        if kind == ASTNodeKind.ast_var_decl:
+            self.compile_expr(node.value)
+            self.emit(STORE_LOCAL, node.slot)
+        elif kind == ASTNodeKind.ast_var_assign:
+            self.compile_expr(node.value)
+            self.emit_access(node, STORE_LOCAL, STORE_GLOBAL, STORE_DEREF)
+        elif kind == ASTNodeKind.ast_fn_decl:
+            code = self.compile_unit(node.name, len(node.parameters), node.body, self.level + 1)
+            self.emit(MAKE_FUNCTION, self.add_code(code))
+            self.emit(STORE_LOCAL, node.slot)
+        elif kind == ASTNodeKind.ast_if_stmt:
+            self.compile_if(node)
+        elif kind == ASTNodeKind.ast_while_stmt:
+            self.compile_while(node)
+        elif kind == ASTNodeKind.ast_root:
+            self.compile_block(node)
+        elif kind == ASTNodeKind.ast_return_stmt:
+            call = node.expr
+            if call.kind == ASTNodeKind.ast_fn_call and not self.is_memo_call(call):
+                # the callee takes over this frame, nothing is left to return to here
+                self.compile_call(call, TAIL_CALL)
+            else:
+                self.compile_expr(call)
+                self.emit(RETURN)
+        elif kind == ASTNodeKind.ast_echo_builtin:
+            self.compile_expr(node.value)
+            self.emit(ECHO)
+        else:
+            self.compile_expr(node)
+            self.emit(POP)
+
+    def compile_if(self, node):
+        end_jumps = []
+        while node is not None:
+            if node.kind == ASTNodeKind.ast_root:
+                # an else branch the optimizer reduced to a plain block
+                self.compile_block(node)
+                break
+
+            self.compile_expr(node.condition)
+            next_branch = self.emit(POP_JUMP_IF_FALSE)
+            self.compile_block(node.body)
+
+            if node.else_branch is not None:
+                end_jumps.append(self.emit(JUMP))
+
+            self.patch_jump(next_branch)
+            node = node.else_branch
+
+        for position in end_jumps:
+            self.patch_jump(position)
+
+    def compile_while(self, node):
+        # The condition lives at the bottom of the loop so each iteration
+        # only takes a single conditional jump.
+        to_condition = self.emit(JUMP)
+        body_start = len(self.code.instructions)
+        self.compile_block(node.body)
+
+        self.patch_jump(to_condition)
+        self.compile_expr(node.condition)
+        self.emit(POP_JUMP_IF_TRUE, body_start)
+
+    # -------------- EXPRESSIONS --------------
+    def compile_expr(self, root):
+        # An explicit stack of nodes still to compile and the instructions
+        # waiting on them, an operator is emitted once its operands have been.
+        pending = [root]
+
+        while pending:
+            node = pending.pop()
+            if type(node) is tuple:
+                self.emit(*node)
+                continue
+
+            kind = node.kind
+
+            if kind == ASTNodeKind.ast_id:
+                self.emit_access(node, LOAD_LOCAL, LOAD_GLOBAL, LOAD_DEREF)
+            elif kind == ASTNodeKind.ast_num or kind == ASTNodeKind.ast_str or kind == ASTNodeKind.ast_bool:
+                self.emit(LOAD_CONST, self.add_constant(node.value))
+            elif kind == ASTNodeKind.ast_bin_expr:
+                op = node.op
+                if op not in BINARY_OPCODES:
+                    raise QwrkRuntimeError(node, f"Unknown Operator ({OPERATOR_SPELLINGS.get(op, op)})")
+
+                pending.append((BINARY_OPCODES[op],))
+                pending.append(node.rhs)
+                pending.append(node.lhs)
+            elif kind == ASTNodeKind.ast_unr_expr:
+                op = node.op
+                if op not in UNARY_OPCODES:
+                    raise QwrkRuntimeError(node, f"Unknown unary operator ({OPERATOR_SPELLINGS.get(op, op)})")
+
+                pending.append((UNARY_OPCODES[op],))
+                pending.append(node.stmt)
+            elif kind == ASTNodeKind.ast_fn_call:
+                # the function goes on the stack below its arguments
+                self.emit_access(node, LOAD_LOCAL, LOAD_GLOBAL, LOAD_DEREF)
+                pending.append((CALL_MEMO if self.is_memo_call(node) else CALL, len(node.arguments)))
+                pending.extend(reversed(node.arguments))
+            elif kind == ASTNodeKind.ast_echo_builtin:
+                pending.append((LOAD_CONST, self.add_constant(None)))
+                pending.append((ECHO,))
+                pending.append(node.value)
+            else:
+                raise QwrkRuntimeError(node, f"Cannot compile node ({AST_NODE_KIND_NAMES[kind]})")
+
+    def is_memo_call(self, node):
+        return self.memoize and node.symbol.pure
+
+    def compile_call(self, node, op=CALL):
+        self.emit_access(node, LOAD_LOCAL, LOAD_GLOBAL, LOAD_DEREF)
+        for argument in node.arguments:
+            self.compile_expr(argument)
+
+        self.emit(CALL_MEMO if self.is_memo_call(node) else op, len(node.arguments))
+
+def freeze_code(code):
+    # a copy whose instructions and constants are tuples, for code shared
+    # between runs that must never change under them
+    frozen = CodeObject(code.name, code.num_params, code.num_slots)
+    frozen.instructions = tuple(code.instructions)
+    frozen.constants = tuple(freeze_code(const) if isinstance(const, CodeObject) else const for const in code.constants)
+    return frozen
+
+def compile_program(ast_root, memoize=False):
+    compiler = Compiler(memoize)
+    return compiler.compile_program(ast_root)
+
+def compile_top_level(statements, num_slots):
+    compiler = Compiler()
+    return compiler.compile_top_level(statements, num_slots)
@@ -0,0 +1,120 @@
+from qast import CONTROL_FLOW_KINDS, ASTRoot, FunctionBody, FunctionCall, WhileStmt, EchoBuiltin, call_function, \
+    iter_nodes
+
+# on_statement(node, frame)          before each statement of a block runs
+# on_call(node, arguments)           after a call's arguments are evaluated
+# on_return(node, value)             when a call returns, value is None when the body ran off its end
+# on_loop_iteration(node, iteration) before each run of a while body, counting from 0
+# on_echo(node, value)               before echo writes value to the output
+HOOK_EVENTS = ("on_statement", "on_call", "on_return", "on_loop_iteration", "on_echo")
+
+def instrumented_classes(hooks):
+    # Subclasses that call the hooks, made only for the events that have any.
+    # Nodes are switched over to them for a hooked run, so the plain evaluate
+    # methods never check for hooks.
+    classes = {}
+
+    statement_hooks = tuple(hooks.get("on_statement", ()))
+    call_hooks = tuple(hooks.get("on_call", ()))
+    return_hooks = tuple(hooks.get("on_return", ()))
+    loop_hooks = tuple(hooks.get("on_loop_iteration", ()))
+    echo_hooks = tuple(hooks.get("on_echo", ()))
+
+    if statement_hooks:
+        def run_block(block, frame):
+            for child in block.children:
+                for hook in statement_hooks:
+                    hook(child, frame)
+
+                if child.kind in CONTROL_FLOW_KINDS:
+                    result = child.evaluate(frame)
+                    if result is not None:
+                        return result
+                else:
+                    child.evaluate(frame)
+
+        class HookedASTRoot(ASTRoot):
+            __slots__ = ()
+
+            def evaluate(self, frame):
+                return run_block(self, frame)
+
+        class HookedFunctionBody(FunctionBody):
+            __slots__ = ()
+
+            def evaluate(self, frame):
+                result = run_block(self, frame)
+                if result is not None:
+                    return result[0]
+
+        classes[ASTRoot] = HookedASTRoot
+        classes[FunctionBody] = HookedFunctionBody
+
+    if call_hooks or return_hooks:
+        class HookedFunctionCall(FunctionCall):
+            __slots__ = ()
+
+            def evaluate(self, frame):
+                fn = frame.ancestor(self.depth).slots[self.slot]
+
+                arguments = [arg.evaluate(frame) for arg in self.arguments]
+                for hook in call_hooks:
+                    hook(self, arguments)
+
+                result = call_function(fn, arguments, frame.pool)
+
+                for hook in return_hooks:
+                    hook(self, result)
+
+                return result
+
+        classes[FunctionCall] = HookedFunctionCall
+
+    if loop_hooks:
+        class HookedWhileStmt(WhileStmt):
+            __slots__ = ()
+
+            def evaluate(self, frame):
+                iteration = 0
+                while self.condition.evaluate(frame):
+                    for hook in loop_hooks:
+                        hook(self, iteration)
+
+                    iteration += 1
+                    result = self.body.evaluate(frame)
+                    if result is not None:
+                        return result
+
+        classes[WhileStmt] = HookedWhileStmt
+
+    if echo_hooks:
+        class HookedEchoBuiltin(EchoBuiltin):
+            __slots__ = ()
+
+            def evaluate(self, frame):
+                value = self.value.evaluate(frame)
+                for hook in echo_hooks:
+                    hook(self, value)
+
+                frame.pool.output.echo(value)
+
+        classes[EchoBuiltin] = HookedEchoBuiltin
+
+    return classes
+
+def instrument(root, hooks):
+    # returns what uninstrument needs to put the tree back
+    classes = instrumented_classes(hooks)
+    swapped = []
+
+    for node in iter_nodes(root):
+        cls = classes.get(type(node))
+        if cls is not None:
+            swapped.append((node, type(node)))
+            node.__class__ = cls
+
+    return swapped
+
+def uninstrument(swapped):
+    for node, cls in swapped:
+        node.__class__ = cls
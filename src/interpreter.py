@@ -1,11 +1,742 @@
-from qast import ASTContext
+import math
+import asyncio
+
+from qast import QwrkRuntimeError, ASTNodeKind, ASTRoot, Frame, FramePool, Function, LiteralType, iter_nodes, token_to_literal_type
+from lexer import RESERVED_WORDS
+from resolver import Resolver, resolve
+from checker import TypeChecker, check
+from optimizer import Optimizer, optimize
+from closures import ClosureCompiler, run_closures
+from transpiler import transpile, run_python
+from profiler import run_profiled
+from hooks import HOOK_EVENTS, instrument, uninstrument
+from output import AsyncOutputSink, AsyncWrappedSink, EchoQueue, default_output
+from rope import concat
+from purity import analyze_purity
+from memo import DEFAULT_MEMO_SIZE, MISSING, MemoTable, memo_key, memoize_calls
+from limits import Limits, meter, step_limit_error, depth_limit_error, string_limit_error
+from compiler import CodeObject, compile_program, compile_top_level, freeze_code, DEREF_SHIFT, DEREF_MASK, \
+    LOAD_LOCAL, LOAD_CONST, STORE_LOCAL, LOAD_GLOBAL, STORE_GLOBAL, BINARY_ADD, BINARY_SUB, BINARY_LT, BINARY_EQ, \
+    POP_JUMP_IF_FALSE, POP_JUMP_IF_TRUE, JUMP, BINARY_MUL, BINARY_DIV, BINARY_MOD, BINARY_NE, BINARY_LE, BINARY_GT, \
+    BINARY_GE, BINARY_CONCAT, BINARY_AND, BINARY_OR, UNARY_NOT, UNARY_NEG, CALL, RETURN, POP, ECHO, LOAD_DEREF, \
+    STORE_DEREF, MAKE_FUNCTION, CALL_MEMO, TAIL_CALL, MEMO_STORE
+
+# what execute returns when a cooperative run stops to let others go
+SUSPENDED = object()
+
+# steps between the pauses of a cooperative run
+DEFAULT_YIELD_STEPS = 100
+
+# A memoized call that misses returns into this, in a frame holding the cache
+# and the key, so the result is stored without leaving the dispatch loop.
+MEMO_STORE_CODE = CodeObject("<memo store>", 0, 2)
+MEMO_STORE_CODE.instructions = (MEMO_STORE, 0, RETURN, 0)
+MEMO_STORE_CODE.constants = ()
+
+class VM:
+    def __init__(self, output=None, memo=None, limits=None, yield_every=None):
+        self.globals = None
+        self.pool = FramePool(output)
+        self.memo = memo
+        self.limits = limits
+        self.steps_left = limits.budgets()[0] if limits is not None else math.inf
+        # A cooperative run stops every yield_every steps and after each echo,
+        # resume() carries on from where it stopped.
+        self.yield_every = yield_every
+        self.suspended = None
+
+    def run(self, code, inputs=()):
+        frame = Frame(code.num_slots, None, self.pool)
+        frame.slots[:len(inputs)] = inputs
+        self.globals = frame
+
+        return self.execute(code, frame)
+
+    def resume(self):
+        state, self.suspended = self.suspended, None
+        return self.execute(state[0], state[2], state)
+
+    def take_steps(self):
+        # the rest of the step limit, or a slice of it for a cooperative run
+        steps = min(self.steps_left, self.yield_every or math.inf)
+        self.steps_left -= steps
+        return steps
+
+    def run_top_level(self, code):
+        # the module frame outlives each chunk and grows as globals are declared
+        if self.globals is None:
+            self.globals = Frame(code.num_slots, None, self.pool)
+        else:
+            slots = self.globals.slots
+            slots.extend([None] * (code.num_slots - len(slots)))
+
+        return self.execute(code, self.globals)
+
+    def execute(self, code, frame, state=None):
+        # The dispatch chain tests the opcode on every instruction, locals are
+        # much cheaper to load there than module globals.
+        _LOAD_LOCAL = LOAD_LOCAL
+        _LOAD_CONST = LOAD_CONST
+        _STORE_LOCAL = STORE_LOCAL
+        _LOAD_GLOBAL = LOAD_GLOBAL
+        _STORE_GLOBAL = STORE_GLOBAL
+        _BINARY_ADD = BINARY_ADD
+        _BINARY_SUB = BINARY_SUB
+        _BINARY_LT = BINARY_LT
+        _BINARY_EQ = BINARY_EQ
+        _POP_JUMP_IF_FALSE = POP_JUMP_IF_FALSE
+        _POP_JUMP_IF_TRUE = POP_JUMP_IF_TRUE
+        _JUMP = JUMP
+        _BINARY_MUL = BINARY_MUL
+        _BINARY_DIV = BINARY_DIV
+        _BINARY_MOD = BINARY_MOD
+        _BINARY_NE = BINARY_NE
+        _BINARY_LE = BINARY_LE
+        _BINARY_GT = BINARY_GT
+        _BINARY_GE = BINARY_GE
+        _BINARY_CONCAT = BINARY_CONCAT
+        _BINARY_AND = BINARY_AND
+        _BINARY_OR = BINARY_OR
+        _UNARY_NOT = UNARY_NOT
+        _UNARY_NEG = UNARY_NEG
+        _CALL = CALL
+        _RETURN = RETURN
+        _POP = POP
+        _ECHO = ECHO
+        _LOAD_DEREF = LOAD_DEREF
+        _STORE_DEREF = STORE_DEREF
+        _MAKE_FUNCTION = MAKE_FUNCTION
+        _CALL_MEMO = CALL_MEMO
+        _TAIL_CALL = TAIL_CALL
+        _MEMO_STORE = MEMO_STORE
+        echo = self.pool.output.echo
+
+        # Limited and cooperative runs spend steps where a run can go on for
+        # ever: the loop back-edge and calls. Other runs pay a single test there.
+        limits = self.limits
+        cooperative = self.yield_every is not None
+        metered = limits is not None or cooperative
+        _, max_depth, max_string = limits.budgets() if limits is not None else (None, math.inf, math.inf)
+
+        if state is None:
+            stack = []
+            calls = []
+            pc = 0
+            steps = self.take_steps() if metered else None
+        else:
+            # picking up a suspended run
+            code, pc, frame, stack, calls, steps = state
+
+        instructions = code.instructions
+        constants = code.constants
+        slots = frame.slots
+        global_slots = self.globals.slots
+        pool = self.pool
+        free_frames = pool.free
+        push = stack.append
+        pop = stack.pop
+
+        while True:
+            op = instructions[pc]
+            arg = instructions[pc + 1]
+            pc += 2
+
+            if op == _LOAD_LOCAL:
+                push(slots[arg])
+            elif op == _LOAD_CONST:
+                push(constants[arg])
+            elif op == _STORE_LOCAL:
+                slots[arg] = pop()
+            elif op == _LOAD_GLOBAL:
+                push(global_slots[arg])
+            elif op == _STORE_GLOBAL:
+                global_slots[arg] = pop()
+            elif op == _BINARY_ADD:
+                rhs = pop()
+                stack[-1] = stack[-1] + rhs
+            elif op == _BINARY_SUB:
+                rhs = pop()
+                stack[-1] = stack[-1] - rhs
+            elif op == _BINARY_LT:
+                rhs = pop()
+                stack[-1] = stack[-1] < rhs
+            elif op == _BINARY_EQ:
+                rhs = pop()
+                stack[-1] = stack[-1] == rhs
+            elif op == _POP_JUMP_IF_FALSE:
+                if not pop():
+                    pc = arg
+            elif op == _POP_JUMP_IF_TRUE:
+                if pop():
+                    pc = arg
+                    # only the bottom of a loop jumps when true, one step an iteration
+                    if metered:
+                        steps -= 1
+                        if steps < 0:
+                            steps = self.take_steps() - 1
+                            if steps < 0:
+                                raise step_limit_error(None, limits)
+
+                            if cooperative:
+                                self.suspended = (code, pc, frame, stack, calls, steps)
+                                return SUSPENDED
+            elif op == _JUMP:
+                pc = arg
+            elif op == _BINARY_MUL:
+                rhs = pop()
+                stack[-1] = stack[-1] * rhs
+            elif op == _BINARY_DIV:
+                rhs = pop()
+                stack[-1] = stack[-1] / rhs
+            elif op == _BINARY_MOD:
+                rhs = pop()
+                stack[-1] = stack[-1] % rhs
+            elif op == _BINARY_NE:
+                rhs = pop()
+                stack[-1] = stack[-1] != rhs
+            elif op == _BINARY_LE:
+                rhs = pop()
+                stack[-1] = stack[-1] <= rhs
+            elif op == _BINARY_GT:
+                rhs = pop()
+                stack[-1] = stack[-1] > rhs
+            elif op == _BINARY_GE:
+                rhs = pop()
+                stack[-1] = stack[-1] >= rhs
+            elif op == _BINARY_CONCAT:
+                rhs = pop()
+                value = stack[-1] = concat(stack[-1], rhs)
+                if metered and len(value) > max_string:
+                    raise string_limit_error(None, limits, len(value))
+            elif op == _BINARY_AND:
+                rhs = pop()
+                stack[-1] = stack[-1] and rhs
+            elif op == _BINARY_OR:
+                rhs = pop()
+                stack[-1] = stack[-1] or rhs
+            elif op == _UNARY_NOT:
+                stack[-1] = not stack[-1]
+            elif op == _UNARY_NEG:
+                stack[-1] = -stack[-1]
+            elif op == _CALL:
+                if metered and len(calls) >= max_depth:
+                    raise depth_limit_error(None, limits)
+
+                fn = stack[-arg - 1]
+                callee_code = fn.code
+
+                # inlined FramePool.acquire, calls are hot enough to matter
+                frames = free_frames.get(callee_code.num_slots)
+                if frames:
+                    callee = frames.pop()
+                    callee.parent = fn.parent_frame
+                else:
+                    callee = Frame(callee_code.num_slots, fn.parent_frame, pool)
+
+                if arg:
+                    callee.slots[:arg] = stack[-arg:]
+
+                del stack[-arg - 1:]
+                calls.append((code, pc, frame))
+                code = callee_code
+                instructions = code.instructions
+                constants = code.constants
+                frame = callee
+                slots = callee.slots
+                pc = 0
+
+                # spent once the callee is set up, so a pause resumes inside it
+                if metered:
+                    steps -= 1
+                    if steps < 0:
+                        steps = self.take_steps() - 1
+                        if steps < 0:
+                            raise step_limit_error(None, limits)
+
+                        if cooperative:
+                            self.suspended = (code, pc, frame, stack, calls, steps)
+                            return SUSPENDED
+            elif op == _RETURN:
+                if not calls:
+                    return pop()
+
+                pool.release(frame)
+                code, pc, frame = calls.pop()
+                instructions = code.instructions
+                constants = code.constants
+                slots = frame.slots
+            elif op == _TAIL_CALL:
+                fn = stack[-arg - 1]
+                callee_code = fn.code
+
+                # The returning frame is done with, unless the callee was declared
+                # in it. The outermost frame of this run belongs to whoever started it.
+                if calls and fn.parent_frame is not frame:
+                    pool.release(frame)
+
+                frames = free_frames.get(callee_code.num_slots)
+                if frames:
+                    callee = frames.pop()
+                    callee.parent = fn.parent_frame
+                else:
+                    callee = Frame(callee_code.num_slots, fn.parent_frame, pool)
+
+                if arg:
+                    callee.slots[:arg] = stack[-arg:]
+
+                del stack[-arg - 1:]
+                code = callee_code
+                instructions = code.instructions
+                constants = code.constants
+                frame = callee
+                slots = callee.slots
+                pc = 0
+
+                if metered:
+                    steps -= 1
+                    if steps < 0:
+                        steps = self.take_steps() - 1
+                        if steps < 0:
+                            raise step_limit_error(None, limits)
+
+                        if cooperative:
+                            self.suspended = (code, pc, frame, stack, calls, steps)
+                            return SUSPENDED
+            elif op == _POP:
+                pop()
+            elif op == _ECHO:
+                echo(pop())
+                # a cooperative run hands each line over as it is echoed
+                if cooperative:
+                    self.suspended = (code, pc, frame, stack, calls, steps)
+                    return SUSPENDED
+            elif op == _LOAD_DEREF:
+                push(frame.ancestor(arg >> DEREF_SHIFT).slots[arg & DEREF_MASK])
+            elif op == _STORE_DEREF:
+                frame.ancestor(arg >> DEREF_SHIFT).slots[arg & DEREF_MASK] = pop()
+            elif op == _MAKE_FUNCTION:
+                push(Function(constants[arg], frame))
+            elif op == _CALL_MEMO:
+                fn = stack[-arg - 1]
+                callee_code = fn.code
+                arguments = stack[-arg:] if arg else []
+                del stack[-arg - 1:]
+
+                cache = self.memo.cache_for(callee_code)
+                key = memo_key(arguments)
+                result = cache.lookup(key)
+                if result is not MISSING:
+                    push(result)
+                    continue
+
+                if metered and len(calls) >= max_depth:
+                    raise depth_limit_error(None, limits)
+
+                # the callee returns into MEMO_STORE_CODE, which stores the
+                # result and returns on to this frame
+                store = pool.acquire(2, None)
+                store.slots[0] = cache
+                store.slots[1] = key
+                calls.append((code, pc, frame))
+                calls.append((MEMO_STORE_CODE, 0, store))
+
+                callee = pool.acquire(callee_code.num_slots, fn.parent_frame)
+                callee.slots[:arg] = arguments
+                code = callee_code
+                instructions = code.instructions
+                constants = code.constants
+                frame = callee
+                slots = callee.slots
+                pc = 0
+
+                if metered:
+                    steps -= 1
+                    if steps < 0:
+                        steps = self.take_steps() - 1
+                        if steps < 0:
+                            raise step_limit_error(None, limits)
+
+                        if cooperative:
+                            self.suspended = (code, pc, frame, stack, calls, steps)
+                            return SUSPENDED
+            elif op == _MEMO_STORE:
+                slots[0].store(slots[1], stack[-1])
+            else:
+                raise QwrkRuntimeError(None, f"Unknown opcode ({op})")
+
+# the python value an input global of each type takes
+INPUT_PYTHON_TYPES = {
+    LiteralType.type_i32: int,
+    LiteralType.type_f32: float,
+    LiteralType.type_bool: bool,
+    LiteralType.type_string: str,
+}
+
+def input_type(type_name):
+    # an input is declared with the name of a qwrk type, i32, f32, bool or string
+    if isinstance(type_name, LiteralType):
+        return type_name
+
+    literal_type = token_to_literal_type(RESERVED_WORDS.get(type_name))
+    if literal_type is None:
+        raise ValueError(f"unknown input type ({type_name}), expected one of i32, f32, bool, string")
+
+    return literal_type
+
+def input_value(name, literal_type, value):
+    if literal_type == LiteralType.type_f32 and type(value) is int:
+        value = float(value)
+
+    # exact types, a python bool is an int but never a qwrk i32
+    if type(value) is not INPUT_PYTHON_TYPES[literal_type]:
+        raise TypeError(f"input ({name}) takes {INPUT_PYTHON_TYPES[literal_type].__name__}, got {type(value).__name__}")
+
+    return value
+
+class Program:
+    # Compiled once and never changed by running it: the bytecode is frozen
+    # and every run gets its own VM, frames and output. A Program can be run
+    # any number of times, from many threads at once.
+    __slots__ = ('code', 'inputs', 'limits')
+
+    def __init__(self, code, inputs=(), limits=None):
+        self.code = freeze_code(code)
+        # (name, type) of each input global, in slot order
+        self.inputs = tuple(inputs)
+        # every run gets the whole of these budgets
+        self.limits = limits
+
+    def bind_inputs(self, values):
+        unknown = set(values) - {name for name, _ in self.inputs}
+        if unknown:
+            raise ValueError(f"unknown input ({', '.join(sorted(unknown))})")
+
+        bound = []
+        for name, literal_type in self.inputs:
+            if name not in values:
+                raise ValueError(f"missing input ({name})")
+
+            bound.append(input_value(name, literal_type, values[name]))
+
+        return bound
+
+    def run(self, inputs=None, output=None):
+        values = self.bind_inputs(inputs if inputs is not None else {})
+        if output is None:
+            output = default_output()
+
+        try:
+            VM(output, limits=self.limits).run(self.code, values)
+        finally:
+            output.flush()
+
+    async def run_async(self, inputs=None, output=None, yield_every=DEFAULT_YIELD_STEPS):
+        # Runs without holding the event loop: the run stops every yield_every
+        # steps to let other tasks go, and after each echo to await the output,
+        # an AsyncOutputSink or a plain sink that is wrapped as one.
+        if yield_every < 1:
+            raise ValueError(f"yield_every must be at least 1 ({yield_every})")
+
+        values = self.bind_inputs(inputs if inputs is not None else {})
+        if output is None:
+            output = default_output()
+
+        if not isinstance(output, AsyncOutputSink):
+            output = AsyncWrappedSink(output)
+
+        echoed = EchoQueue()
+        vm = VM(echoed, limits=self.limits, yield_every=yield_every)
+        try:
+            result = vm.run(self.code, values)
+            while result is SUSPENDED:
+                if echoed.values:
+                    await self.deliver(echoed, output)
+                else:
+                    await asyncio.sleep(0)
+
+                result = vm.resume()
+        finally:
+            # what was echoed before an error still comes out
+            await self.deliver(echoed, output)
+            await output.flush()
+
+    async def deliver(self, echoed, output):
+        for value in echoed.values:
+            await output.echo(value)
+
+        echoed.values.clear()
 
 class Interpreter:
-    def __init__(self, ast_root):
+    # The interpreter owns the output sink and flushes it when a run ends,
+    # however it ends.
+    def __init__(self, ast_root, output=None):
         self.root = ast_root
-        self.glob_vars = ASTContext()
+        self.hooks = {}
+        self.memo = None
+        self.limits = None
+        self.output = output if output is not None else default_output()
+
+    def add_hook(self, event, callback):
+        if event not in HOOK_EVENTS:
+            raise ValueError(f"unknown hook ({event}), expected one of {', '.join(HOOK_EVENTS)}")
+
+        self.hooks.setdefault(event, []).append(callback)
+
+    def enable_memoization(self, maxsize=DEFAULT_MEMO_SIZE):
+        # calls to pure functions are answered from a bounded cache, the
+        # returned table keeps the hit and miss counts
+        self.memo = MemoTable(maxsize)
+        return self.memo
+
+    def set_limits(self, max_steps=None, max_depth=None, max_string=None):
+        # a run that goes over one of these stops with a QwrkRuntimeError
+        self.limits = Limits(max_steps, max_depth, max_string)
+        return self.limits
+
+    def prepare(self, optimize_ast=True, debug=False, inputs=()):
+        resolve(self.root, inputs)
+        check(self.root)
+        if optimize_ast:
+            optimize(self.root, debug)
+
+        if self.memo is not None:
+            analyze_purity(self.root)
+
+    def compile(self, optimize_ast=True, debug=False):
+        self.prepare(optimize_ast, debug)
+        return compile_program(self.root, self.memo is not None)
+
+    def compile_program(self, inputs=None, optimize_ast=True, debug=False):
+        # Compiles the tree into a Program, inputs maps the names of globals
+        # the program reads without declaring to their types. The tree is used
+        # up by this, later runs go through the Program.
+        if self.hooks or self.memo is not None:
+            raise ValueError("a Program runs on the vm, it has no hooks or memoization")
+
+        declared = [(name, input_type(type_name)) for name, type_name in (inputs or {}).items()]
+        self.prepare(optimize_ast, debug, declared)
+        return Program(compile_program(self.root), declared, self.limits)
+
+    def evaluate_tree(self):
+        frame = Frame(self.root.frame_size, None, FramePool(self.output))
+        if not self.hooks and self.memo is None and self.limits is None:
+            self.root.evaluate(frame)
+            return
+
+        swapped = instrument(self.root, self.hooks) if self.hooks else []
+        if self.memo is not None:
+            swapped += memoize_calls(self.root, self.memo)
+
+        if self.limits is not None:
+            swapped += meter(self.root, self.limits)
+
+        try:
+            self.root.evaluate(frame)
+        finally:
+            uninstrument(swapped)
+
+    def run(self, engine="vm", optimize_ast=True, debug=False):
+        if self.hooks and engine != "tree":
+            raise ValueError(f"hooks are only supported by the tree engine, not {engine}")
+
+        if self.memo is not None:
+            if engine not in ("vm", "tree"):
+                raise ValueError(f"memoization is only supported by the vm and tree engines, not {engine}")
+
+            if "on_call" in self.hooks or "on_return" in self.hooks:
+                raise ValueError("memoized calls would skip on_call and on_return hooks")
+
+        if self.limits is not None:
+            if engine not in ("vm", "tree"):
+                raise ValueError(f"limits are only enforced by the vm and tree engines, not {engine}")
+
+            if self.hooks or self.memo is not None:
+                raise ValueError("limits cannot be combined with hooks or memoization")
+
+        try:
+            self.run_engine(engine, optimize_ast, debug)
+        finally:
+            self.output.flush()
+
+    def run_engine(self, engine, optimize_ast, debug):
+        if engine == "tree" or engine == "closure":
+            self.prepare(optimize_ast, debug)
+            try:
+                if engine == "tree":
+                    self.evaluate_tree()
+                else:
+                    run_closures(self.root, output=self.output)
+            except RecursionError:
+                # deep recursion, or calls nested deep in each other's arguments
+                raise QwrkRuntimeError(None, f"Calls nested too deeply for the {engine} engine") from None
+            return
+
+        if engine == "python":
+            self.prepare(optimize_ast, debug)
+            run_python(transpile(self.root), self.output)
+            return
+
+        run_code(self.compile(optimize_ast, debug), self.output, self.memo, self.limits)
+
+    def profile(self, profiler=None, optimize_ast=True, debug=False):
+        # profiled runs always use the closure engine, it is the one instrumented
+        self.prepare(optimize_ast, debug)
+        try:
+            return run_profiled(self.root, profiler, self.output)
+        finally:
+            self.output.flush()
+
+class IncrementalInterpreter:
+    # Runs top-level statements as they arrive against globals that persist
+    # between them. Function declarations are held back until the next other
+    # statement, so functions declared together can call each other, and one
+    # naming a global declared further on is held until that is declared.
+    def __init__(self, engine="vm", optimize_ast=True, debug=False, output=None):
+        if engine not in ("vm", "tree", "closure"):
+            raise ValueError(f"Engine ({engine}) cannot run statements incrementally")
+
+        self.root = ASTRoot()
+        self.engine = engine
+        self.optimize_ast = optimize_ast
+        self.resolver = Resolver()
+        self.resolver.begin_program(self.root)
+        self.checker = TypeChecker()
+        self.optimizer = Optimizer(debug)
+        self.output = output if output is not None else default_output()
+        self.vm = VM(self.output)
+        self.frame = Frame(0, None, FramePool(self.output))
+        self.closure_compiler = ClosureCompiler(self.frame)
+        self.held = []
+
+    def feed(self, stmt):
+        self.resolver.resolve_stmt(stmt, self.root.context)
+        self.held.append(stmt)
+
+        if stmt.kind != ASTNodeKind.ast_fn_decl:
+            self.flush(defer_undefined=True)
+
+    def run_entry(self, statements):
+        # An entry is applied whole or not at all. Like a program, all of it is
+        # resolved and checked before any of it runs, so a static error has no
+        # effects, and after an error while running, the names it declared and
+        # the globals it set are put back as they were.
+        saved = self.save_state()
+        try:
+            for stmt in statements:
+                self.resolver.resolve_stmt(stmt, self.root.context)
+
+            self.held.extend(statements)
+            if self.held:
+                self.flush()
+        except BaseException:
+            self.restore_state(saved)
+            raise
+
+    def global_slots(self):
+        if self.engine != "vm":
+            return self.frame.slots
+
+        return self.vm.globals.slots if self.vm.globals is not None else []
+
+    def save_state(self):
+        resolver = self.resolver
+        return (dict(self.root.context.variables), resolver.layout, resolver.layout.size, list(resolver.pending),
+                list(self.held), list(self.global_slots()))
+
+    def restore_state(self, saved):
+        variables, layout, size, pending, held, slots = saved
+        self.root.context.variables.clear()
+        self.root.context.variables.update(variables)
+
+        # an error while resolving a function body leaves its layout current
+        resolver = self.resolver
+        resolver.layout = layout
+        layout.size = size
+        resolver.pending = pending
+        self.root.frame_size = size
+        self.checker.return_types.clear()
+
+        self.held = held
+        # in place, compiled closures and the vm hold on to this very list
+        self.global_slots()[:] = slots
+
+    def waiting_functions(self, deferred):
+        # the symbols of functions that cannot run yet, and the name each waits
+        # on, including those that call one of them
+        waiting = {declaration.symbol: name for declaration, name in deferred}
+        resolved = [stmt for stmt in self.held if stmt.kind == ASTNodeKind.ast_fn_decl and stmt.symbol not in waiting]
+
+        changed = bool(waiting)
+        while changed:
+            changed = False
+            for declaration in resolved:
+                if declaration.symbol in waiting:
+                    continue
+
+                for node in iter_nodes(declaration.body):
+                    if node.kind == ASTNodeKind.ast_fn_call and node.symbol in waiting:
+                        waiting[declaration.symbol] = waiting[node.symbol]
+                        changed = True
+                        break
+
+        return waiting
+
+    def finish(self):
+        try:
+            if self.held:
+                self.flush()
+        finally:
+            self.output.flush()
+
+    def flush(self, defer_undefined=False):
+        waiting = self.waiting_functions(self.resolver.flush_pending(defer_undefined))
+        statements, self.held = self.held, []
+
+        if waiting:
+            # those stay held, and nothing that runs now may call them
+            self.held = [stmt for stmt in statements if stmt.kind == ASTNodeKind.ast_fn_decl and stmt.symbol in waiting]
+            self.resolver.pending = list(self.held)
+            statements = [stmt for stmt in statements if stmt.kind != ASTNodeKind.ast_fn_decl or stmt.symbol not in waiting]
+
+            for stmt in statements:
+                for node in iter_nodes(stmt):
+                    if node.kind == ASTNodeKind.ast_fn_call and node.symbol in waiting:
+                        raise QwrkRuntimeError(node, f"Function ({node.name}) is called before ({waiting[node.symbol]}) is declared")
+
+        for stmt in statements:
+            self.checker.check_stmt(stmt)
+
+        if self.optimize_ast:
+            optimized = (self.optimizer.optimize_top_level(stmt, self.root) for stmt in statements)
+            statements = [stmt for stmt in optimized if stmt is not None]
+
+        num_slots = self.resolver.layout.size
+        self.root.frame_size = num_slots
+
+        if self.engine == "tree" or self.engine == "closure":
+            # grown in place, compiled closures hold on to this very list
+            slots = self.frame.slots
+            slots.extend([None] * (num_slots - len(slots)))
+
+            if self.engine == "tree":
+                for stmt in statements:
+                    stmt.evaluate(self.frame)
+            else:
+                self.closure_compiler.compile_statements(statements)(self.frame)
+            return
+
+        self.vm.run_top_level(compile_top_level(statements, num_slots))
+
+def run_code(code, output=None, memo=None, limits=None):
+    VM(output, memo, limits).run(code)
+
+async def interpret_async(program, inputs=None, output=None, yield_every=DEFAULT_YIELD_STEPS):
+    # for many scripts at once in one asyncio service, program is a Program
+    # from Interpreter.compile_program
+    await program.run_async(inputs, output, yield_every)
 
-def interpret(ast_root):
-    interpreter = Interpreter(ast_root)
+def interpret(ast_root, engine="vm", optimize_ast=True, debug=False, output=None, limits=None):
+    interpreter = Interpreter(ast_root, output)
+    interpreter.limits = limits
 
-    interpreter.root.evaluate()
\ No newline at end of file
+    interpreter.run(engine, optimize_ast, debug)
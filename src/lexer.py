@@ -1,4 +1,7 @@
-from tokens import TokenKind, Token
+import gc
+import re
+
+from tokens import TokenKind, Token, TokenArray
 
 RESERVED_WORDS = {
     "true": TokenKind.tok_true,
@@ -15,6 +18,71 @@ RESERVED_WORDS = {
     "fn": TokenKind.tok_key_fn
 }
 
+# Every operator and delimiter, the master regex tries longer spellings first
+# so "++" wins over "+" (maximal munch).
+OPERATOR_TABLE = {
+    "++": TokenKind.tok_concat,
+    "->": TokenKind.tok_arrow,
+    ">=": TokenKind.tok_gt_equal,
+    "<=": TokenKind.tok_lt_equal,
+    "!=": TokenKind.tok_not_equal,
+    "==": TokenKind.tok_equal,
+    "&&": TokenKind.tok_and_op,
+    "||": TokenKind.tok_or_op,
+    "/": TokenKind.tok_fslash,
+    "+": TokenKind.tok_plus,
+    "-": TokenKind.tok_dash,
+    "*": TokenKind.tok_star,
+    "%": TokenKind.tok_percent,
+    "(": TokenKind.tok_open_paren,
+    ")": TokenKind.tok_close_paren,
+    "{": TokenKind.tok_open_brace,
+    "}": TokenKind.tok_close_brace,
+    ";": TokenKind.tok_semi,
+    ":": TokenKind.tok_colon,
+    ",": TokenKind.tok_comma,
+    ">": TokenKind.tok_gt,
+    "<": TokenKind.tok_lt,
+    "!": TokenKind.tok_not_op,
+    "=": TokenKind.tok_assign,
+    "&": TokenKind.tok_bit_and_op,
+    "|": TokenKind.tok_bit_or_op,
+}
+
+# group numbers of the master regex, matched through Match.lastindex
+GROUP_WORD = 1
+GROUP_NUMBER = 2
+GROUP_STRING = 3
+GROUP_OPERATOR = 4
+GROUP_ERROR = 5
+
+# Leading whitespace is folded into every match, so one match is one token,
+# only trailing whitespace at the very end matches without a group.
+MASTER_PATTERN = re.compile(r"\s*(?:" + "|".join([
+    r"([^\W\d_]\w*)",
+    r"(\d+(?:\.\d*)?)",
+    r'"([^"]*)(?:"|\Z)',
+    "(" + "|".join(re.escape(op) for op in sorted(OPERATOR_TABLE, key=len, reverse=True)) + ")",
+    r"(\S)",
+]) + ")?")
+
+# the same tables as int kind codes, for TokenArray
+RESERVED_WORD_CODES = {word: kind.value[0] for word, kind in RESERVED_WORDS.items()}
+OPERATOR_CODES = {op: kind.value[0] for op, kind in OPERATOR_TABLE.items()}
+
+def offset_position(src, end):
+    line_start = src.rfind('\n', 0, end) + 1
+    if line_start == 0:
+        return 0, end + 1
+
+    return src.count('\n', 0, end), end - line_start
+
+class LexError(RuntimeError):
+    def __init__(self, line, column, message):
+        super().__init__(message)
+        self.line = line
+        self.column = column
+
 class Lexer:
     def __init__(self, src):
         self.src = src
@@ -185,10 +253,149 @@ class Lexer:
 
         return tokens
 
+class RegexLexer:
+    # Produces the same tokens as Lexer, but scans whole runs of whitespace,
+    # words, numbers, strings and operators with one regex match each.
+    def __init__(self, src):
+        self.src = src
+
+    def tokenize(self):
+        # Tokens cannot form reference cycles, so no collection could free one,
+        # yet every collection the allocations set off would walk the list again.
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return list(self.iter_tokens())
+        finally:
+            if enabled:
+                gc.enable()
+
+    def iter_tokens(self, first_line=0):
+        src = self.src
+        reserved_words = RESERVED_WORDS
+        operators = OPERATOR_TABLE
+        tok_id = TokenKind.tok_id
+        tok_int = TokenKind.tok_int
+        tok_float = TokenKind.tok_float
+        tok_string = TokenKind.tok_string
+
+        # Token positions are taken after the token is consumed, lines count
+        # from 0 and the first line's columns are one ahead, like Lexer.
+        # Newlines are found lazily so tokens can be pulled one at a time.
+        # Source that starts further into a file starts at the top of a line.
+        line = first_line
+        line_start = -1 if first_line == 0 else 0
+        next_newline = src.find('\n')
+        if next_newline < 0:
+            next_newline = len(src)
+
+        for match in MASTER_PATTERN.finditer(src):
+            group = match.lastindex
+            if group is None:
+                return
+
+            end = match.end()
+            while next_newline < end:
+                line_start = next_newline + 1
+                line += 1
+                next_newline = src.find('\n', line_start)
+                if next_newline < 0:
+                    next_newline = len(src)
+
+            if group == GROUP_WORD:
+                value = match[1]
+                yield Token(reserved_words.get(value, tok_id), value, line, end - line_start)
+            elif group == GROUP_OPERATOR:
+                value = match[4]
+                yield Token(operators[value], value, line, end - line_start)
+            elif group == GROUP_NUMBER:
+                value = match[2]
+                yield Token(tok_float if '.' in value else tok_int, value, line, end - line_start)
+            elif group == GROUP_STRING:
+                if end == match.end(3):
+                    raise LexError(line, end - line_start, "Unterminated string literal")
+
+                yield Token(tok_string, match[3], line, end - line_start)
+            else:
+                raise LexError(line, end - line_start, f"Unexpected character ({match[5]!r})")
+
+    def tokenize_compact(self):
+        src = self.src
+        tokens = TokenArray(src)
+        append_kind = tokens.kinds.append
+        append_start = tokens.starts.append
+        append_end = tokens.ends.append
+        word_codes = RESERVED_WORD_CODES
+        operator_codes = OPERATOR_CODES
+        id_code = TokenKind.tok_id.value[0]
+        int_code = TokenKind.tok_int.value[0]
+        float_code = TokenKind.tok_float.value[0]
+        string_code = TokenKind.tok_string.value[0]
+
+        for match in MASTER_PATTERN.finditer(src):
+            group = match.lastindex
+            if group is None:
+                break
+
+            if group == GROUP_WORD:
+                append_kind(word_codes.get(match[1], id_code))
+            elif group == GROUP_OPERATOR:
+                append_kind(operator_codes[match[4]])
+            elif group == GROUP_NUMBER:
+                append_kind(float_code if '.' in match[2] else int_code)
+            elif group == GROUP_STRING:
+                end = match.end()
+                if end == match.end(3):
+                    raise LexError(*offset_position(src, end), "Unterminated string literal")
+
+                append_kind(string_code)
+            else:
+                raise LexError(*offset_position(src, match.end()), f"Unexpected character ({match[5]!r})")
+
+            start, end = match.span(group)
+            append_start(start)
+            append_end(end)
+
+        return tokens
+
 def lex(file_path):
-    lexer = Lexer(file_path)
+    lexer = RegexLexer(file_path)
     tokens = lexer.tokenize()
     # for token in tokens:
     #     print(token)
 
     return tokens
+
+def lex_lines(lines):
+    # Tokens from source read a line at a time, such as an open file, with
+    # the positions lexing it whole would give. A string literal still open
+    # at the end of a line takes the lines after it until it is closed.
+    chunk = ""
+    first_line = 0
+    for text in lines:
+        chunk += text
+        # literals have no escapes, an odd count of quotes leaves one open
+        if chunk.count('"') % 2:
+            continue
+
+        yield from RegexLexer(chunk).iter_tokens(first_line)
+        first_line += chunk.count('\n')
+        chunk = ""
+
+    if chunk:
+        yield from RegexLexer(chunk).iter_tokens(first_line)
+
+def lex_compact(src):
+    lexer = RegexLexer(src)
+    return lexer.tokenize_compact()
+
+# from this size a whole source is lexed to a TokenArray, Token objects for
+# it would take around fifteen times the memory
+COMPACT_SOURCE_SIZE = 256 * 1024
+
+def lex_source(src):
+    # the tokens of a whole program, for parse
+    if len(src) >= COMPACT_SOURCE_SIZE:
+        return lex_compact(src)
+
+    return lex(src)
@@ -0,0 +1,171 @@
+import sys
+import math
+
+from rope import Rope, concat
+from qast import QwrkRuntimeError, OP_CONCAT, BINARY_FUNCTIONS, FunctionCall, WhileStmt, ReturnExpr, BinaryExpr, \
+    DeepBinaryExpr, DeepUnaryExpr, TailCall, run_tail_calls, evaluate_operators, iter_nodes
+
+class Limits:
+    # Budgets for running scripts that cannot be trusted, None leaves one
+    # unbounded. A step is spent on each loop iteration and each call, tail
+    # calls included. The depth counts calls still running, and capping the
+    # length of every string bounds the memory strings can take.
+    __slots__ = ('max_steps', 'max_depth', 'max_string')
+
+    def __init__(self, max_steps=None, max_depth=None, max_string=None):
+        for name, value in (("max_steps", max_steps), ("max_depth", max_depth), ("max_string", max_string)):
+            if value is not None and value < 0:
+                raise ValueError(f"{name} cannot be negative ({value})")
+
+        self.max_steps = max_steps
+        self.max_depth = max_depth
+        self.max_string = max_string
+
+    def budgets(self):
+        # the unbounded ones as infinity, so checking them never tests for None
+        return tuple(math.inf if value is None else value for value in (self.max_steps, self.max_depth, self.max_string))
+
+def step_limit_error(node, limits):
+    return QwrkRuntimeError(node, f"Step limit exceeded ({limits.max_steps})")
+
+def depth_limit_error(node, limits):
+    return QwrkRuntimeError(node, f"Call depth limit exceeded ({limits.max_depth})")
+
+def string_limit_error(node, limits, length):
+    return QwrkRuntimeError(node, f"String length limit exceeded ({length} > {limits.max_string})")
+
+def metered_classes(limits):
+    # Subclasses that spend from this run's budget, swapped in for a limited run the
+    # way hooks are, so unlimited runs never check anything. The step and
+    # depth budgets are ints, either running out makes their or negative,
+    # so a call tests both with one comparison.
+    steps = limits.max_steps if limits.max_steps is not None else sys.maxsize
+    depth_left = limits.max_depth if limits.max_depth is not None else sys.maxsize
+    max_string = limits.budgets()[2]
+
+    class MeteredWhileStmt(WhileStmt):
+        __slots__ = ()
+
+        def evaluate(self, frame):
+            nonlocal steps
+            while self.condition.evaluate(frame):
+                steps -= 1
+                if steps < 0:
+                    raise step_limit_error(self, limits)
+
+                result = self.body.evaluate(frame)
+                if result is not None:
+                    return result
+
+    class MeteredFunctionCall(FunctionCall):
+        __slots__ = ()
+
+        def evaluate(self, frame):
+            nonlocal steps, depth_left
+            fn = frame.ancestor(self.depth).slots[self.slot]
+            body = fn.code.body
+            pool = frame.pool
+
+            callee = pool.acquire(body.frame_size, fn.parent_frame)
+            slots = callee.slots
+            i = 0
+            for arg in self.arguments:
+                slots[i] = arg.evaluate(frame)
+                i += 1
+
+            steps -= 1
+            depth_left -= 1
+            if steps | depth_left < 0:
+                raise step_limit_error(self, limits) if steps < 0 else depth_limit_error(self, limits)
+
+            # an error ends the run and its budget, so the depth is only given back on the way out
+            result = body.evaluate(callee)
+            if type(result) is TailCall:
+                result = run_tail_calls(result, callee, pool)
+            else:
+                pool.release(callee)
+
+            depth_left += 1
+            return result
+
+    class MeteredReturnExpr(ReturnExpr):
+        __slots__ = ()
+
+        def evaluate(self, frame):
+            # only returns of a call are swapped, a tail call replaces this
+            # call so it costs a step but no depth
+            nonlocal steps
+            expr = self.expr
+            steps -= 1
+            if steps < 0:
+                raise step_limit_error(expr, limits)
+
+            fn = frame.ancestor(expr.depth).slots[expr.slot]
+            return (TailCall(fn, [arg.evaluate(frame) for arg in expr.arguments]),)
+
+    class MeteredConcatExpr(BinaryExpr):
+        __slots__ = ()
+
+        def evaluate(self, frame):
+            value = concat(self.lhs.evaluate(frame), self.rhs.evaluate(frame))
+            # a rope's length is a slot, len() would go through its __len__
+            length = value.length if type(value) is Rope else len(value)
+            if length > max_string:
+                raise string_limit_error(self, limits, length)
+
+            return value
+
+    def checked_concat(lhs, rhs):
+        value = concat(lhs, rhs)
+        length = value.length if type(value) is Rope else len(value)
+        if length > max_string:
+            raise string_limit_error(None, limits, length)
+
+        return value
+
+    # a deep tree runs its operators from a table, whatever its root, so the
+    # ++ anywhere inside it is checked through the table
+    functions = list(BINARY_FUNCTIONS)
+    functions[OP_CONCAT] = checked_concat
+    functions = tuple(functions)
+
+    class MeteredDeepBinaryExpr(DeepBinaryExpr):
+        __slots__ = ()
+
+        def evaluate(self, frame):
+            return evaluate_operators(self, frame, functions)
+
+    class MeteredDeepUnaryExpr(DeepUnaryExpr):
+        __slots__ = ()
+
+        def evaluate(self, frame):
+            return evaluate_operators(self, frame, functions)
+
+    return {
+        WhileStmt: MeteredWhileStmt,
+        FunctionCall: MeteredFunctionCall,
+        ReturnExpr: MeteredReturnExpr,
+        BinaryExpr: MeteredConcatExpr,
+        DeepBinaryExpr: MeteredDeepBinaryExpr,
+        DeepUnaryExpr: MeteredDeepUnaryExpr,
+    }
+
+def meter(root, limits):
+    # returns what hooks.uninstrument needs to put the tree back, only ++
+    # makes strings longer so only those operators are checked, and only a
+    # return of a call can spend a step
+    classes = metered_classes(limits)
+    swapped = []
+
+    for node in iter_nodes(root):
+        cls = classes.get(type(node))
+        if cls is None or (type(node) is BinaryExpr and node.op != OP_CONCAT):
+            continue
+
+        if type(node) is ReturnExpr and not isinstance(node.expr, FunctionCall):
+            continue
+
+        swapped.append((node, type(node)))
+        node.__class__ = cls
+
+    return swapped
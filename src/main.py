@@ -1,8 +1,18 @@
+import os
 import sys
+import time
+import argparse
 
-from lexer import lex
-from parser import parse
-from interpreter import interpret
+from lexer import lex_lines, lex_source
+from parser import parse, parse_iter
+from interpreter import interpret, run_code, Interpreter, IncrementalInterpreter
+from transpiler import transpile
+from cache import INTERPRETER_VERSION, cache_path, source_key, load_code, store_code
+from output import BUFFERING_MODES, StreamSink, default_output
+from repl import ReplSession, REPL_ERRORS
+from memo import DEFAULT_MEMO_SIZE
+from batch import STATUS_OK, collect_scripts, run_batch, print_result, print_summary
+from limits import Limits
 
 def get_file_content(file_path):
     with open(file_path, "r") as file:
@@ -11,32 +21,214 @@ def get_file_content(file_path):
     return content
 
 def print_usage():
-    print("USAGE: python src/main.py <file_to_run>")
+    print("USAGE: python src/main.py [--engine vm|tree|closure|python] [--emit-python] [--debug-optimizer] [--stream] [--no-cache] [--cache-dir DIR] [--profile] [--profile-collapsed FILE] [--buffering line|block|full] [--interactive] [--memoize] [--memo-size N] [--memo-stats] [--batch DIR|MANIFEST] [--jobs N] [--max-steps N] [--max-depth N] [--max-string N] <file_to_run>")
 
-def process(src):
-    tokens = lex(src)
+def parse_args(argv):
+    arg_parser = argparse.ArgumentParser(prog="qwrk", add_help=True)
+    arg_parser.add_argument("file", nargs="?")
+    arg_parser.add_argument("--engine", choices=("vm", "tree", "closure", "python"), default="vm", help="how the program is executed (default: vm)")
+    arg_parser.add_argument("--emit-python", action="store_true", help="print the python the program translates to instead of running it")
+    arg_parser.add_argument("--debug-optimizer", action="store_true", help="report what the optimizer folded and removed")
+    arg_parser.add_argument("--stream", action="store_true", help="run each top-level statement as soon as it is parsed")
+    arg_parser.add_argument("--no-cache", action="store_true", help="always compile from source, never read or write the bytecode cache")
+    arg_parser.add_argument("--cache-dir", default=None, help="where to keep cached bytecode (default: __qkcache__ next to the source)")
+    arg_parser.add_argument("--profile", action="store_true", help="report time spent per function, loop and line, tail calls nest in the function making them (runs on the closure engine)")
+    arg_parser.add_argument("--profile-collapsed", default=None, metavar="FILE", help="write collapsed stacks for flamegraph tools to FILE, implies --profile")
+    arg_parser.add_argument("--interactive", "-i", action="store_true", help="start a session that reads statements from the prompt")
+    arg_parser.add_argument("--buffering", choices=BUFFERING_MODES, default=None, help="when echo output is written (default: line on a terminal, block otherwise)")
+    arg_parser.add_argument("--memoize", action="store_true", help="cache the results of pure functions (vm and tree engines)")
+    arg_parser.add_argument("--memo-size", type=int, default=DEFAULT_MEMO_SIZE, metavar="N", help=f"results kept per function with --memoize (default: {DEFAULT_MEMO_SIZE})")
+    arg_parser.add_argument("--memo-stats", action="store_true", help="report memo hits and misses per function, implies --memoize")
+    arg_parser.add_argument("--batch", default=None, metavar="DIR|MANIFEST", help="run every script in DIR, or listed one per line in MANIFEST, and summarize")
+    arg_parser.add_argument("--jobs", "-j", type=int, default=None, metavar="N", help="worker processes for --batch (default: one per core)")
+    arg_parser.add_argument("--max-steps", type=int, default=None, metavar="N", help="stop a run after N loop iterations and calls (vm and tree engines, any limit slows call heavy code on the tree engine by 4-7%%)")
+    arg_parser.add_argument("--max-depth", type=int, default=None, metavar="N", help="stop a run that nests more than N calls (vm and tree engines)")
+    arg_parser.add_argument("--max-string", type=int, default=None, metavar="N", help="stop a run that builds a string longer than N (vm and tree engines)")
+
+    args = arg_parser.parse_args(argv)
+    if args.stream and args.engine == "python":
+        arg_parser.error("--stream cannot be used with the python engine")
+
+    if args.profile_collapsed:
+        args.profile = True
+
+    if args.profile and args.stream:
+        arg_parser.error("--profile cannot be used with --stream")
+
+    if args.memo_stats:
+        args.memoize = True
+
+    if args.memoize and (args.stream or args.profile or args.engine not in ("vm", "tree")):
+        arg_parser.error("--memoize needs the vm or tree engine and cannot be used with --stream or --profile")
+
+    if args.batch is not None:
+        if args.file is not None or args.interactive or args.emit_python:
+            arg_parser.error("--batch takes the place of a file to run")
+
+        if args.stream or args.profile or args.memoize or args.debug_optimizer:
+            arg_parser.error("--batch cannot be used with --stream, --profile, --memoize or --debug-optimizer")
+
+    if args.jobs is not None and args.jobs < 1:
+        arg_parser.error("--jobs must be at least 1")
+
+    limit_values = (args.max_steps, args.max_depth, args.max_string)
+    if any(value is not None and value < 0 for value in limit_values):
+        arg_parser.error("--max-steps, --max-depth and --max-string cannot be negative")
+
+    args.limits = Limits(*limit_values) if any(value is not None for value in limit_values) else None
+    if args.limits is not None and (args.engine not in ("vm", "tree") or args.stream or args.profile or args.memoize or args.interactive):
+        arg_parser.error("limits need the vm or tree engine and cannot be used with --stream, --profile, --memoize or --interactive")
+
+    return args
+
+def make_output(buffering=None):
+    if buffering is None:
+        return default_output()
+
+    return StreamSink(sys.stdout, buffering)
+
+def process(src, debug=False, engine="vm", output=None, limits=None):
+    tokens = lex_source(src)
     ast_root = parse(tokens)
-    interpret(ast_root)
+    interpret(ast_root, engine, debug=debug, output=output, limits=limits)
+
+def process_memoized(src, debug=False, engine="vm", output=None, memo_size=DEFAULT_MEMO_SIZE, memo_stats=False):
+    interpreter = Interpreter(parse(lex_source(src)), output)
+    memo = interpreter.enable_memoization(memo_size)
+    interpreter.run(engine, debug=debug)
+
+    if memo_stats:
+        memo.report()
+
+def process_stream(lines, debug=False, engine="vm", output=None):
+    # lines is any iterable of source lines, an open file is read as it runs
+    interpreter = IncrementalInterpreter(engine, debug=debug, output=output)
+    try:
+        for stmt in parse_iter(lex_lines(lines), interpreter.root):
+            interpreter.feed(stmt)
+
+        interpreter.finish()
+    finally:
+        # what earlier statements echoed still comes out when a later one fails
+        interpreter.output.flush()
+
+def process_cached(file_path, src, cache_dir=None, output=None, limits=None):
+    path = cache_path(file_path, cache_dir)
+    key = source_key(src)
+
+    code = load_code(path, key)
+    if code is None:
+        code = Interpreter(parse(lex_source(src))).compile()
+        store_code(path, key, code)
+
+    if output is None:
+        output = default_output()
+
+    try:
+        run_code(code, output, limits=limits)
+    finally:
+        output.flush()
+
+def profile_file(file_path, debug=False, collapsed_path=None, output=None):
+    src = get_file_content(file_path)
+    profiler = Interpreter(parse(lex_source(src)), output).profile(debug=debug)
+
+    profiler.report(src)
+    if collapsed_path is not None:
+        with open(collapsed_path, "w") as file:
+            profiler.write_collapsed(file)
+
+def emit_python(file_path, debug=False):
+    ast_root = parse(lex_source(get_file_content(file_path)))
+    Interpreter(ast_root).prepare(debug=debug)
+    print(transpile(ast_root), end="")
+
+def run_file(file_path, debug=False, stream=False, use_cache=True, cache_dir=None, engine="vm", output=None, memo_size=None, memo_stats=False, limits=None):
+    if stream and memo_size is None:
+        # the first statements run before the rest of the file is read
+        with open(file_path, "r") as file:
+            process_stream(file, debug, engine, output)
+        return
 
-def run_file(file_path):
     src = get_file_content(file_path)
-    process(src)
+    if memo_size is not None:
+        # memoized bytecode differs from the plain kind, it is never cached
+        process_memoized(src, debug, engine, output, memo_size, memo_stats)
+    elif use_cache and not debug and engine == "vm":
+        # the optimizer report needs the full pipeline, so debug runs skip the cache
+        process_cached(file_path, src, cache_dir, output, limits)
+    else:
+        process(src, debug, engine, output, limits)
+
+def process_batch(target, jobs=None, engine="vm", use_cache=True, cache_dir=None, limits=None):
+    # each script's output is printed as a whole once it finishes, in the
+    # order the scripts were listed, and the summary goes to stderr
+    scripts = collect_scripts(target)
+    jobs = jobs if jobs is not None else os.cpu_count() or 1
+    results = []
+
+    start = time.perf_counter()
+    for result in run_batch(scripts, jobs, engine, use_cache, cache_dir, limits):
+        print_result(result)
+        results.append(result)
+
+    sys.stdout.flush()
+    print_summary(results, time.perf_counter() - start, jobs)
+
+    return all(result.status == STATUS_OK for result in results)
 
-def run_interactive():
-    print("Welcome to the world of qwrk (0.0.1)...")
-    usr_input = ""
+def run_interactive(engine="vm", output=None):
+    print(f"Welcome to the world of qwrk ({INTERPRETER_VERSION})...")
+    session = ReplSession(engine, output=output)
 
     while True:
-        usr_input = input('> ')
-        if usr_input == "exit":
+        try:
+            usr_input = input('... ' if session.waiting else '> ')
+        except EOFError:
+            print()
             break
+        except KeyboardInterrupt:
+            # drops the entry being typed, like a shell
+            print()
+            session.reset_entry()
+            continue
 
-        process(usr_input)
+        if usr_input == "exit" and not session.waiting:
+            break
+
+        try:
+            session.feed_line(usr_input)
+        except REPL_ERRORS as error:
+            print(f"error: {error}", file=sys.stderr)
+        except Exception as error:
+            # the entry was rolled back, a bug in the interpreter is no reason to end the session
+            print(f"internal error: {type(error).__name__}: {error}", file=sys.stderr)
+
+    session.close()
 
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
+    args = parse_args(sys.argv[1:])
+    if args.interactive:
+        run_interactive(args.engine, make_output(args.buffering))
+        exit(0)
+
+    if args.batch is not None:
+        succeeded = process_batch(args.batch, args.jobs, args.engine, not args.no_cache, args.cache_dir, args.limits)
+        exit(0 if succeeded else 1)
+
+    if args.file is None:
         print_usage()
         exit(0)
 
-    run_file(sys.argv[1])
+    if args.emit_python:
+        emit_python(args.file, args.debug_optimizer)
+        exit(0)
+
+    output = make_output(args.buffering)
+    if args.profile:
+        profile_file(args.file, args.debug_optimizer, args.profile_collapsed, output)
+        exit(0)
+
+    memo_size = args.memo_size if args.memoize else None
+    run_file(args.file, args.debug_optimizer, args.stream, not args.no_cache, args.cache_dir, args.engine, output, memo_size, args.memo_stats, args.limits)
@@ -0,0 +1,112 @@
+import sys
+from collections import OrderedDict
+
+from qast import FunctionCall, TailCall, run_tail_calls, iter_nodes
+
+DEFAULT_MEMO_SIZE = 1024
+
+# stored results can be None, a function that runs off its end returns nothing
+MISSING = object()
+
+def memo_key(arguments):
+    # 2 and 2.0 are the same key to python but print differently, the types keep them apart
+    return (*arguments, *map(type, arguments))
+
+class LRUCache:
+    def __init__(self, name, maxsize):
+        self.name = name
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key):
+        value = self.entries.get(key, MISSING)
+        if value is MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+
+        return value
+
+    def store(self, key, value):
+        entries = self.entries
+        entries[key] = value
+        if len(entries) > self.maxsize:
+            entries.popitem(last=False)
+
+class MemoTable:
+    # One bounded cache per function, keyed by its code: the declaration for
+    # the tree walker, the CodeObject for the VM.
+    def __init__(self, maxsize=DEFAULT_MEMO_SIZE):
+        self.maxsize = maxsize
+        self.caches = {}
+
+    def cache_for(self, code):
+        cache = self.caches.get(code)
+        if cache is None:
+            cache = self.caches[code] = LRUCache(code.name, self.maxsize)
+
+        return cache
+
+    @property
+    def hits(self):
+        return sum(cache.hits for cache in self.caches.values())
+
+    @property
+    def misses(self):
+        return sum(cache.misses for cache in self.caches.values())
+
+    def stats(self):
+        return [(cache.name, cache.hits, cache.misses, len(cache.entries)) for cache in self.caches.values()]
+
+    def report(self, file=sys.stderr):
+        print(f"{'hits':>10} {'misses':>10} {'cached':>8}  function", file=file)
+        for name, hits, misses, size in sorted(self.stats(), key=lambda stat: stat[1] + stat[2], reverse=True):
+            print(f"{hits:>10} {misses:>10} {size:>8}  {name}", file=file)
+
+def memoized_call_class(memo):
+    class MemoizedFunctionCall(FunctionCall):
+        __slots__ = ()
+
+        def evaluate(self, frame):
+            fn = frame.ancestor(self.depth).slots[self.slot]
+            arguments = [arg.evaluate(frame) for arg in self.arguments]
+
+            cache = memo.cache_for(fn.code)
+            key = memo_key(arguments)
+            result = cache.lookup(key)
+            if result is not MISSING:
+                return result
+
+            # called the way FunctionCall.evaluate calls, so a miss nests no
+            # deeper in python than an uncached call would
+            body = fn.code.body
+            pool = frame.pool
+            callee = pool.acquire(body.frame_size, fn.parent_frame)
+            callee.slots[:len(arguments)] = arguments
+
+            result = body.evaluate(callee)
+            if type(result) is TailCall:
+                result = run_tail_calls(result, callee, pool)
+            else:
+                pool.release(callee)
+
+            cache.store(key, result)
+            return result
+
+    return MemoizedFunctionCall
+
+def memoize_calls(root, memo):
+    # switches calls to pure functions over to a cached implementation, the
+    # returned pairs are what hooks.uninstrument needs to switch them back
+    cls = memoized_call_class(memo)
+    swapped = []
+
+    for node in iter_nodes(root):
+        if type(node) is FunctionCall and node.symbol.pure:
+            swapped.append((node, FunctionCall))
+            node.__class__ = cls
+
+    return swapped
@@ -0,0 +1,203 @@
+import sys
+
+from qast import ASTNodeKind, LiteralType, Number, Boolean, String, OPERATOR_SPELLINGS, postorder
+from rope import materialize
+
+LITERAL_KINDS = (ASTNodeKind.ast_num, ASTNodeKind.ast_bool, ASTNodeKind.ast_str)
+
+# python type a folded value must have to be stored in a literal of that type
+LITERAL_PYTHON_TYPES = {
+    LiteralType.type_i32: int,
+    LiteralType.type_f32: float,
+    LiteralType.type_bool: bool,
+    LiteralType.type_string: str,
+}
+
+def make_literal(value, type, line=None):
+    if type == LiteralType.type_bool:
+        literal = Boolean("true" if value else "false")
+    elif type == LiteralType.type_string:
+        literal = String(value)
+    else:
+        literal = Number(value, type)
+
+    literal.line = line
+    return literal
+
+class Optimizer:
+    def __init__(self, debug=False):
+        self.debug = debug
+        self.report = []
+        self.constants = {}
+        self.unfolded_reads = set()
+        self.candidates = []
+
+    def note(self, message):
+        self.report.append(message)
+        if self.debug:
+            print(f"[optimizer] {message}", file=sys.stderr)
+
+    def optimize_program(self, root):
+        self.optimize_block(root)
+        self.remove_constant_declarations()
+        return root
+
+    def optimize_top_level(self, node, root):
+        node = self.optimize_stmt(node, root)
+        self.remove_constant_declarations()
+        return node
+
+    def remove_constant_declarations(self):
+        # a constant local whose every read was replaced no longer needs storing
+        candidates, self.candidates = self.candidates, []
+        for block, declaration in candidates:
+            if declaration.symbol in self.unfolded_reads or declaration not in block.children:
+                continue
+
+            block.children.remove(declaration)
+            self.note(f"removed declaration of constant ({declaration.name})")
+
+    # -------------- STATEMENTS --------------
+    def optimize_block(self, block):
+        children = []
+        for i, child in enumerate(block.children):
+            child = self.optimize_stmt(child, block)
+            if child is None:
+                continue
+
+            children.append(child)
+            if child.kind == ASTNodeKind.ast_return_stmt:
+                unreachable = len(block.children) - i - 1
+                if unreachable:
+                    self.note(f"removed {unreachable} unreachable statement(s) after return")
+
+                break
+
+        block.children = children
+
+    def optimize_stmt(self, node, block):
+        kind = node.kind
+
+        if kind == ASTNodeKind.ast_var_decl:
+            node.value = self.fold(node.value)
+
+            symbol = node.symbol
+            if node.value.kind in LITERAL_KINDS and symbol.level > 0 and not symbol.assigned:
+                self.constants[symbol] = node.value
+                self.candidates.append((block, node))
+        elif kind == ASTNodeKind.ast_var_assign:
+            node.value = self.fold(node.value)
+        elif kind == ASTNodeKind.ast_fn_decl:
+            self.optimize_block(node.body)
+        elif kind == ASTNodeKind.ast_if_stmt:
+            return self.optimize_if(node, block)
+        elif kind == ASTNodeKind.ast_while_stmt:
+            node.condition = self.fold(node.condition)
+            if node.condition.kind in LITERAL_KINDS and not node.condition.value:
+                self.note("removed while loop with a constant false condition")
+                return None
+
+            self.optimize_block(node.body)
+        elif kind == ASTNodeKind.ast_return_stmt:
+            node.expr = self.fold(node.expr)
+        elif kind == ASTNodeKind.ast_root:
+            self.optimize_block(node)
+        else:
+            node = self.fold(node)
+            if node.kind in LITERAL_KINDS or node.kind == ASTNodeKind.ast_id:
+                self.note(f"removed expression statement without effect ({node.value!r})")
+                return None
+
+        return node
+
+    def optimize_if(self, node, block):
+        node.condition = self.fold(node.condition)
+
+        if node.condition.kind in LITERAL_KINDS:
+            if node.condition.value:
+                if node.else_branch is not None:
+                    self.note("pruned else branch of an if with a constant true condition")
+
+                # the body keeps its own scope, it just runs unconditionally
+                self.optimize_block(node.body)
+                return node.body
+
+            self.note("pruned if branch with a constant false condition")
+            if node.else_branch is None:
+                return None
+
+            return self.optimize_stmt(node.else_branch, block)
+
+        self.optimize_block(node.body)
+        if node.else_branch is not None:
+            node.else_branch = self.optimize_stmt(node.else_branch, block)
+
+        return node
+
+    # -------------- EXPRESSIONS --------------
+    def fold(self, root):
+        # children are folded first and their results collected on a stack,
+        # each node takes its own off the top
+        folded = []
+        for node in postorder(root):
+            kind = node.kind
+
+            if kind == ASTNodeKind.ast_bin_expr:
+                node.rhs = folded.pop()
+                node.lhs = folded.pop()
+            elif kind == ASTNodeKind.ast_unr_expr:
+                node.stmt = folded.pop()
+            elif kind == ASTNodeKind.ast_fn_call:
+                count = len(node.arguments)
+                if count:
+                    node.arguments = folded[-count:]
+                    del folded[-count:]
+            elif kind == ASTNodeKind.ast_echo_builtin:
+                node.value = folded.pop()
+
+            folded.append(self.fold_node(node))
+
+        return folded[0]
+
+    def fold_node(self, node):
+        kind = node.kind
+
+        if kind == ASTNodeKind.ast_id:
+            symbol = node.symbol
+            if symbol in self.constants:
+                constant = self.constants[symbol]
+                return make_literal(constant.value, constant.type, node.line)
+
+            self.unfolded_reads.add(symbol)
+            return node
+
+        if kind == ASTNodeKind.ast_bin_expr:
+            if node.lhs.kind in LITERAL_KINDS and node.rhs.kind in LITERAL_KINDS:
+                return self.fold_literal(node)
+        elif kind == ASTNodeKind.ast_unr_expr:
+            if node.stmt.kind in LITERAL_KINDS:
+                return self.fold_literal(node)
+
+        return node
+
+    def fold_literal(self, node):
+        # evaluating a node whose operands are all literals never touches a frame
+        try:
+            value = node.evaluate(None)
+        except ArithmeticError:
+            return node
+
+        # a long folded string is a rope, a literal holds the plain text
+        value = materialize(value)
+
+        # i32 division yields a python float, keep those for the runtime
+        if type(value) is not LITERAL_PYTHON_TYPES[node.type]:
+            return node
+
+        literal = make_literal(value, node.type, node.line)
+        self.note(f"folded '{OPERATOR_SPELLINGS[node.op]}' expression to {literal.value!r}")
+        return literal
+
+def optimize(ast_root, debug=False):
+    optimizer = Optimizer(debug)
+    return optimizer.optimize_program(ast_root)
@@ -0,0 +1,143 @@
+import sys
+
+BUFFER_LINE = "line"
+BUFFER_BLOCK = "block"
+BUFFER_FULL = "full"
+BUFFERING_MODES = (BUFFER_LINE, BUFFER_BLOCK, BUFFER_FULL)
+
+DEFAULT_BLOCK_SIZE = 64 * 1024
+
+class OutputSink:
+    # Where echo output goes. Engines only call echo(value), the sink decides
+    # when and where the text is written.
+    def echo(self, value):
+        self.write(f"{value}\n")
+
+    def write(self, text):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+class StreamSink(OutputSink):
+    # line: written and flushed on every echo
+    # block: collected until block_size characters are waiting
+    # full: collected until flush(), which the interpreter calls once the run ends
+    def __init__(self, stream=None, buffering=BUFFER_LINE, block_size=DEFAULT_BLOCK_SIZE):
+        if buffering not in BUFFERING_MODES:
+            raise ValueError(f"unknown buffering ({buffering}), expected one of {', '.join(BUFFERING_MODES)}")
+
+        self.stream = stream if stream is not None else sys.stdout
+        self.buffering = buffering
+        self.block_size = block_size
+        self.parts = []
+        self.size = 0
+
+        # picked once here, so echo never looks at the mode
+        if buffering == BUFFER_LINE:
+            self.echo = self.echo_line
+        elif buffering == BUFFER_BLOCK:
+            self.echo = self.echo_block
+        else:
+            self.echo = self.echo_full
+
+    def echo_line(self, value):
+        self.stream.write(f"{value}\n")
+        self.stream.flush()
+
+    def echo_block(self, value):
+        text = f"{value}\n"
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size >= self.block_size:
+            self.flush()
+
+    def echo_full(self, value):
+        self.parts.append(f"{value}\n")
+
+    def write(self, text):
+        self.parts.append(text)
+        self.size += len(text)
+        if self.buffering == BUFFER_LINE or (self.buffering == BUFFER_BLOCK and self.size >= self.block_size):
+            self.flush()
+
+    def flush(self):
+        if self.parts:
+            self.stream.write("".join(self.parts))
+            self.parts.clear()
+            self.size = 0
+
+        self.stream.flush()
+
+class MemorySink(OutputSink):
+    # keeps everything echoed, for embedders that want the output as a string
+    def __init__(self):
+        self.parts = []
+
+    def echo(self, value):
+        self.parts.append(f"{value}\n")
+
+    def write(self, text):
+        self.parts.append(text)
+
+    def getvalue(self):
+        return "".join(self.parts)
+
+    def clear(self):
+        self.parts.clear()
+
+class EchoQueue(OutputSink):
+    # holds echoed values for a driver to hand on, a cooperative run stops
+    # after each echo so there is seldom more than one
+    def __init__(self):
+        self.values = []
+
+    def echo(self, value):
+        self.values.append(value)
+
+class AsyncOutputSink:
+    # Where echo output goes for a run driven from asyncio. Writes are
+    # awaited, so a slow reader holds the script back instead of output
+    # piling up in memory.
+    async def echo(self, value):
+        await self.write(f"{value}\n")
+
+    async def write(self, text):
+        raise NotImplementedError
+
+    async def flush(self):
+        pass
+
+class AsyncStreamSink(AsyncOutputSink):
+    # writes to an asyncio StreamWriter, waiting for it to drain
+    def __init__(self, writer):
+        self.writer = writer
+
+    async def write(self, text):
+        self.writer.write(text.encode())
+        await self.writer.drain()
+
+    async def flush(self):
+        await self.writer.drain()
+
+class AsyncWrappedSink(AsyncOutputSink):
+    # a plain sink used from asyncio, for ones that never block for long
+    def __init__(self, sink):
+        self.sink = sink
+
+    async def echo(self, value):
+        self.sink.echo(value)
+
+    async def write(self, text):
+        self.sink.write(text)
+
+    async def flush(self):
+        self.sink.flush()
+
+def default_output(stream=None):
+    # like C stdio: flushed per line for a terminal, in blocks for pipes and files
+    stream = stream if stream is not None else sys.stdout
+    isatty = getattr(stream, "isatty", None)
+    interactive = isatty is not None and isatty()
+
+    return StreamSink(stream, BUFFER_LINE if interactive else BUFFER_BLOCK)
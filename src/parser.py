@@ -1,5 +1,8 @@
-from tokens import TokenKind
-from qast import BinaryExpr, UnaryExpr, ReturnExpr, Number, Boolean, String, Identifier, ASTRoot, FunctionBody, FunctionDeclaration, FunctionCall, VariableAssignment, VariableDeclaration, IfStmt, WhileStmt, EchoBuiltin, Operator, LiteralType
+from collections import deque
+
+from tokens import TokenKind, Token
+from qast import BinaryExpr, UnaryExpr, DeepBinaryExpr, DeepUnaryExpr, ReturnExpr, Number, Boolean, String, Identifier, ASTRoot, FunctionBody, FunctionDeclaration, FunctionCall, VariableAssignment, VariableDeclaration, IfStmt, WhileStmt, EchoBuiltin, LiteralType, \
+    BINARY_OPERATOR_CODES, OP_NOT, OP_NEG, DEEP_EXPRESSION_HEIGHT
 
 PRECEDENCE = {
     # Maths
@@ -23,6 +26,65 @@ PRECEDENCE = {
     TokenKind.tok_or_op: 1,
 }
 
+LITERAL_MAP = {
+    TokenKind.tok_int: lambda value: Number(value, LiteralType.type_i32),
+    TokenKind.tok_float: lambda value: Number(value, LiteralType.type_f32),
+    TokenKind.tok_string: String,
+    TokenKind.tok_true: Boolean,
+    TokenKind.tok_false: Boolean,
+    TokenKind.tok_id: Identifier,
+}
+
+EXPRESSION_ENDS = (TokenKind.tok_semi, TokenKind.tok_close_brace)
+
+# what an expression being parsed becomes once it ends
+EXPR_TOP = 0
+EXPR_PAREN = 1
+EXPR_ARGUMENT = 2
+EXPR_ECHO = 3
+EXPR_RETURN = 4
+
+class OpenExpr:
+    # An expression still being parsed: operands paired with the height of
+    # their operator tree, binary operators waiting for a right hand side and
+    # prefix operators waiting for the next operand.
+    __slots__ = ('role', 'token', 'operands', 'operators', 'prefixes', 'arguments')
+
+    def __init__(self, role, token, arguments=None):
+        self.role = role
+        self.token = token
+        self.operands = []
+        self.operators = []
+        self.prefixes = []
+        self.arguments = arguments
+
+    def add_operand(self, operand):
+        node, height = operand
+
+        # prefixes bind tighter than any binary operator
+        for op, token in reversed(self.prefixes):
+            height += 1
+            node = (DeepUnaryExpr if height > DEEP_EXPRESSION_HEIGHT else UnaryExpr)(op, node)
+            node.line = token.line
+
+        self.prefixes.clear()
+        self.operands.append((node, height))
+
+    def reduce(self, min_precedence):
+        # every operator is left associative, so one of equal precedence
+        # takes the operands before the next one does
+        operands = self.operands
+        operators = self.operators
+
+        while operators and operators[-1][1] >= min_precedence:
+            op, _ = operators.pop()
+            rhs, rhs_height = operands.pop()
+            lhs, lhs_height = operands[-1]
+
+            height = max(lhs_height, rhs_height) + 1
+            node = (DeepBinaryExpr if height > DEEP_EXPRESSION_HEIGHT else BinaryExpr)(lhs, op, rhs)
+            node.line = lhs.line
+            operands[-1] = (node, height)
 
 class ParseError(RuntimeError):
     def __init__(self, token, message):
@@ -30,22 +92,46 @@ class ParseError(RuntimeError):
         self.token = token
 
 class Parser:
+    # Tokens are pulled from any iterable through a small lookahead buffer, so
+    # a token generator is lexed only as far as the parser has got.
     def __init__(self, tokens):
-        self.tokens = tokens
-        self.position = 0
+        self.tokens = iter(tokens)
+        self.lookahead = deque()
+        self.last_token = None
         self.variables = {}
 
+    def fill(self, count):
+        while len(self.lookahead) < count:
+            token = next(self.tokens, None)
+            if token is None:
+                # the end of input is a token of its own, it is never consumed
+                last = self.last_token
+                token = Token(TokenKind.tok_eof, None, last.line if last else 0, last.column if last else 0)
+            else:
+                self.last_token = token
+
+            self.lookahead.append(token)
+
     def peek(self):
-        return self.tokens[self.position]
+        if not self.lookahead:
+            self.fill(1)
+
+        return self.lookahead[0]
 
     def peek_offset(self, offset):
-        return self.tokens[self.position + offset]
+        if len(self.lookahead) <= offset:
+            self.fill(offset + 1)
+
+        return self.lookahead[offset]
+
+    def at_end(self):
+        return self.peek().kind == TokenKind.tok_eof
 
     def advance(self):
-        if self.position + 1 >= len(self.tokens):
+        if self.at_end():
             return
 
-        self.position += 1
+        self.lookahead.popleft()
 
     def advance_with_expected(self, *expected_kinds):
         if self.peek().kind not in expected_kinds:
@@ -55,9 +141,9 @@ class Parser:
 
     def parse_operator(self):
         if self.peek().is_operator():
-            return Operator(self.peek().value, self.peek().op_type())
+            return BINARY_OPERATOR_CODES[self.peek().value]
     
-    def parse_function_declaration(self, name, parent_context):
+    def parse_function_declaration(self, name, line, parent_context):
         # id: fn(...) -> return_type {
         #   body
         # }
@@ -87,6 +173,7 @@ class Parser:
         self.advance_with_expected(TokenKind.tok_open_brace)  # {
 
         body = FunctionBody(return_type, parent_context)
+        body.line = line
         while self.peek().kind != TokenKind.tok_close_brace:
             stmt = self.parse_stmt(body.context)
             body.append_child(stmt)
@@ -96,10 +183,13 @@ class Parser:
         
         self.advance_with_expected(TokenKind.tok_close_brace)  # }
 
-        return FunctionDeclaration(name, parameters, return_type, body)
+        declaration = FunctionDeclaration(name, parameters, return_type, body)
+        declaration.line = line
+        return declaration
 
     def parse_variable_declaration(self, parent_context):
         # identifier: type = value;
+        line = self.peek().line
         var_name = self.peek().value # identifier
         self.advance_with_expected(TokenKind.tok_id)
         self.advance_with_expected(TokenKind.tok_colon)
@@ -108,7 +198,7 @@ class Parser:
 
         # check if the 'var' is a function
         if var_type == TokenKind.tok_key_fn:
-            return self.parse_function_declaration(var_name, parent_context)
+            return self.parse_function_declaration(var_name, line, parent_context)
 
         self.advance_with_expected(TokenKind.tok_key_i32, TokenKind.tok_key_f32, TokenKind.tok_key_bool, TokenKind.tok_key_string)
         self.advance_with_expected(TokenKind.tok_assign)
@@ -116,10 +206,13 @@ class Parser:
         var_value = self.parse_bin_expr() # value
         self.advance_with_expected(TokenKind.tok_semi)
 
-        return VariableDeclaration(var_name, var_type, var_value)
+        declaration = VariableDeclaration(var_name, var_type, var_value)
+        declaration.line = line
+        return declaration
 
     def parse_variable_assignment(self):
         # identifier = value;
+        line = self.peek().line
         var_name = self.peek().value # identifier
         self.advance_with_expected(TokenKind.tok_id)
         self.advance_with_expected(TokenKind.tok_assign)
@@ -127,13 +220,16 @@ class Parser:
         var_value = self.parse_bin_expr() # value
         self.advance_with_expected(TokenKind.tok_semi)
 
-        return VariableAssignment(var_name, var_value)
+        assignment = VariableAssignment(var_name, var_value)
+        assignment.line = line
+        return assignment
 
     def parse_if_stmt(self, parent_context):
         # if (expr) {
         #     body
         # }
 
+        line = self.peek().line
         self.advance() # if
         self.advance_with_expected(TokenKind.tok_open_paren)  # (
         condition = self.parse_bin_expr()
@@ -142,6 +238,7 @@ class Parser:
         self.advance_with_expected(TokenKind.tok_open_brace)  # {
 
         body = ASTRoot(parent_context)
+        body.line = line
         while self.peek().kind != TokenKind.tok_close_brace:
             stmt = self.parse_stmt(body.context)
             body.append_child(stmt)
@@ -153,12 +250,14 @@ class Parser:
 
         else_branch = None
         if self.peek().kind == TokenKind.tok_else:
+            else_line = self.peek().line
             self.advance() # else
             if self.peek().kind == TokenKind.tok_if:
                 else_branch = self.parse_if_stmt(parent_context)
             else:
                 self.advance_with_expected(TokenKind.tok_open_brace) # {
                 else_body = ASTRoot(parent_context)
+                else_body.line = else_line
                 while self.peek().kind != TokenKind.tok_close_brace:
                     else_stmt = self.parse_stmt(else_body.context)
                     else_body.append_child(else_stmt)
@@ -166,14 +265,19 @@ class Parser:
                 self.advance_with_expected(TokenKind.tok_close_brace) # }
 
                 else_branch = IfStmt(Boolean("true"), else_body, None)
+                else_branch.line = else_line
+                else_branch.condition.line = else_line
 
-        return IfStmt(condition, body, else_branch)
+        if_stmt = IfStmt(condition, body, else_branch)
+        if_stmt.line = line
+        return if_stmt
     
     def parse_while_stmt(self, parent_context):
         # while (expr) {
         #     body
         # }
 
+        line = self.peek().line
         self.advance() # while
         self.advance_with_expected(TokenKind.tok_open_paren)  # (
         condition = self.parse_bin_expr()
@@ -182,6 +286,7 @@ class Parser:
         self.advance_with_expected(TokenKind.tok_open_brace)  # {
 
         body = ASTRoot(parent_context)
+        body.line = line
         while self.peek().kind != TokenKind.tok_close_brace:
             stmt = self.parse_stmt(body.context)
             body.append_child(stmt)
@@ -191,100 +296,129 @@ class Parser:
             
         self.advance_with_expected(TokenKind.tok_close_brace)  # }
 
-        return WhileStmt(condition, body)
-
-    def parse_primary(self):
-        token = self.peek()
-
-        LITERAL_MAP = {
-            TokenKind.tok_int: lambda: Number(token.value, LiteralType.type_i32),
-            TokenKind.tok_float: lambda: Number(token.value, LiteralType.type_f32),
-            TokenKind.tok_string: lambda: String(token.value),
-            TokenKind.tok_true: lambda: Boolean(token.value),
-            TokenKind.tok_false: lambda: Boolean(token.value),
-            TokenKind.tok_id: lambda: Identifier(token.value),
-        }
-
-        if token.kind == TokenKind.tok_id and self.peek_offset(1).kind == TokenKind.tok_open_paren:
-            # id(...)
-            fn_name = self.peek().value # id
-            self.advance_with_expected(TokenKind.tok_id)
-            self.advance_with_expected(TokenKind.tok_open_paren) # (
-
-            # ...
-            arguments = []
-            while self.peek().kind != TokenKind.tok_close_paren:
-                if self.peek().kind == TokenKind.tok_comma:
-                    self.advance_with_expected(TokenKind.tok_comma)
-
-                argument = self.parse_bin_expr()
-                arguments.append(argument)
-
-            self.advance_with_expected(TokenKind.tok_close_paren) # )
-
-            return FunctionCall(fn_name, arguments)
-
-        if token.kind in LITERAL_MAP:
-            self.advance()
-            return LITERAL_MAP[token.kind]()
+        while_stmt = WhileStmt(condition, body)
+        while_stmt.line = line
+        return while_stmt
 
-        if token.kind == TokenKind.tok_not_op:
-            op = self.parse_operator()
-            self.advance() # !
-            operand = self.parse_primary()
-            return UnaryExpr(op, operand)
-
-        if token.kind == TokenKind.tok_dash:
-            op = self.parse_operator()
-            self.advance() # -
-            operand = self.parse_primary()
-            return UnaryExpr(op, operand)
-
-        if token.kind == TokenKind.tok_open_paren:
-            self.advance()  # (
-            expr = self.parse_bin_expr()
-            self.advance_with_expected(TokenKind.tok_close_paren)  # )
-            return expr
-
-        if token.kind == TokenKind.tok_echo:
-            # echo(expr)
-            self.advance() # echo
-            self.advance_with_expected(TokenKind.tok_open_paren)  # (
-            param = self.parse_bin_expr()
-
-            self.advance_with_expected(TokenKind.tok_close_paren)  # )
-
-            echo_node = EchoBuiltin(param)
-            return echo_node
-        
-        if token.kind == TokenKind.tok_return:
-            # return expr
-            self.advance() # return
-            ret_expr = self.parse_bin_expr() # expr
-
-            return ReturnExpr(ret_expr)
-       
-        raise ParseError(token, f"Unexpected token ({token.kind})")
-
-    def parse_bin_expr(self, min_precedence=0):
-        if self.peek().kind == TokenKind.tok_semi or self.peek().kind == TokenKind.tok_close_brace:
+    def parse_bin_expr(self):
+        # Precedence climbing on explicit stacks. An expression nested in
+        # parentheses, call arguments, echo or return is opened on top of the
+        # one it appears in and handed back to it as an operand when it ends,
+        # so nesting depth is limited only by memory.
+        if self.peek().kind in EXPRESSION_ENDS:
             return
 
-        lhs = self.parse_primary()
-
-        while self.peek().kind in PRECEDENCE and PRECEDENCE[self.peek().kind] >= min_precedence:
-            if self.peek().kind == TokenKind.tok_semi:
-                break
-
-            op = self.parse_operator()
-            op_precendence = PRECEDENCE[self.peek().kind]
-            self.advance()
-
-            rhs = self.parse_bin_expr(op_precendence + 1)
-
-            lhs = BinaryExpr(lhs, op, rhs)
-
-        return lhs
+        current = OpenExpr(EXPR_TOP, None)
+        enclosing = []
+
+        while True:
+            token = self.peek()
+            kind = token.kind
+
+            if kind in EXPRESSION_ENDS and not current.prefixes:
+                if current.operators:
+                    # an operator with nothing after it
+                    raise ParseError(token, f"Unexpected token ({kind})")
+
+                operand = (None, 0)
+            elif kind == TokenKind.tok_not_op or kind == TokenKind.tok_dash:
+                self.advance() # ! or -
+                current.prefixes.append((OP_NOT if kind == TokenKind.tok_not_op else OP_NEG, token))
+                continue
+            elif kind == TokenKind.tok_id and self.peek_offset(1).kind == TokenKind.tok_open_paren:
+                # id(...)
+                self.advance_with_expected(TokenKind.tok_id)
+                self.advance_with_expected(TokenKind.tok_open_paren) # (
+
+                if self.peek().kind == TokenKind.tok_close_paren:
+                    self.advance() # )
+                    operand = (self.make_call(token, []), 1)
+                else:
+                    if self.peek().kind == TokenKind.tok_comma:
+                        self.advance_with_expected(TokenKind.tok_comma)
+
+                    enclosing.append(current)
+                    current = OpenExpr(EXPR_ARGUMENT, token, [])
+                    continue
+            elif kind in LITERAL_MAP:
+                self.advance()
+                node = LITERAL_MAP[kind](token.value)
+                node.line = token.line
+                operand = (node, 1)
+            elif kind == TokenKind.tok_open_paren:
+                self.advance() # (
+                enclosing.append(current)
+                current = OpenExpr(EXPR_PAREN, token)
+                continue
+            elif kind == TokenKind.tok_echo:
+                # echo(expr)
+                self.advance() # echo
+                self.advance_with_expected(TokenKind.tok_open_paren) # (
+                enclosing.append(current)
+                current = OpenExpr(EXPR_ECHO, token)
+                continue
+            elif kind == TokenKind.tok_return:
+                # return expr
+                self.advance() # return
+                enclosing.append(current)
+                current = OpenExpr(EXPR_RETURN, token)
+                continue
+            else:
+                raise ParseError(token, f"Unexpected token ({kind})")
+
+            while True:
+                current.add_operand(operand)
+
+                kind = self.peek().kind
+                if kind in PRECEDENCE:
+                    precedence = PRECEDENCE[kind]
+                    current.reduce(precedence)
+                    current.operators.append((self.parse_operator(), precedence))
+                    self.advance()
+                    break
+
+                # the expression has ended
+                current.reduce(0)
+                node, height = current.operands[0]
+                if not enclosing:
+                    return node
+
+                finished = current
+                current = enclosing.pop()
+                role = finished.role
+
+                if role == EXPR_PAREN:
+                    self.advance_with_expected(TokenKind.tok_close_paren) # )
+                    operand = (node, height)
+                elif role == EXPR_ARGUMENT:
+                    if node is None:
+                        raise ParseError(self.peek(), f"Unexpected token ({self.peek().kind})")
+
+                    finished.arguments.append(node)
+                    if self.peek().kind != TokenKind.tok_close_paren:
+                        if self.peek().kind == TokenKind.tok_comma:
+                            self.advance_with_expected(TokenKind.tok_comma)
+
+                        enclosing.append(current)
+                        current = OpenExpr(EXPR_ARGUMENT, finished.token, finished.arguments)
+                        break
+
+                    self.advance_with_expected(TokenKind.tok_close_paren) # )
+                    operand = (self.make_call(finished.token, finished.arguments), 1)
+                elif role == EXPR_ECHO:
+                    self.advance_with_expected(TokenKind.tok_close_paren) # )
+                    echo_node = EchoBuiltin(node)
+                    echo_node.line = finished.token.line
+                    operand = (echo_node, 1)
+                else:
+                    ret_node = ReturnExpr(node)
+                    ret_node.line = finished.token.line
+                    operand = (ret_node, 1)
+
+    def make_call(self, token, arguments):
+        call = FunctionCall(token.value, arguments)
+        call.line = token.line
+        return call
 
     def parse_stmt(self, parent_context):
         if self.peek().kind == TokenKind.tok_id and self.peek_offset(1).kind == TokenKind.tok_colon:
@@ -324,16 +458,23 @@ class Parser:
                 # print(expr)
                 return expr
         
-def parse(token_array):
-    parser = Parser(token_array)
-    root = ASTRoot()
+def parse_iter(tokens, root):
+    # Yields each top-level statement as soon as it is parsed, they are
+    # parsed in the scope of root but not added to it.
+    parser = Parser(tokens)
 
-    while parser.position < len(parser.tokens):
+    while not parser.at_end():
         stmt = parser.parse_stmt(root.context)
 
         if stmt == None:
             break
-        
+
+        yield stmt
+
+def parse(token_array):
+    root = ASTRoot()
+
+    for stmt in parse_iter(token_array, root):
         root.append_child(stmt)
 
     return root
@@ -0,0 +1,227 @@
+import sys
+import time
+
+from qast import ASTNodeKind, Frame, FramePool, TailCall
+from closures import ClosureCompiler
+
+PROGRAM_NAME = "<program>"
+
+ENTRY_FUNCTION = "function"
+ENTRY_LOOP = "loop"
+ENTRY_LINE = "line"
+
+class ProfileEntry:
+    __slots__ = ('kind', 'name', 'line', 'calls', 'iterations', 'inclusive', 'exclusive', 'active')
+
+    def __init__(self, kind, name, line):
+        self.kind = kind
+        self.name = name
+        self.line = line
+        self.calls = 0
+        self.iterations = 0
+        self.inclusive = 0.0
+        self.exclusive = 0.0
+        # how many runs of this entry are on the stack, recursion only counts
+        # towards inclusive time once
+        self.active = 0
+
+class Profiler:
+    # Functions and loops are scopes, they nest into the stacks written out for
+    # flamegraphs. Lines are timed on a stack of their own, so exclusive time
+    # of a line is the time not spent in the statements nested inside it.
+    def __init__(self):
+        self.entries = {}
+        self.collapsed = {}
+        self.scope_stack = []
+        self.line_stack = []
+
+    def entry(self, key, kind, name, line):
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = ProfileEntry(kind, name, line)
+
+        return entry
+
+    def time_scope(self, entry, run):
+        stack = self.scope_stack
+        collapsed = self.collapsed
+        clock = time.perf_counter
+
+        def timed_scope(frame):
+            # [time spent in nested scopes, stack path]
+            record = [0.0, f"{stack[-1][1]};{entry.name}" if stack else entry.name]
+            stack.append(record)
+            entry.calls += 1
+            entry.active += 1
+            start = clock()
+            try:
+                return run(frame)
+            finally:
+                elapsed = clock() - start
+                stack.pop()
+                entry.active -= 1
+                if not entry.active:
+                    entry.inclusive += elapsed
+
+                own = elapsed - record[0]
+                entry.exclusive += own
+                collapsed[record[1]] = collapsed.get(record[1], 0.0) + own
+                if stack:
+                    stack[-1][0] += elapsed
+
+        return timed_scope
+
+    def time_line(self, entry, run):
+        stack = self.line_stack
+        clock = time.perf_counter
+
+        def timed_line(frame):
+            nested = [0.0]
+            stack.append(nested)
+            entry.calls += 1
+            entry.active += 1
+            start = clock()
+            try:
+                return run(frame)
+            finally:
+                elapsed = clock() - start
+                stack.pop()
+                entry.active -= 1
+                if not entry.active:
+                    entry.inclusive += elapsed
+
+                entry.exclusive += elapsed - nested[0]
+                if stack:
+                    stack[-1][0] += elapsed
+
+        return timed_line
+
+    # -------------- OUTPUT --------------
+    def sorted_entries(self, kind):
+        entries = [entry for entry in self.entries.values() if entry.kind == kind]
+        return sorted(entries, key=lambda entry: entry.exclusive, reverse=True)
+
+    def report(self, src=None, file=sys.stderr, limit=20):
+        source_lines = src.split("\n") if src is not None else []
+
+        print("functions (by exclusive time)", file=file)
+        print(f"{'calls':>10} {'inclusive':>11} {'exclusive':>11} {'per call':>11}  function", file=file)
+        for entry in self.sorted_entries(ENTRY_FUNCTION)[:limit]:
+            where = f" (line {entry.line + 1})" if entry.line is not None else ""
+            print(f"{entry.calls:>10} {format_seconds(entry.inclusive)} {format_seconds(entry.exclusive)} "
+                  f"{format_seconds(entry.inclusive / entry.calls)}  {entry.name}{where}", file=file)
+
+        print(file=file)
+        print("loops (by exclusive time)", file=file)
+        print(f"{'runs':>10} {'iterations':>11} {'inclusive':>11} {'exclusive':>11}  line", file=file)
+        for entry in self.sorted_entries(ENTRY_LOOP)[:limit]:
+            print(f"{entry.calls:>10} {entry.iterations:>11} {format_seconds(entry.inclusive)} "
+                  f"{format_seconds(entry.exclusive)}  {entry.line + 1}", file=file)
+
+        print(file=file)
+        print("lines (by exclusive time)", file=file)
+        print(f"{'hits':>10} {'inclusive':>11} {'exclusive':>11}  line", file=file)
+        for entry in self.sorted_entries(ENTRY_LINE)[:limit]:
+            text = source_lines[entry.line].strip() if entry.line < len(source_lines) else ""
+            print(f"{entry.calls:>10} {format_seconds(entry.inclusive)} {format_seconds(entry.exclusive)}  "
+                  f"{entry.line + 1:>5}: {text}", file=file)
+
+    def write_collapsed(self, file):
+        # one "outer;inner microseconds" line per stack, the format flamegraph tools read
+        for path, seconds in sorted(self.collapsed.items()):
+            microseconds = round(seconds * 1000000)
+            if microseconds > 0:
+                file.write(f"{path} {microseconds}\n")
+
+def format_seconds(seconds):
+    return f"{seconds * 1000:9.3f}ms"
+
+class ProfilingCompiler(ClosureCompiler):
+    # The closure engine with timing wrapped around statements, function
+    # bodies and loops, normal runs never pay for any of it.
+    def __init__(self, module_frame, profiler):
+        super().__init__(module_frame)
+        self.profiler = profiler
+        # the body a function runs as when reached by a tail call, by the one it is called through
+        self.tail_bodies = {}
+
+    def compile_program(self, root):
+        entry = self.profiler.entry(root, ENTRY_FUNCTION, PROGRAM_NAME, None)
+        return self.profiler.time_scope(entry, self.compile_block(root))
+
+    def compile_stmt(self, node):
+        closure = super().compile_stmt(node)
+
+        # a bare block only groups statements that are timed on their own lines
+        if node.kind == ASTNodeKind.ast_root or node.line is None:
+            return closure
+
+        entry = self.profiler.entry(("line", node.line), ENTRY_LINE, None, node.line)
+        return self.profiler.time_line(entry, closure)
+
+    def wrap_body(self, node, body):
+        # A tail call made by a function runs inside its scope, so the callee is
+        # timed as nested in it and counts towards its inclusive time. The rest of
+        # the chain runs in the same loop, tail recursion still takes no stack.
+        entry = self.profiler.entry(node, ENTRY_FUNCTION, node.name, node.line)
+        tail_bodies = self.tail_bodies
+        pool = self.pool
+
+        def run_body(frame):
+            result = body(frame)
+            if result is not None and type(result[0]) is TailCall:
+                value = run_tail_calls(result[0], pool, tail_bodies)
+                return (value,) if value is not None else None
+
+            return result
+
+        timed = self.profiler.time_scope(entry, run_body)
+        tail_bodies[timed] = self.profiler.time_scope(entry, body)
+        return timed
+
+    def compile_while(self, node):
+        entry = self.profiler.entry(node, ENTRY_LOOP, f"while@{node.line + 1}", node.line)
+        condition = self.compile_expr(node.condition)
+        body = self.compile_block(node.body)
+
+        def run_while(frame):
+            while condition(frame):
+                entry.iterations += 1
+                result = body(frame)
+                if result is not None:
+                    return result
+
+        return self.profiler.time_scope(entry, run_while)
+
+def run_tail_calls(tail, pool, tail_bodies):
+    # closures.run_tail_calls for profiled bodies, the frame of the body that
+    # made the first call is still its caller's to release
+    frame = None
+    while True:
+        fn = tail.function
+        if frame is not None and fn.parent_frame is not frame:
+            pool.release(frame)
+
+        body, size = fn.code
+        frame = pool.acquire(size, fn.parent_frame)
+        frame.slots[:len(tail.arguments)] = tail.arguments
+
+        result = tail_bodies[body](frame)
+        if result is None:
+            pool.release(frame)
+            return None
+
+        tail = result[0]
+        if type(tail) is not TailCall:
+            pool.release(frame)
+            return tail
+
+def run_profiled(root, profiler=None, output=None):
+    if profiler is None:
+        profiler = Profiler()
+
+    module_frame = Frame(root.frame_size, None, FramePool(output))
+    program = ProfilingCompiler(module_frame, profiler).compile_program(root)
+    program(module_frame)
+
+    return profiler
@@ -0,0 +1,61 @@
+from qast import ASTNodeKind, child_nodes, iter_nodes
+
+def scan_function(declaration):
+    # Returns whether the body on its own is pure, and the symbols it calls.
+    # A pure body never echoes and never touches a variable outside its own
+    # frame, so its result can only depend on its arguments.
+    called = set()
+    stack = list(declaration.body.children)
+
+    while stack:
+        node = stack.pop()
+        kind = node.kind
+
+        if kind == ASTNodeKind.ast_echo_builtin:
+            return False, called
+
+        if kind in (ASTNodeKind.ast_id, ASTNodeKind.ast_var_assign) and node.depth != 0:
+            return False, called
+
+        if kind == ASTNodeKind.ast_fn_call:
+            called.add(node.symbol)
+        elif kind == ASTNodeKind.ast_fn_decl:
+            # a nested function is judged on its own, declaring it is a local store
+            continue
+
+        stack.extend(child_nodes(node))
+
+    return True, called
+
+def analyze_purity(root):
+    # Marks the symbols of pure functions and returns their declarations. A
+    # function is pure when its body is and every function it calls is too,
+    # which is settled by dropping impure callers until nothing changes.
+    callees = {}
+    declarations_of = {}
+    pure = set()
+
+    for node in iter_nodes(root):
+        if node.kind != ASTNodeKind.ast_fn_decl:
+            continue
+
+        # a redeclaration in a nested block shares the symbol, every
+        # declaration behind a symbol has to be pure for calls through it
+        declarations_of.setdefault(node.symbol, []).append(node)
+
+        body_pure, callees[node] = scan_function(node)
+        if body_pure:
+            pure.add(node)
+
+    while True:
+        pure_symbols = {symbol for symbol, declarations in declarations_of.items() if all(d in pure for d in declarations)}
+        impure = {declaration for declaration in pure if not callees[declaration] <= pure_symbols}
+        if not impure:
+            break
+
+        pure -= impure
+
+    for symbol in declarations_of:
+        symbol.pure = symbol in pure_symbols
+
+    return pure
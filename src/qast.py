@@ -1,5 +1,8 @@
+import operator
 from enum import Enum
-from tokens import TokenKind, OperatorType
+from tokens import TokenKind
+from output import StreamSink
+from rope import concat
 
 class QwrkRuntimeError(RuntimeError):
     def __init__(self, node, message):
@@ -13,57 +16,162 @@ class QwrkRuntimeError(RuntimeError):
     def __repr__(self):
         return self.message
 
+class UndefinedVariableError(QwrkRuntimeError):
+    def __init__(self, node, name):
+        super().__init__(node, f"Undefined variable ({name})")
+        self.name = name
+
 class SymbolTableEntry:
-    def __init__(self, type, value, parameters=None):
+    __slots__ = ('type', 'slot', 'level', 'parameters', 'assigned', 'pure')
+
+    def __init__(self, type, slot, level, parameters=None):
         self.type = type
-        self.value = value
+        self.slot = slot
+        self.level = level
         self.parameters = parameters
+        self.assigned = False
+        # set by the purity analysis for functions whose result depends only on their arguments
+        self.pure = False
+
+class FrameLayout:
+    def __init__(self, level):
+        self.level = level
+        self.size = 0
+
+    def new_slot(self):
+        slot = self.size
+        self.size += 1
+        return slot
 
 class ASTContext:
+    __slots__ = ('parent', 'variables', 'frame')
+
     def __init__(self, parent=None):
         self.parent = parent
         self.variables = {}
+        self.frame = None
 
     def get_variable(self, var_name):
-        if var_name not in self.variables:
-            if self.parent is None:
-                raise QwrkRuntimeError(self, f"Undefined variable ({var_name})")
+        context = self
+        while context is not None:
+            if var_name in context.variables:
+                return context.variables[var_name]
 
-            return self.parent.get_variable(var_name)
+            context = context.parent
 
-        return self.variables[var_name]
+        raise UndefinedVariableError(self, var_name)
 
-    def set_new_function(self, fn_name, return_type, parameters, body):
+    def set_new_function(self, fn_name, return_type, parameters):
         if fn_name in self.variables:
             raise QwrkRuntimeError(self, f"Function name already exists ({fn_name})")
-        
-        for param in parameters:
-            body.context.set_new_variable(param[0], param[1], None)
-        
-        self.variables[fn_name] = SymbolTableEntry(return_type, body, parameters)
 
-    def set_new_variable(self, var_name, type, value):
+        entry = SymbolTableEntry(return_type, self.frame.new_slot(), self.frame.level, parameters)
+        self.variables[fn_name] = entry
+        return entry
+
+    def set_new_variable(self, var_name, type):
         if var_name in self.variables:
             if self.parent is None:
                 raise QwrkRuntimeError(self, f"Variable name already exists ({var_name})")
 
-            try:
-                par_var = self.parent.get_variable(var_name)
-            except:
-                print("Var does not exist")
+            # re-declaring inside a nested block reuses the slot
+            existing = self.variables[var_name]
+            if existing.parameters is None:
+                entry = SymbolTableEntry(type, existing.slot, existing.level)
+                self.variables[var_name] = entry
+                return entry
 
+        entry = SymbolTableEntry(type, self.frame.new_slot(), self.frame.level)
+        self.variables[var_name] = entry
+        return entry
 
-        self.variables[var_name] = SymbolTableEntry(type, value)
+class Frame:
+    __slots__ = ('slots', 'parent', 'pool')
 
-    def set_existing_variable(self, var_name, value):
-        if var_name not in self.variables:
-            if self.parent is None:
-                raise QwrkRuntimeError(self, f"Undefined variable ({var_name})")
+    def __init__(self, size, parent=None, pool=None):
+        self.slots = [None] * size
+        self.parent = parent
+        self.pool = pool
+
+    def ancestor(self, depth):
+        frame = self
+        while depth:
+            frame = frame.parent
+            depth -= 1
 
-            self.parent.set_existing_variable(var_name, value)
+        return frame
+
+class TailCall:
+    # What a body returns in place of a value for `return f(...)`: the
+    # function and its arguments, for the caller to run.
+    __slots__ = ('function', 'arguments')
+
+    def __init__(self, function, arguments):
+        self.function = function
+        self.arguments = arguments
 
-        var = self.get_variable(var_name)
-        var.value = value
+def run_tail_calls(tail, frame, pool):
+    # Runs a chain of tail calls in a loop, frame is the one whose body asked
+    # for the first. A finished frame goes back to the pool for the next call
+    # to reuse, unless the function being called was declared in it.
+    while True:
+        fn = tail.function
+        if fn.parent_frame is not frame:
+            pool.release(frame)
+
+        body = fn.code.body
+        frame = pool.acquire(body.frame_size, fn.parent_frame)
+        frame.slots[:len(tail.arguments)] = tail.arguments
+
+        tail = body.evaluate(frame)
+        if type(tail) is not TailCall:
+            pool.release(frame)
+            return tail
+
+def call_function(fn, arguments, pool):
+    body = fn.code.body
+    callee = pool.acquire(body.frame_size, fn.parent_frame)
+    callee.slots[:len(arguments)] = arguments
+
+    result = body.evaluate(callee)
+    if type(result) is TailCall:
+        return run_tail_calls(result, callee, pool)
+
+    pool.release(callee)
+    return result
+
+class FramePool:
+    # Every frame of a run shares its pool, so run-wide state such as the
+    # output sink is reached through it.
+    def __init__(self, output=None):
+        self.free = {}
+        self.blanks = {}
+        self.output = output if output is not None else StreamSink()
+
+    def acquire(self, size, parent):
+        frames = self.free.get(size)
+        if frames:
+            frame = frames.pop()
+            frame.parent = parent
+            return frame
+
+        return Frame(size, parent, self)
+
+    def release(self, frame):
+        size = len(frame.slots)
+        if size not in self.free:
+            self.free[size] = []
+            self.blanks[size] = (None,) * size
+
+        # drop the old values so a recycled frame never keeps them alive
+        frame.slots[:] = self.blanks[size]
+        frame.parent = None
+        self.free[size].append(frame)
+
+class Function:
+    def __init__(self, code, parent_frame):
+        self.code = code
+        self.parent_frame = parent_frame
 
 class LiteralType(Enum):
     type_i32 = 0,
@@ -84,46 +192,173 @@ def token_to_literal_type(tok_type):
     
     return None
 
-class ASTNodeKind(Enum):
+class ASTNodeKind:
+    # plain ints, node dispatch compares and hashes them without Enum overhead
+
     # Root
-    ast_root = 7,
-    ast_fn_body = 15,
+    ast_root = 7
+    ast_fn_body = 15
 
     # Literals
-    ast_num = 0,
-    ast_bool = 1,
-    ast_str = 2,
-    ast_op = 3,
-    ast_id = 8,
+    ast_num = 0
+    ast_bool = 1
+    ast_str = 2
+    ast_id = 8
 
     # Expressions/Statements
-    ast_var_decl = 4,
-    ast_var_assign = 9,
-    ast_if_stmt = 10,
-    ast_while_stmt = 11,
-    ast_return_stmt = 14,
-    ast_unr_expr = 5,
-    ast_bin_expr = 6,
-    ast_fn_decl = 12,
-    ast_fn_call = 13,
-    ast_echo_builtin = 16,
-
-class ASTRoot():
+    ast_var_decl = 4
+    ast_var_assign = 9
+    ast_if_stmt = 10
+    ast_while_stmt = 11
+    ast_return_stmt = 14
+    ast_unr_expr = 5
+    ast_bin_expr = 6
+    ast_fn_decl = 12
+    ast_fn_call = 13
+    ast_echo_builtin = 16
+
+AST_NODE_KIND_NAMES = {value: name for name, value in vars(ASTNodeKind).items() if name.startswith("ast_")}
+
+# statements that can end the enclosing function with a return value
+CONTROL_FLOW_KINDS = (ASTNodeKind.ast_return_stmt, ASTNodeKind.ast_if_stmt, ASTNodeKind.ast_while_stmt, ASTNodeKind.ast_root)
+
+# -------------- OPERATORS --------------
+# BinaryExpr.op and UnaryExpr.op hold one of these codes, binary codes are
+# dense from 0 so they index BINARY_FUNCTIONS directly
+OP_ADD = 0
+OP_SUB = 1
+OP_MUL = 2
+OP_DIV = 3
+OP_MOD = 4
+OP_CONCAT = 5
+OP_AND = 6
+OP_OR = 7
+OP_EQ = 8
+OP_NE = 9
+OP_LT = 10
+OP_LE = 11
+OP_GT = 12
+OP_GE = 13
+OP_NOT = 14
+OP_NEG = 15
+
+BINARY_OPERATOR_CODES = {
+    '+': OP_ADD,
+    '-': OP_SUB,
+    '*': OP_MUL,
+    '/': OP_DIV,
+    '%': OP_MOD,
+    '++': OP_CONCAT,
+    '&&': OP_AND,
+    '||': OP_OR,
+    '==': OP_EQ,
+    '!=': OP_NE,
+    '<': OP_LT,
+    '<=': OP_LE,
+    '>': OP_GT,
+    '>=': OP_GE,
+}
+
+UNARY_OPERATOR_CODES = {
+    '!': OP_NOT,
+    '-': OP_NEG,
+}
+
+OPERATOR_SPELLINGS = {code: op for op, code in BINARY_OPERATOR_CODES.items()}
+OPERATOR_SPELLINGS.update({code: op for op, code in UNARY_OPERATOR_CODES.items()})
+
+MATHS_OPERATORS = frozenset((OP_ADD, OP_SUB, OP_MUL, OP_DIV, OP_MOD))
+LOGICAL_OPERATORS = frozenset((OP_AND, OP_OR))
+COMP_OPERATORS = frozenset((OP_EQ, OP_NE, OP_LT, OP_LE, OP_GT, OP_GE))
+STRING_OPERATORS = frozenset((OP_CONCAT,))
+
+# operands are evaluated before the call, so && and || never short-circuit
+BINARY_FUNCTIONS = (
+    operator.add,
+    operator.sub,
+    operator.mul,
+    operator.truediv,
+    operator.mod,
+    concat,
+    lambda lhs, rhs: lhs and rhs,
+    lambda lhs, rhs: lhs or rhs,
+    operator.eq,
+    operator.ne,
+    operator.lt,
+    operator.le,
+    operator.gt,
+    operator.ge,
+)
+
+UNARY_FUNCTIONS = {
+    OP_NOT: operator.not_,
+    OP_NEG: operator.neg,
+}
+
+# -------------- TRAVERSAL --------------
+CHILD_FIELDS = ("children", "body", "condition", "else_branch", "value", "lhs", "rhs", "stmt", "expr", "arguments")
+
+def child_nodes(node):
+    for name in CHILD_FIELDS:
+        child = getattr(node, name, None)
+        if isinstance(child, list):
+            yield from child
+        elif child is not None and hasattr(child, "kind"):
+            yield child
+
+def iter_nodes(root):
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(child_nodes(node))
+
+def postorder(root):
+    # every node below root after its children, children left to right. Built
+    # from an explicit stack, so tree height is limited only by memory.
+    order = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        order.append(node)
+        stack.extend(child_nodes(node))
+
+    order.reverse()
+    return order
+
+# -------------- NODES --------------
+class ASTNode:
+    # line is the source line the node starts on, None for nodes made after parsing
+    __slots__ = ('line',)
+
+class ASTRoot(ASTNode):
+    __slots__ = ('context', 'children', 'frame_size')
+    kind = ASTNodeKind.ast_root
+
     def __init__(self, parent_context=None):
-        self.kind = ASTNodeKind.ast_root
+        self.line = None
         self.context = ASTContext(parent_context)
         self.children = []
+        self.frame_size = 0
 
-    def evaluate(self):
+    def evaluate(self, frame):
         for child in self.children:
-            child.evaluate(self.context)
+            if child.kind in CONTROL_FLOW_KINDS:
+                result = child.evaluate(frame)
+                if result is not None:
+                    return result
+            else:
+                child.evaluate(frame)
 
     def append_child(self, child):
         self.children.append(child)
 
-class Number(ASTRoot):
+class Number(ASTNode):
+    __slots__ = ('type', 'value')
+    kind = ASTNodeKind.ast_num
+
     def __init__(self, value, type):
-        self.kind = ASTNodeKind.ast_num
+        self.line = None
         self.type = type
 
         if type == LiteralType.type_f32:
@@ -136,24 +371,36 @@ class Number(ASTRoot):
     def __str__(self):
         return f"(value: {self.value}, type: {self.type})"
 
-    def evaluate(self, context):
-        return (self.value, self.type)
+    def evaluate(self, frame):
+        return self.value
+
+class Identifier(ASTNode):
+    __slots__ = ('value', 'type', 'depth', 'slot', 'symbol')
+    kind = ASTNodeKind.ast_id
 
-class Identifier(ASTRoot):
     def __init__(self, value):
-        self.kind = ASTNodeKind.ast_id
+        self.line = None
         self.value = value
+        self.type = None
+        self.depth = None
+        self.slot = None
+        self.symbol = None
 
     def __str__(self):
         return f"(Value: {self.value})"
 
-    def evaluate(self, context):
-        var = context.get_variable(self.value)
-        return (var.value, var.type)
+    def evaluate(self, frame):
+        if self.depth:
+            frame = frame.ancestor(self.depth)
+
+        return frame.slots[self.slot]
+
+class Boolean(ASTNode):
+    __slots__ = ('type', 'value')
+    kind = ASTNodeKind.ast_bool
 
-class Boolean(ASTRoot):
     def __init__(self, value):
-        self.kind = ASTNodeKind.ast_bool
+        self.line = None
         self.type = LiteralType.type_bool
 
         if value == "true":
@@ -166,185 +413,134 @@ class Boolean(ASTRoot):
     def __str__(self):
         return f"{self.value}"
 
-    def evaluate(self, context):
-        return (self.value, self.type)
+    def evaluate(self, frame):
+        return self.value
+
+class String(ASTNode):
+    __slots__ = ('type', 'value')
+    kind = ASTNodeKind.ast_str
 
-class String(ASTRoot):
     def __init__(self, value):
-        self.kind = ASTNodeKind.ast_str
+        self.line = None
         self.type = LiteralType.type_string
         self.value = str(value)
 
     def __str__(self):
         return f'"{self.value}"'
 
-    def evaluate(self, context):
-        return (self.value, self.type)
-
-class Operator(ASTRoot):
-    def __init__(self, op, type):
-        self.kind = ASTNodeKind.ast_op
-        self.type = type
-        self.value = op
-
-    def __str__(self):
-        return f"{self.value}"
-
-    def evaluate(self, context):
+    def evaluate(self, frame):
         return self.value
 
-    def is_mathmatical(self):
-        if self.type == OperatorType.type_maths:
-            return True
-
-        return False
-
-    def is_logical(self):
-        if self.type == OperatorType.type_logical:
-            return True
-
-        return False
-
-    def is_comp(self):
-        if self.type == OperatorType.type_comp:
-            return True
-
-        return False
-
-    def is_string_op(self):
-        if self.type == OperatorType.type_string:
-            return True
-
-        return False
-
 class FunctionBody(ASTRoot):
+    __slots__ = ('return_type',)
+    kind = ASTNodeKind.ast_fn_body
+
     def __init__(self, return_type, parent_context):
-        self.kind = ASTNodeKind.ast_fn_body
+        ASTRoot.__init__(self, parent_context)
         self.return_type = token_to_literal_type(return_type)
-        self.context = ASTContext(parent_context)
-        self.children = []
 
     def __str__(self):
         return f""
     
-    def evaluate(self):
-        for child in self.children:
-            if child.kind == ASTNodeKind.ast_return_stmt:
-                ret_val, ret_type = child.evaluate(self.context)
-
-                if ret_type != self.return_type:
-                    raise QwrkRuntimeError(self, f"Invalid return type ({ret_type}), expected ({self.return_type}).")
+    def evaluate(self, frame):
+        result = ASTRoot.evaluate(self, frame)
+        if result is not None:
+            return result[0]
 
-                return ret_val, ret_type
-            
-            child.evaluate(self.context)
-    
-    def append_child(self, child):
-        self.children.append(child)
+class FunctionDeclaration(ASTNode):
+    __slots__ = ('name', 'parameters', 'return_type', 'body', 'slot', 'symbol')
+    kind = ASTNodeKind.ast_fn_decl
 
-class FunctionDeclaration(ASTRoot):
     def __init__(self, name, parameters, return_type, body):
-        self.kind = ASTNodeKind.ast_fn_decl
+        self.line = None
         self.name = name
         self.parameters = parameters
         self.return_type = return_type
         self.body = body
+        self.slot = None
+        self.symbol = None
 
     def __str__(self):
         return f""
     
-    def evaluate(self, context):
-        if self.return_type in TOKEN_TO_LITERAL_TYPE:
-            self.return_type = TOKEN_TO_LITERAL_TYPE[self.return_type]
-        else:
-            raise QwrkRuntimeError(self, f"Return Type ({self.return_type}) not a supported type")
-        
-        new_parameters = []
-        for parameter in self.parameters:
-            param_val = parameter[0]
-            param_type = parameter[1]
+    def evaluate(self, frame):
+        frame.slots[self.slot] = Function(self, frame)
 
-            if param_type in TOKEN_TO_LITERAL_TYPE:
-                param_type = TOKEN_TO_LITERAL_TYPE[param_type]
-            else:
-                raise QwrkRuntimeError(self, f"({param_val}) -> Parameter Type ({param_type}) not a supported type")
-            
-            new_parameters.append((param_val, param_type))
-        
-        self.parameters = new_parameters
-            
-        context.set_new_function(self.name, self.return_type, self.parameters, self.body)
+class FunctionCall(ASTNode):
+    __slots__ = ('name', 'arguments', 'type', 'depth', 'slot', 'symbol')
+    kind = ASTNodeKind.ast_fn_call
 
-class FunctionCall(ASTRoot):
     def __init__(self, name, arguments):
-        self.kind = ASTNodeKind.ast_fn_call
+        self.line = None
         self.name = name
         self.arguments = arguments
+        self.type = None
+        self.depth = None
+        self.slot = None
+        self.symbol = None
 
     def __str__(self):
         return f""
     
-    def evaluate(self, context):
-        fn = context.get_variable(self.name)
-
-        if len(fn.parameters) != len(self.arguments):
-            raise QwrkRuntimeError(self, f"Invalid argument length: ({len(self.arguments)} )given, but expected ({len(fn.parameters)}).")
-        
-        for i in range(len(fn.parameters)):
-            arg = self.arguments[i]
-            param = fn.parameters[i]
-
-            arg_val, arg_type = arg.evaluate(context)
-            if arg_type != param[1]:
-                raise QwrkRuntimeError(self, f"Invalid argument type: ({arg_type}) given, but expected ({param[1]}).")
-            
-            fn.value.context.set_existing_variable(param[0], arg_val)
+    def evaluate(self, frame):
+        fn = frame.ancestor(self.depth).slots[self.slot]
+        body = fn.code.body
+        pool = frame.pool
+
+        callee = pool.acquire(body.frame_size, fn.parent_frame)
+        slots = callee.slots
+        for i, arg in enumerate(self.arguments):
+            slots[i] = arg.evaluate(frame)
         
-        return fn.value.evaluate()
+        result = body.evaluate(callee)
+        if type(result) is TailCall:
+            return run_tail_calls(result, callee, pool)
+
+        pool.release(callee)
+        return result
+
+class VariableDeclaration(ASTNode):
+    __slots__ = ('name', 'type', 'value', 'slot', 'symbol')
+    kind = ASTNodeKind.ast_var_decl
 
-class VariableDeclaration(ASTRoot):
     def __init__(self, name, type, value):
-        self.kind = ASTNodeKind.ast_var_decl
+        self.line = None
         self.name = name
         self.type = type
         self.value = value
+        self.slot = None
+        self.symbol = None
 
     def __str__(self):
         return f"(Name: {self.name}, Type: {self.type}, Value: {self.value})"
 
-    def evaluate(self, context):
-        if self.type in TOKEN_TO_LITERAL_TYPE:
-            self.type = TOKEN_TO_LITERAL_TYPE[self.type]
-        else:
-            raise QwrkRuntimeError(self, f"({self.name}) -> Type ({self.type}) not a supported type")
+    def evaluate(self, frame):
+        frame.slots[self.slot] = self.value.evaluate(frame)
 
-        var, var_type = self.value.evaluate(context)
-        if var_type != self.type:
-            raise QwrkRuntimeError(self, f"Cannot assign type ({var_type}) to type ({self.type})")
+class VariableAssignment(ASTNode):
+    __slots__ = ('name', 'value', 'depth', 'slot', 'symbol')
+    kind = ASTNodeKind.ast_var_assign
 
-        context.set_new_variable(self.name, var_type, var)
-
-class VariableAssignment(ASTRoot):
     def __init__(self, name, value):
-        self.kind = ASTNodeKind.ast_var_assign
+        self.line = None
         self.name = name
         self.value = value
+        self.depth = None
+        self.slot = None
+        self.symbol = None
 
     def __str__(self):
         return f"(Name: {self.name}, Value: {self.value})"
 
-    def evaluate(self, context):
-        var = self.value.evaluate(context)
-        var_type = context.get_variable(self.name).type
-
-        if var[1] != var_type:
-            raise QwrkRuntimeError(self, f"Cannot assign type ({var[1]}) to type ({var_type})")
+    def evaluate(self, frame):
+        frame.ancestor(self.depth).slots[self.slot] = self.value.evaluate(frame)
 
-        context.set_existing_variable(self.name, var[0])
+class IfStmt(ASTNode):
+    __slots__ = ('condition', 'body', 'else_branch')
+    kind = ASTNodeKind.ast_if_stmt
 
-class IfStmt(ASTRoot):
     def __init__(self, condition, body, else_branch=None):
-        self.kind = ASTNodeKind.ast_if_stmt
+        self.line = None
         self.condition = condition
         self.body = body
         self.else_branch = else_branch
@@ -352,165 +548,157 @@ class IfStmt(ASTRoot):
     def __str__(self):
         pass
 
-    def evaluate(self, context):
-        if self.condition.evaluate(context)[0] == True:
-            self.body.evaluate()
+    def evaluate(self, frame):
+        if self.condition.evaluate(frame):
+            return self.body.evaluate(frame)
         elif self.else_branch:
-            self.else_branch.evaluate(context)
+            return self.else_branch.evaluate(frame)
+
+class WhileStmt(ASTNode):
+    __slots__ = ('condition', 'body')
+    kind = ASTNodeKind.ast_while_stmt
 
-class WhileStmt(ASTRoot):
     def __init__(self, condition, body):
-        self.kind = ASTNodeKind.ast_while_stmt
+        self.line = None
         self.condition = condition
         self.body = body
 
     def __str__(self):
         pass
 
-    def evaluate(self, context):
-        while self.condition.evaluate(context)[0] == True:
-            self.body.evaluate()
+    def evaluate(self, frame):
+        while self.condition.evaluate(frame):
+            result = self.body.evaluate(frame)
+            if result is not None:
+                return result
+
+class UnaryExpr(ASTNode):
+    __slots__ = ('op', 'stmt', 'type')
+    kind = ASTNodeKind.ast_unr_expr
+    # set on the Deep* subclasses the parser makes for tall operator trees
+    deep = False
 
-class UnaryExpr(ASTRoot):
     def __init__(self, op, stmt):
-        self.kind = ASTNodeKind.ast_unr_expr
+        self.line = None
         self.op = op
         self.stmt = stmt
+        self.type = None
 
     def __str__(self):
-        return f"(op: {self.op}, stmt: {self.stmt})"
-
-    def evaluate(self, context):
-        operand, operand_type = self.stmt.evaluate(context)
-        op = self.op.evaluate(context)
+        return f"(op: {OPERATOR_SPELLINGS[self.op]}, stmt: {self.stmt})"
 
-        if op == '!':
-            return (not operand, LiteralType.type_bool)
-        if op == '-':
-            if operand_type != LiteralType.type_f32 and operand_type != LiteralType.type_i32:
-                raise QwrkRuntimeError(self, f"Invalid operand for '-' ({operand} -> {operand_type})") 
+    def evaluate(self, frame):
+        operand = self.stmt.evaluate(frame)
 
-            return (-operand, operand_type)
+        if self.op == OP_NOT:
+            return not operand
+        if self.op == OP_NEG:
+            return -operand
         else:
-            raise QwrkRuntimeError(self, f"Unknown unary operator ({op})")
+            raise QwrkRuntimeError(self, f"Unknown unary operator ({self.op})")
+
+class BinaryExpr(ASTNode):
+    __slots__ = ('lhs', 'op', 'rhs', 'type')
+    kind = ASTNodeKind.ast_bin_expr
+    deep = False
 
-class BinaryExpr(ASTRoot):
     def __init__(self, lhs, op, rhs):
-        self.kind = ASTNodeKind.ast_bin_expr
+        self.line = None
         self.lhs = lhs
         self.op = op
         self.rhs = rhs
+        self.type = None
 
     def __str__(self):
-        return f"(lhs: {self.lhs}, op: {self.op}, rhs: {self.rhs})"
-
-    def evaluate_arithmatic(self, op, context):
-        lhs, lhs_type = self.lhs.evaluate(context)
-        rhs, rhs_type = self.rhs.evaluate(context)
-
-        if lhs_type != LiteralType.type_i32 and lhs_type != LiteralType.type_f32:
-            raise QwrkRuntimeError(self, f"Invalid Arethmatic operation type ({lhs_type})")
-
-        if rhs_type != LiteralType.type_i32 and rhs_type != LiteralType.type_f32:
-            raise QwrkRuntimeError(self, f"Invalid Arethmatic operation type ({rhs_type})")
-
-        if op == '+':
-            return lhs + rhs, lhs_type
-        elif op == '-':
-            return lhs - rhs, lhs_type
-        elif op == '*':
-            return lhs * rhs, lhs_type
-        elif op == '/':
-            return lhs / rhs, lhs_type
-        elif op == '%':
-            return lhs % rhs, lhs_type
-
-    def evaluate_logical(self, op, context):
-        lhs, lhs_type = self.lhs.evaluate(context)
-        rhs, rhs_type = self.rhs.evaluate(context)
-
-        if lhs_type == LiteralType.type_bool and rhs_type != LiteralType.type_bool:
-            raise QwrkRuntimeError(self, f"Incompatible types ({lhs_type} - {rhs_type})")
-
-        elif op == '&&':
-            return lhs and rhs, LiteralType.type_bool
-        elif op == '||':
-            return lhs or rhs, LiteralType.type_bool
-
-    def evaluate_comp(self, op, context):
-        lhs, lhs_type = self.lhs.evaluate(context)
-        rhs, rhs_type = self.rhs.evaluate(context)
-
-        if lhs_type == LiteralType.type_i32 and (rhs_type != LiteralType.type_i32 and rhs_type != LiteralType.type_f32):
-            raise QwrkRuntimeError(self, f"Incompatible types ({lhs_type} - {rhs_type})")
-
-        if lhs_type == LiteralType.type_f32 and (rhs_type != LiteralType.type_i32 and rhs_type != LiteralType.type_f32):
-            raise QwrkRuntimeError(self, f"Incompatible types ({lhs_type} - {rhs_type})")
-
-        if lhs_type == LiteralType.type_bool and rhs_type != LiteralType.type_bool:
-            raise QwrkRuntimeError(self, f"Incompatible types ({lhs_type} - {rhs_type})")
-
-        if op == '==':
-            return lhs == rhs, LiteralType.type_bool
-        elif op == '!=':
-            return lhs != rhs, LiteralType.type_bool
-        elif op == '<':
-            return lhs < rhs, LiteralType.type_bool
-        elif op == '<=':
-            return lhs <= rhs, LiteralType.type_bool
-        elif op == '>':
-            return lhs > rhs, LiteralType.type_bool
-        elif op == '>=':
-            return lhs >= rhs, LiteralType.type_bool
-
-    def evaluate_string(self, op, context):
-        lhs, lhs_type = self.lhs.evaluate(context)
-        rhs, rhs_type = self.rhs.evaluate(context)
-
-        if lhs_type != LiteralType.type_string:
-            raise QwrkRuntimeError(self, f"Invalid String operation type ({lhs_type})")
-
-        if rhs_type != LiteralType.type_string:
-            raise QwrkRuntimeError(self, f"Invalid String operation type ({rhs_type})")
+        return f"(lhs: {self.lhs}, op: {OPERATOR_SPELLINGS[self.op]}, rhs: {self.rhs})"
+
+    def evaluate(self, frame):
+        return BINARY_FUNCTIONS[self.op](self.lhs.evaluate(frame), self.rhs.evaluate(frame))
+
+# -------------- DEEP EXPRESSIONS --------------
+# The parser makes operator nodes taller than this deep ones, they run their
+# whole operator tree from explicit stacks instead of one python call a level
+DEEP_EXPRESSION_HEIGHT = 32
+
+def evaluate_operators(root, frame, functions=BINARY_FUNCTIONS):
+    # operands that are not operators are evaluated on their own, with any
+    # operator trees of their own left to their own evaluate. functions
+    # replaces the binary operator table, for metered runs.
+    values = []
+    pending = [(root, False)]
+
+    while pending:
+        node, ready = pending.pop()
+        kind = node.kind
+
+        if kind == ASTNodeKind.ast_bin_expr:
+            if ready:
+                rhs = values.pop()
+                values[-1] = functions[node.op](values[-1], rhs)
+            else:
+                pending.append((node, True))
+                pending.append((node.rhs, False))
+                pending.append((node.lhs, False))
+        elif kind == ASTNodeKind.ast_unr_expr:
+            if ready:
+                if node.op not in UNARY_FUNCTIONS:
+                    raise QwrkRuntimeError(node, f"Unknown unary operator ({node.op})")
+
+                values[-1] = UNARY_FUNCTIONS[node.op](values[-1])
+            else:
+                pending.append((node, True))
+                pending.append((node.stmt, False))
+        else:
+            values.append(node.evaluate(frame))
 
-        if op == '++':
-            return lhs + rhs, LiteralType.type_string
+    return values[0]
 
-    def evaluate(self, context):
-        if self.op.is_mathmatical():
-            return self.evaluate_arithmatic(self.op.evaluate(context), context)
+class DeepBinaryExpr(BinaryExpr):
+    __slots__ = ()
+    deep = True
 
-        if self.op.is_logical():
-            return self.evaluate_logical(self.op.evaluate(context), context)
+    def evaluate(self, frame):
+        return evaluate_operators(self, frame)
 
-        if self.op.is_comp():
-            return self.evaluate_comp(self.op.evaluate(context), context)
+class DeepUnaryExpr(UnaryExpr):
+    __slots__ = ()
+    deep = True
 
-        if self.op.is_string_op():
-            return self.evaluate_string(self.op.evaluate(context), context)
+    def evaluate(self, frame):
+        return evaluate_operators(self, frame)
 
-        raise QwrkRuntimeError(self, f"Unknown Operator ({self.op.value})")
+class EchoBuiltin(ASTNode):
+    __slots__ = ('value', 'type')
+    kind = ASTNodeKind.ast_echo_builtin
 
-class EchoBuiltin(ASTRoot):
     def __init__(self, value):
-        self.kind = ASTNodeKind.ast_echo_builtin
+        self.line = None
         self.value = value
+        self.type = None
 
     def __str__(self):
         return f"(Value: {self.value})"
     
-    def evaluate(self, context):
-        print(self.value.evaluate(context)[0])
+    def evaluate(self, frame):
+        frame.pool.output.echo(self.value.evaluate(frame))
 
- # type: ignore
+class ReturnExpr(ASTNode):
+    __slots__ = ('expr',)
+    kind = ASTNodeKind.ast_return_stmt
 
-class ReturnExpr(ASTRoot):
     def __init__(self, expr):
-        self.kind = ASTNodeKind.ast_return_stmt
+        self.line = None
         self.expr = expr
 
     def __str__(self):
         return f""
     
-    def evaluate(self, context):
-        return self.expr.evaluate(context)
\ No newline at end of file
+    def evaluate(self, frame):
+        expr = self.expr
+        if type(expr) is FunctionCall:
+            # a tail call, run by the caller once this body is gone instead of nesting in it
+            fn = frame.ancestor(expr.depth).slots[expr.slot]
+            return (TailCall(fn, [arg.evaluate(frame) for arg in expr.arguments]),)
+
+        # boxed so a returned value can be told apart from a block that just ended
+        return (expr.evaluate(frame),)
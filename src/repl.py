@@ -0,0 +1,75 @@
+from lexer import lex, LexError
+from parser import parse_iter, ParseError
+from qast import QwrkRuntimeError
+from tokens import TokenKind
+from interpreter import IncrementalInterpreter
+
+# what a bad entry can raise without ending the session, division by zero
+# surfaces as a python ArithmeticError
+REPL_ERRORS = (LexError, ParseError, QwrkRuntimeError, ArithmeticError, RecursionError)
+
+OPENERS = (TokenKind.tok_open_brace, TokenKind.tok_open_paren)
+CLOSERS = (TokenKind.tok_close_brace, TokenKind.tok_close_paren)
+ENTRY_ENDS = (TokenKind.tok_semi, TokenKind.tok_close_brace)
+
+def is_complete(src):
+    # An entry is complete once its brackets balance and it ends a statement.
+    # A lex error counts as complete so it is reported rather than waited on.
+    try:
+        tokens = lex(src)
+    except LexError:
+        return True
+
+    if not tokens:
+        return True
+
+    depth = 0
+    for token in tokens:
+        if token.kind in OPENERS:
+            depth += 1
+        elif token.kind in CLOSERS:
+            depth -= 1
+
+    return depth <= 0 and tokens[-1].kind in ENTRY_ENDS
+
+class ReplSession:
+    # One global environment for the whole session. Each entry is lexed and
+    # parsed on its own and only its statements are compiled and run, so
+    # nothing typed earlier is ever processed again.
+    def __init__(self, engine="vm", optimize_ast=True, output=None):
+        self.interpreter = IncrementalInterpreter(engine, optimize_ast, output=output)
+        self.lines = []
+
+    @property
+    def waiting(self):
+        # an entry has been started and needs more lines
+        return bool(self.lines)
+
+    def feed_line(self, line):
+        # returns True once the line completed an entry and it ran, an empty
+        # line submits whatever has been typed so far
+        self.lines.append(line)
+        src = "\n".join(self.lines)
+
+        if line.strip() and not is_complete(src):
+            return False
+
+        self.lines = []
+        self.run_entry(src)
+        return True
+
+    def run_entry(self, src):
+        # parsed in full first, a syntax error anywhere runs none of the entry
+        statements = list(parse_iter(lex(src), self.interpreter.root))
+
+        try:
+            self.interpreter.run_entry(statements)
+        finally:
+            self.interpreter.output.flush()
+
+    def reset_entry(self):
+        self.lines = []
+
+    def close(self):
+        self.lines = []
+        self.interpreter.finish()
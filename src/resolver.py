@@ -0,0 +1,143 @@
+from qast import ASTNodeKind, FrameLayout, QwrkRuntimeError, UndefinedVariableError, postorder, token_to_literal_type
+
+class Resolver:
+    def __init__(self):
+        self.layout = None
+        self.pending = []
+
+    def resolve_program(self, root, inputs=()):
+        self.begin_program(root)
+
+        # globals an embedder fills in before the program runs take the first slots
+        for name, type in inputs:
+            root.context.set_new_variable(name, type)
+
+        self.resolve_children(root)
+        self.flush_pending()
+
+        root.frame_size = self.layout.size
+        return root
+
+    def begin_program(self, root):
+        self.layout = FrameLayout(0)
+        root.context.variables = {}
+        root.context.frame = self.layout
+
+    def flush_pending(self, defer_undefined=False):
+        # Function bodies are resolved once their enclosing frame is complete so
+        # they can see every name declared around them, the same names a call
+        # would have found at run time. With defer_undefined a body naming
+        # something not declared yet is left pending, and the (declaration,
+        # name) pairs of those are returned.
+        pending, self.pending = self.pending, []
+        outer_layout = self.layout
+        deferred = []
+
+        for declaration in pending:
+            try:
+                self.resolve_body(declaration, outer_layout)
+            except UndefinedVariableError as error:
+                if not defer_undefined:
+                    raise
+
+                # what the body had queued is resolved again along with it
+                self.pending = []
+                deferred.append((declaration, error.name))
+
+        self.layout = outer_layout
+        self.pending = [declaration for declaration, _ in deferred]
+        return deferred
+
+    def resolve_body(self, declaration, outer_layout):
+        body = declaration.body
+        self.layout = FrameLayout(outer_layout.level + 1)
+        body.context.variables = {}
+        body.context.frame = self.layout
+
+        # parameters take the first slots of every activation record
+        for name, type in declaration.symbol.parameters:
+            body.context.set_new_variable(name, type)
+
+        self.resolve_children(body)
+        self.flush_pending()
+        body.frame_size = self.layout.size
+
+    def bind(self, node, name, context):
+        symbol = context.get_variable(name)
+
+        node.symbol = symbol
+        node.slot = symbol.slot
+        node.depth = self.layout.level - symbol.level
+
+        return symbol
+
+    # -------------- STATEMENTS --------------
+    def resolve_children(self, block):
+        for child in block.children:
+            self.resolve_stmt(child, block.context)
+
+    def resolve_block(self, block):
+        block.context.variables = {}
+        block.context.frame = self.layout
+        self.resolve_children(block)
+
+    def resolve_stmt(self, node, context):
+        kind = node.kind
+
+        if kind == ASTNodeKind.ast_var_decl:
+            self.resolve_expr(node.value, context)
+
+            symbol = context.set_new_variable(node.name, token_to_literal_type(node.type))
+            node.symbol = symbol
+            node.slot = symbol.slot
+        elif kind == ASTNodeKind.ast_var_assign:
+            self.resolve_expr(node.value, context)
+            symbol = self.bind(node, node.name, context)
+
+            if symbol.parameters is not None:
+                raise QwrkRuntimeError(node, f"Cannot assign to function ({node.name})")
+
+            symbol.assigned = True
+        elif kind == ASTNodeKind.ast_fn_decl:
+            parameters = [(name, token_to_literal_type(type)) for name, type in node.parameters]
+            symbol = context.set_new_function(node.name, token_to_literal_type(node.return_type), parameters)
+
+            node.symbol = symbol
+            node.slot = symbol.slot
+            self.pending.append(node)
+        elif kind == ASTNodeKind.ast_if_stmt:
+            self.resolve_expr(node.condition, context)
+            self.resolve_block(node.body)
+
+            if node.else_branch is not None:
+                self.resolve_stmt(node.else_branch, context)
+        elif kind == ASTNodeKind.ast_while_stmt:
+            self.resolve_expr(node.condition, context)
+            self.resolve_block(node.body)
+        elif kind == ASTNodeKind.ast_root:
+            self.resolve_block(node)
+        elif kind == ASTNodeKind.ast_return_stmt:
+            if self.layout.level == 0:
+                raise QwrkRuntimeError(node, "Return outside of a function")
+
+            self.resolve_expr(node.expr, context)
+        else:
+            self.resolve_expr(node, context)
+
+    # -------------- EXPRESSIONS --------------
+    def resolve_expr(self, root, context):
+        for node in postorder(root):
+            kind = node.kind
+
+            if kind == ASTNodeKind.ast_id:
+                self.bind(node, node.value, context)
+            elif kind == ASTNodeKind.ast_fn_call:
+                symbol = self.bind(node, node.name, context)
+                if symbol.parameters is None:
+                    raise QwrkRuntimeError(node, f"({node.name}) is not a function")
+            elif kind == ASTNodeKind.ast_return_stmt:
+                raise QwrkRuntimeError(node, "Return is only allowed as a statement")
+
+def resolve(ast_root, inputs=()):
+    resolver = Resolver()
+    return resolver.resolve_program(ast_root, inputs)
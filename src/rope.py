@@ -0,0 +1,88 @@
+# strings up to this long are joined right away, copying them is cheaper
+# than a rope node
+SHORT_STRING = 256
+
+class Rope:
+    # A string value built by ++. Joining two values only records them, the
+    # text is put together the first time it is compared, hashed or printed,
+    # so a string grown piece by piece costs linear time overall.
+    __slots__ = ('left', 'right', 'length', 'text')
+
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+        self.length = len(left) + len(right)
+        self.text = None
+
+    def __len__(self):
+        return self.length
+
+    def __str__(self):
+        text = self.text
+        if text is None:
+            text = self.text = self.join()
+            # the pieces are not needed once the text is known
+            self.left = None
+            self.right = None
+
+        return text
+
+    def join(self):
+        # a rope grown in a loop is as deep as the loop ran, so it is walked
+        # from an explicit stack
+        parts = []
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if type(node) is str:
+                parts.append(node)
+            elif node.text is not None:
+                parts.append(node.text)
+            else:
+                stack.append(node.right)
+                stack.append(node.left)
+
+        return "".join(parts)
+
+    def __repr__(self):
+        return repr(str(self))
+
+    def __format__(self, spec):
+        return format(str(self), spec)
+
+    def __hash__(self):
+        return hash(str(self))
+
+    def __eq__(self, other):
+        return str(self) == str(other)
+
+    def __ne__(self, other):
+        return str(self) != str(other)
+
+    def __lt__(self, other):
+        return str(self) < str(other)
+
+    def __le__(self, other):
+        return str(self) <= str(other)
+
+    def __gt__(self, other):
+        return str(self) > str(other)
+
+    def __ge__(self, other):
+        return str(self) >= str(other)
+
+def concat(lhs, rhs):
+    # the ++ operator, both sides are str or Rope
+    if type(rhs) is str:
+        if type(lhs) is str:
+            if len(lhs) + len(rhs) <= SHORT_STRING:
+                return lhs + rhs
+        elif lhs.text is None and type(lhs.right) is str and len(lhs.right) + len(rhs) <= SHORT_STRING:
+            # short pieces appended one by one share a leaf instead of a node each
+            return Rope(lhs.left, lhs.right + rhs)
+
+    return Rope(lhs, rhs)
+
+def materialize(value):
+    # the plain python value, for code handing values outside the interpreter
+    return str(value) if type(value) is Rope else value
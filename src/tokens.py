@@ -1,3 +1,6 @@
+import re
+from array import array
+from bisect import bisect_left
 from enum import Enum
 
 class TokenKind(Enum):
@@ -84,7 +87,59 @@ class OperatorType(Enum):
     type_string = 2,
     type_comp = 3,
 
-class Token:
+# -------------- BITSETS --------------
+# kinds are numbered by the int inside their value, a set of kinds is an int
+# with one bit per kind so membership is a shift and a mask
+KINDS_BY_CODE = {kind.value[0]: kind for kind in TokenKind}
+
+def kind_bits(kinds):
+    bits = 0
+    for kind in kinds:
+        bits |= 1 << kind.value[0]
+
+    return bits
+
+OPERATOR_BITS = kind_bits(OPERATORS)
+BINARY_OPERATOR_BITS = kind_bits(BINARY_0PERATORS)
+COMP_OPERATOR_BITS = kind_bits(COMP_0PERATORS)
+LOGICAL_OPERATOR_BITS = kind_bits(LOGIGAL_OPERATORS)
+STRING_OPERATOR_BITS = kind_bits(STRING_OPERATORS)
+DIGIT_BITS = kind_bits(DIGITS)
+
+class TokenHelpers:
+    # shared by Token and TokenView, both provide the int kind as .code
+    __slots__ = ()
+
+    def is_operator(self):
+        return (OPERATOR_BITS >> self.code) & 1 == 1
+
+    def op_type(self):
+        code = self.code
+        if (LOGICAL_OPERATOR_BITS >> code) & 1:
+            return OperatorType.type_logical
+        elif (BINARY_OPERATOR_BITS >> code) & 1:
+            return OperatorType.type_maths
+        elif (STRING_OPERATOR_BITS >> code) & 1:
+            return OperatorType.type_string
+        elif (COMP_OPERATOR_BITS >> code) & 1:
+            return OperatorType.type_comp
+
+    def is_binary_op(self):
+        return (BINARY_OPERATOR_BITS >> self.code) & 1 == 1
+
+    def is_comparison_op(self):
+        return (COMP_OPERATOR_BITS >> self.code) & 1 == 1
+
+    def is_logical_op(self):
+        return (LOGICAL_OPERATOR_BITS >> self.code) & 1 == 1
+
+    def is_digit(self):
+        return (DIGIT_BITS >> self.code) & 1 == 1
+
+class Token(TokenHelpers):
+    # a large source lexes to hundreds of thousands of these
+    __slots__ = ('kind', 'value', 'line', 'column')
+
     def __init__(self, kind, value, line, column):
         self.kind = kind
         self.value = value
@@ -94,45 +149,75 @@ class Token:
     def __str__(self):
         return f"Kind: {self.kind}, Value: {self.value}, Line: {self.line}, Column: {self.column}"
 
-    # -------------- HELPERS -------------- 
-    def is_operator(self):
-        if self.kind in OPERATORS:
-            return True
+    @property
+    def code(self):
+        return self.kind.value[0]
 
-        return False
+class TokenArray:
+    # Struct-of-arrays token stream: a kind code and the source span of the
+    # value per token. Values are sliced out on demand and line/column are
+    # only worked out when something asks for them.
+    def __init__(self, src):
+        self.src = src
+        self.kinds = array('B')
+        self.starts = array('I')
+        self.ends = array('I')
+        self.newlines = None
 
-    def op_type(self):
-        if self.kind in LOGIGAL_OPERATORS:
-            return OperatorType.type_logical
-        elif self.kind in BINARY_0PERATORS:
-            return OperatorType.type_maths
-        elif self.kind in STRING_OPERATORS:
-            return OperatorType.type_string
-        elif self.kind in COMP_0PERATORS:
-            return OperatorType.type_comp
+    def __len__(self):
+        return len(self.kinds)
 
-    def is_binary_op(self):
-        if self.kind in BINARY_0PERATORS:
-            return True
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.kinds)
 
-        return False
+        if not 0 <= index < len(self.kinds):
+            raise IndexError("token index out of range")
 
-    def is_comparison_op(self):
-        if self.kind in COMP_0PERATORS:
-            return True
+        return TokenView(self, index)
 
-        return False
+    def __iter__(self):
+        for index in range(len(self.kinds)):
+            yield TokenView(self, index)
 
-    def is_logical_op(self):
-        if self.kind in LOGIGAL_OPERATORS:
-            return True
+    def kind(self, index):
+        return KINDS_BY_CODE[self.kinds[index]]
 
-        return False
+    def value(self, index):
+        return self.src[self.starts[index]:self.ends[index]]
 
-    def is_digit(self):
-        if self.kind in DIGITS:
-            return True
+    def position(self, index):
+        # positions are taken after the token, past the closing quote of strings
+        end = self.ends[index]
+        if self.kinds[index] == TokenKind.tok_string.value[0]:
+            end += 1
+
+        if self.newlines is None:
+            self.newlines = array('I', (match.start() for match in re.finditer("\n", self.src)))
+
+        line = bisect_left(self.newlines, end)
+        line_start = self.newlines[line - 1] + 1 if line else -1
+        return line, end - line_start
 
-        return False
+class TokenView(TokenHelpers):
+    # A token read from a TokenArray. The parser holds only a few at a time, so
+    # kind and value are taken when it is made, only the position stays lazy.
+    __slots__ = ('tokens', 'index', 'code', 'kind', 'value')
+
+    def __init__(self, tokens, index):
+        self.tokens = tokens
+        self.index = index
+        self.code = tokens.kinds[index]
+        self.kind = KINDS_BY_CODE[self.code]
+        self.value = tokens.value(index)
+
+    def __str__(self):
+        return f"Kind: {self.kind}, Value: {self.value}, Line: {self.line}, Column: {self.column}"
 
+    @property
+    def line(self):
+        return self.tokens.position(self.index)[0]
 
+    @property
+    def column(self):
+        return self.tokens.position(self.index)[1]
@@ -0,0 +1,403 @@
+from qast import ASTNodeKind, AST_NODE_KIND_NAMES, iter_nodes, QwrkRuntimeError, OPERATOR_SPELLINGS, OP_ADD, OP_SUB, OP_MUL, OP_DIV, \
+    OP_MOD, OP_CONCAT, OP_AND, OP_OR, OP_EQ, OP_NE, OP_LT, OP_LE, OP_GT, OP_GE, OP_NOT, OP_NEG
+from output import StreamSink
+from rope import concat
+
+LITERAL_KINDS = (ASTNodeKind.ast_num, ASTNodeKind.ast_bool, ASTNodeKind.ast_str)
+
+PYTHON_OPERATORS = {
+    OP_ADD: "+",
+    OP_SUB: "-",
+    OP_MUL: "*",
+    OP_DIV: "/",
+    OP_MOD: "%",
+    OP_EQ: "==",
+    OP_NE: "!=",
+    OP_LT: "<",
+    OP_LE: "<=",
+    OP_GT: ">",
+    OP_GE: ">=",
+}
+
+# && and || evaluate both operands, python's and/or only do when the right
+# side cannot have an effect, otherwise these take both as arguments
+PYTHON_LOGICAL_OPERATORS = {
+    OP_AND: ("and", "_qwrk_and"),
+    OP_OR: ("or", "_qwrk_or"),
+}
+
+ENTRY_POINT = "_qwrk_main"
+ECHO_FUNCTION = "_qwrk_echo"
+# ++ builds ropes, python's + would copy the whole string each time
+CONCAT_FUNCTION = "_qwrk_concat"
+TAIL_CALL_CLASS = "_QwrkTailCall"
+RUN_FUNCTION = "_qwrk_run"
+
+def _qwrk_and(lhs, rhs):
+    return lhs and rhs
+
+def _qwrk_or(lhs, rhs):
+    return lhs or rhs
+
+class _QwrkTailCall:
+    # what a function that calls others in tail position returns instead of
+    # making the call, _qwrk_run makes it once the returning frame is gone
+    __slots__ = ('fn', 'arguments')
+
+    def __init__(self, fn, arguments):
+        self.fn = fn
+        self.arguments = arguments
+
+def _qwrk_run(fn, *arguments):
+    result = fn(*arguments)
+    while type(result) is _QwrkTailCall:
+        result = result.fn(*result.arguments)
+
+    return result
+
+def python_name(name, symbol):
+    # (level, slot) is unique along any chain of enclosing functions, and a
+    # redeclaration in a nested block shares its slot just like the other engines
+    return f"{name}_{symbol.level}_{symbol.slot}"
+
+def has_effect(node):
+    kind = node.kind
+    if kind in LITERAL_KINDS or kind == ASTNodeKind.ast_id:
+        return False
+
+    if kind == ASTNodeKind.ast_bin_expr:
+        return has_effect(node.lhs) or has_effect(node.rhs)
+
+    if kind == ASTNodeKind.ast_unr_expr:
+        return has_effect(node.stmt)
+
+    return True
+
+class Transpiler:
+    def __init__(self):
+        self.lines = []
+        self.indent = 0
+        self.level = 0
+        # the function whose self tail calls loop, with its parameter names,
+        # and how many while loops deep the current statement is inside it
+        self.tail_symbol = None
+        self.tail_parameters = None
+        self.loop_depth = 0
+        # functions that tail call each other, their calls go through _qwrk_run
+        self.trampolined = set()
+        self.function_symbol = None
+
+    def emit(self, line):
+        self.lines.append("    " * self.indent + line)
+
+    def transpile_program(self, root):
+        # the program body is a function so its variables are fast locals
+        # and nested functions reach them as closure cells
+        self.trampolined = mutual_tail_calls(root)
+        self.emit(f"def {ENTRY_POINT}():")
+        self.transpile_body(root)
+        self.emit(f"{ENTRY_POINT}()")
+
+        return "\n".join(self.lines) + "\n"
+
+    def transpile_body(self, block, outer_assignments=()):
+        self.indent += 1
+        for name in outer_assignments:
+            self.emit(f"nonlocal {name}")
+
+        if not self.transpile_block(block) and not outer_assignments:
+            self.emit("pass")
+
+        self.indent -= 1
+
+    def transpile_nested_block(self, block):
+        self.indent += 1
+        if not self.transpile_block(block):
+            self.emit("pass")
+
+        self.indent -= 1
+
+    def transpile_block(self, block):
+        count = len(self.lines)
+        for child in block.children:
+            self.transpile_stmt(child)
+
+        return len(self.lines) > count
+
+    # -------------- STATEMENTS --------------
+    def transpile_stmt(self, node):
+        kind = node.kind
+
+        if kind == ASTNodeKind.ast_var_decl:
+            self.emit(f"{python_name(node.name, node.symbol)} = {self.transpile_expr(node.value)}")
+        elif kind == ASTNodeKind.ast_var_assign:
+            self.emit(f"{python_name(node.name, node.symbol)} = {self.transpile_expr(node.value)}")
+        elif kind == ASTNodeKind.ast_fn_decl:
+            self.transpile_function(node)
+        elif kind == ASTNodeKind.ast_if_stmt:
+            self.transpile_if(node)
+        elif kind == ASTNodeKind.ast_while_stmt:
+            self.emit(f"while {self.transpile_expr(node.condition)}:")
+            self.loop_depth += 1
+            self.transpile_nested_block(node.body)
+            self.loop_depth -= 1
+        elif kind == ASTNodeKind.ast_root:
+            self.transpile_block(node)
+        elif kind == ASTNodeKind.ast_return_stmt:
+            if self.is_self_tail_call(node.expr):
+                self.transpile_self_tail_call(node.expr)
+            elif self.is_trampolined_tail_call(node.expr):
+                call = node.expr
+                arguments = "".join(f"{self.transpile_expr(argument)}, " for argument in call.arguments)
+                self.emit(f"return {TAIL_CALL_CLASS}({python_name(call.name, call.symbol)}, ({arguments}))")
+            else:
+                self.emit(f"return {self.transpile_expr(node.expr)}")
+        else:
+            self.emit(self.transpile_expr(node))
+
+    def transpile_function(self, node):
+        symbol = node.symbol
+        # parameters take the first slots of the body's frame, one level down
+        parameters = [f"{name}_{symbol.level + 1}_{slot}" for slot, (name, _) in enumerate(symbol.parameters)]
+
+        self.emit(f"def {python_name(node.name, symbol)}({', '.join(parameters)}):")
+
+        self.level += 1
+        outer_assignments = sorted(collect_outer_assignments(node.body, self.level))
+        outer_tail = (self.tail_symbol, self.tail_parameters, self.loop_depth, self.function_symbol)
+        self.loop_depth = 0
+        self.function_symbol = symbol
+
+        if loops_on_itself(node.body, symbol):
+            # python has no tail calls, returning a call to itself rebinds the
+            # parameters and goes round a loop instead of growing the stack
+            self.tail_symbol = symbol
+            self.tail_parameters = parameters
+            self.indent += 1
+            for name in outer_assignments:
+                self.emit(f"nonlocal {name}")
+
+            self.emit("while True:")
+            self.indent += 1
+            self.transpile_block(node.body)
+            # running off the end returns, it must not go round again
+            self.emit("return None")
+            self.indent -= 2
+        else:
+            self.tail_symbol = None
+            self.tail_parameters = None
+            self.transpile_body(node.body, outer_assignments)
+
+        self.tail_symbol, self.tail_parameters, self.loop_depth, self.function_symbol = outer_tail
+        self.level -= 1
+
+    def is_self_tail_call(self, expr):
+        # a continue inside a python while would only restart that loop
+        return self.tail_symbol is not None and self.loop_depth == 0 and expr.kind == ASTNodeKind.ast_fn_call \
+            and expr.symbol is self.tail_symbol
+
+    def is_trampolined_tail_call(self, expr):
+        # the caller of this function runs the call, so python frames do not pile up
+        return self.function_symbol in self.trampolined and expr.kind == ASTNodeKind.ast_fn_call \
+            and expr.symbol in self.trampolined
+
+    def transpile_self_tail_call(self, call):
+        if call.arguments:
+            # every argument is evaluated before any parameter changes
+            arguments = ", ".join(self.transpile_expr(argument) for argument in call.arguments)
+            self.emit(f"{', '.join(self.tail_parameters)}, = {arguments},")
+
+        self.emit("continue")
+
+    def transpile_if(self, node):
+        keyword = "if"
+        while node is not None:
+            if node.kind == ASTNodeKind.ast_root:
+                # an else branch the optimizer reduced to a plain block
+                self.emit("else:")
+                self.transpile_nested_block(node)
+                return
+
+            self.emit(f"{keyword} {self.transpile_expr(node.condition)}:")
+            self.transpile_nested_block(node.body)
+
+            keyword = "elif"
+            node = node.else_branch
+
+    # -------------- EXPRESSIONS --------------
+    def transpile_expr(self, node):
+        kind = node.kind
+
+        if kind in LITERAL_KINDS:
+            return repr(node.value)
+
+        if kind == ASTNodeKind.ast_id:
+            return python_name(node.value, node.symbol)
+
+        if kind == ASTNodeKind.ast_bin_expr:
+            lhs = self.transpile_expr(node.lhs)
+            rhs = self.transpile_expr(node.rhs)
+
+            if node.op in PYTHON_OPERATORS:
+                return f"({lhs} {PYTHON_OPERATORS[node.op]} {rhs})"
+
+            if node.op == OP_CONCAT:
+                return f"{CONCAT_FUNCTION}({lhs}, {rhs})"
+
+            if node.op in PYTHON_LOGICAL_OPERATORS:
+                keyword, helper = PYTHON_LOGICAL_OPERATORS[node.op]
+                if has_effect(node.rhs):
+                    return f"{helper}({lhs}, {rhs})"
+
+                return f"({lhs} {keyword} {rhs})"
+
+            raise QwrkRuntimeError(node, f"Unknown Operator ({OPERATOR_SPELLINGS.get(node.op, node.op)})")
+
+        if kind == ASTNodeKind.ast_unr_expr:
+            operand = self.transpile_expr(node.stmt)
+            if node.op == OP_NOT:
+                return f"(not {operand})"
+
+            if node.op == OP_NEG:
+                return f"(-{operand})"
+
+            raise QwrkRuntimeError(node, f"Unknown unary operator ({OPERATOR_SPELLINGS.get(node.op, node.op)})")
+
+        if kind == ASTNodeKind.ast_fn_call:
+            arguments = ", ".join(self.transpile_expr(argument) for argument in node.arguments)
+            if node.symbol in self.trampolined:
+                return f"{RUN_FUNCTION}({python_name(node.name, node.symbol)}{', ' if arguments else ''}{arguments})"
+
+            return f"{python_name(node.name, node.symbol)}({arguments})"
+
+        if kind == ASTNodeKind.ast_echo_builtin:
+            return f"{ECHO_FUNCTION}({self.transpile_expr(node.value)})"
+
+        raise QwrkRuntimeError(node, f"Cannot transpile node ({AST_NODE_KIND_NAMES[kind]})")
+
+def loops_on_itself(block, symbol):
+    # Whether the body returns a call to itself outside any while loop. A body
+    # that declares functions is left recursive, closures made in one round
+    # would see the parameters of the next.
+    found = False
+    stack = [(child, False) for child in block.children]
+
+    while stack:
+        node, in_loop = stack.pop()
+        kind = node.kind
+
+        if kind == ASTNodeKind.ast_fn_decl:
+            return False
+        elif kind == ASTNodeKind.ast_return_stmt:
+            expr = node.expr
+            if not in_loop and expr is not None and expr.kind == ASTNodeKind.ast_fn_call and expr.symbol is symbol:
+                found = True
+        elif kind == ASTNodeKind.ast_if_stmt:
+            stack.extend((child, in_loop) for child in node.body.children)
+            if node.else_branch is not None:
+                stack.append((node.else_branch, in_loop))
+        elif kind == ASTNodeKind.ast_while_stmt:
+            stack.extend((child, True) for child in node.body.children)
+        elif kind == ASTNodeKind.ast_root:
+            stack.extend((child, in_loop) for child in node.children)
+
+    return found
+
+def tail_calls(block):
+    # the functions a body returns a call to, its nested functions aside
+    callees = set()
+    stack = list(block.children)
+
+    while stack:
+        node = stack.pop()
+        kind = node.kind
+
+        if kind == ASTNodeKind.ast_return_stmt:
+            if node.expr is not None and node.expr.kind == ASTNodeKind.ast_fn_call:
+                callees.add(node.expr.symbol)
+        elif kind == ASTNodeKind.ast_if_stmt:
+            stack.extend(node.body.children)
+            if node.else_branch is not None:
+                stack.append(node.else_branch)
+        elif kind == ASTNodeKind.ast_while_stmt:
+            stack.extend(node.body.children)
+        elif kind == ASTNodeKind.ast_root:
+            stack.extend(node.children)
+
+    return callees
+
+def mutual_tail_calls(root):
+    # The functions on a cycle of tail calls through some other function. A
+    # function that only tail calls itself loops instead, see loops_on_itself.
+    graph = {node.symbol: tail_calls(node.body) for node in iter_nodes(root) if node.kind == ASTNodeKind.ast_fn_decl}
+    for symbol, callees in graph.items():
+        callees.discard(symbol)
+
+    cyclic = set()
+    for symbol in graph:
+        seen = set()
+        stack = list(graph[symbol])
+        while stack:
+            callee = stack.pop()
+            if callee is symbol:
+                cyclic.add(symbol)
+                break
+
+            if callee not in seen:
+                seen.add(callee)
+                stack.extend(graph.get(callee, ()))
+
+    return cyclic
+
+def collect_outer_assignments(block, level):
+    # names a function assigns in an enclosing frame need a nonlocal
+    names = set()
+    stack = list(block.children)
+
+    while stack:
+        node = stack.pop()
+        kind = node.kind
+
+        if kind == ASTNodeKind.ast_var_assign:
+            if node.symbol.level < level:
+                names.add(python_name(node.name, node.symbol))
+        elif kind == ASTNodeKind.ast_if_stmt:
+            stack.extend(node.body.children)
+            if node.else_branch is not None:
+                stack.append(node.else_branch)
+        elif kind == ASTNodeKind.ast_while_stmt:
+            stack.extend(node.body.children)
+        elif kind == ASTNodeKind.ast_root:
+            stack.extend(node.children)
+
+    return names
+
+def nested_too_deeply(error=None):
+    detail = f" ({error.msg})" if isinstance(error, SyntaxError) else ""
+    return QwrkRuntimeError(None, f"Calls or expressions nested too deeply for the python engine{detail}")
+
+def transpile(ast_root):
+    # expressions are translated recursively, a tall one runs out of python frames
+    transpiler = Transpiler()
+    try:
+        return transpiler.transpile_program(ast_root)
+    except RecursionError:
+        raise nested_too_deeply() from None
+
+def run_python(source, output=None):
+    if output is None:
+        output = StreamSink()
+
+    namespace = {"_qwrk_and": _qwrk_and, "_qwrk_or": _qwrk_or, CONCAT_FUNCTION: concat, ECHO_FUNCTION: output.echo,
+                 TAIL_CALL_CLASS: _QwrkTailCall, RUN_FUNCTION: _qwrk_run}
+    try:
+        # python limits how deeply parentheses and blocks nest in source
+        code = compile(source, "<qwrk>", "exec")
+    except (RecursionError, SyntaxError) as error:
+        raise nested_too_deeply(error) from None
+
+    try:
+        exec(code, namespace)
+    except RecursionError:
+        # calls that are not tail calls still nest python frames
+        raise nested_too_deeply() from None